@@ -0,0 +1,113 @@
+"""
+Reconciliation of the allowance events with the backend payment tables (Modak Challenge).
+
+Importing the package has no side effects: the submodules (and pandas) are only imported when one of
+their names is first accessed, e.g. `from modak_challenge import calculate_next_ocurrence` only loads
+the standard-library schedule module.
+
+Modules:
+    schedule: reference (row by row) schedule functions, without pandas.
+    schedule_engine: vectorized schedule engine and calendar index.
+    loading: loaders and type conversions of the input files.
+    cache: typed columnar cache of the tables.
+    concurrent_loading: concurrent loading of the input tables, with the errors of each source.
+    keys: dictionary encoding of the user ids shared by the tables.
+    joins: index-based semi, anti and left joins on the user ids.
+    analysis: comparison with the backend tables and categorization of the discrepancies.
+    duplicates: detection of duplicate events.
+    incremental: incremental reconciliation of the users with new events.
+    backfill: reconciliation over a range of as-of dates.
+    parallel: per-user stages sharded by user id in a process pool.
+    sql_engine: out-of-core reconciliation on an embedded SQLite database.
+    external_sort: chunked out-of-core reconciliation over external sorts of the tables by user.
+    service: long-running reconciliation service with the per-user state in memory.
+    streaming: tail-following reconciliation of an append-only NDJSON events file.
+    sinks: CSV, Parquet and Arrow IPC output writers, optionally partitioned.
+    instrumentation: stage-level spans and JSON run reports.
+    synthetic: seeded generator of synthetic input files.
+    benchmark: scaling benchmarks of the stages over synthetic data.
+    pipeline: stages of the pipeline and the full run.
+    cli: command line entry point.
+"""
+
+import importlib
+
+
+# Public names and the module that defines each of them
+_EXPORTS = {
+    "LIMIT_DATE": "schedule",
+    "WEEK_DAYS_MAP": "schedule",
+    "calculate_next_ocurrence": "schedule",
+    "calculate_incremented_date": "schedule",
+    "calculate_next_ocurrence_vectorized": "schedule_engine",
+    "calculate_incremented_date_vectorized": "schedule_engine",
+    "build_schedule_calendar": "schedule_engine",
+    "load_schedule_calendar": "schedule_engine",
+    "load_initial_file": "loading",
+    "iter_events_chunks": "loading",
+    "read_events": "loading",
+    "parse_events": "loading",
+    "parse_mixed_timestamps": "loading",
+    "convert_backend_types": "loading",
+    "convert_payment_types": "loading",
+    "load_cached_table": "cache",
+    "read_cached_table": "cache",
+    "load_input_tables": "concurrent_loading",
+    "InputLoadError": "concurrent_loading",
+    "encode_tables": "keys",
+    "build_key_index": "joins",
+    "semi_join": "joins",
+    "anti_join": "joins",
+    "left_join": "joins",
+    "remove_disabled_users": "analysis",
+    "latest_events_per_user": "analysis",
+    "compare_with_backend": "analysis",
+    "classify_rows": "analysis",
+    "flag_discrepancies": "analysis",
+    "aggregate_payment_schedule": "analysis",
+    "summarize_payment_schedule": "analysis",
+    "expand_payment_summary": "analysis",
+    "detect_duplicate_events": "duplicates",
+    "run_incremental_reconciliation": "incremental",
+    "latest_events_as_of": "backfill",
+    "backfill_reconciliation": "backfill",
+    "summarize_backfill": "backfill",
+    "reconcile_in_parallel": "parallel",
+    "write_output": "sinks",
+    "run_sql_reconciliation": "sql_engine",
+    "SortedRuns": "external_sort",
+    "run_external_reconciliation": "external_sort",
+    "generate_dataset": "synthetic",
+    "start_run_report": "instrumentation",
+    "span": "instrumentation",
+    "finish_run_report": "instrumentation",
+    "run_benchmarks": "benchmark",
+    "load_backend_table": "pipeline",
+    "load_payment_table": "pipeline",
+    "analyze_disabled_users": "pipeline",
+    "analyze_latest_events": "pipeline",
+    "analyze_discrepancies": "pipeline",
+    "analyze_payment_schedule": "pipeline",
+    "analyze_payment_summary": "pipeline",
+    "analyze_duplicate_events": "pipeline",
+    "run_pipeline": "pipeline",
+    "run_backfill": "pipeline",
+    "run_service": "pipeline",
+    "run_stream": "pipeline",
+    "ReconciliationService": "service",
+    "StreamingReconciler": "streaming",
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f".{_EXPORTS[name]}", __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,325 @@
+"""
+Stages of the reconciliation: disabled users, comparison with the backend tables and categorization of the discrepancies.
+"""
+
+import numpy as np #For the rule engine of the categorizations.
+import pandas as pd #For data manipulation and analysis.
+
+from .joins import anti_join, left_join, lookup_slots, table_key_index
+from .schedule_engine import calculate_incremented_date_vectorized
+
+
+def remove_disabled_users(df_events, df_backend):
+    """
+    Removes the events of users with 'disabled' status in the backend table.
+
+    Args:
+        df_events (pd.DataFrame): Typed events table.
+        df_backend (pd.DataFrame): Typed backend table.
+
+    Returns:
+        pd.DataFrame: Events of enabled users, with a clean sequential index.
+    """
+    # Anti-join with the disabled rows of the backend key index
+    disabled = (df_backend["status"] == "disabled").to_numpy(dtype=bool)
+    enabled_events = anti_join(df_events["user.id"], table_key_index(df_backend, "uuid"), rows=disabled)
+    return df_events[enabled_events].reset_index(drop=True)
+
+
+def latest_events_per_user(df_events, n=1, presorted=False):
+    """
+    Group reduction returning the latest event (or the `n` latest events) of each user in a single pass.
+
+    - n = 1: one hash-based argmax pass over event.timestamp per user, with no sort of the events table.
+      Ties on the latest timestamp keep the first of them in table order (as sorting by timestamp and
+      dropping duplicates did).
+    - n > 1: the table is sorted once by user.id and event.timestamp (stable, skipped when `presorted`)
+      and the last `n` rows of each user are kept, so later stages can reuse the sorted result.
+
+    Args:
+        df_events (pd.DataFrame): Events table.
+        n (int): Number of latest events to keep per user.
+        presorted (bool): The table is already sorted by user.id and event.timestamp.
+
+    Returns:
+        pd.DataFrame: For n = 1 one row per user (its latest event) sorted by user.id; for n > 1 the
+        `n` latest events of each user, sorted by user.id and event.timestamp.
+    """
+    if n == 1:
+        # Missing timestamps are the oldest events, as they were sorted last in descending order
+        timestamps = df_events['event.timestamp'].fillna(pd.Timestamp.min).to_numpy()
+        # Grouped by the array of the ids (the codes of encoded ids), without materializing Python strings
+        latest = pd.Series(timestamps).groupby(df_events['user.id'].array, sort=True, observed=True).idxmax()
+        return df_events.iloc[latest.to_numpy()].reset_index(drop=True)
+
+    if not presorted:
+        df_events = df_events.sort_values(by=['user.id', 'event.timestamp'], kind='stable')
+    from_latest = df_events.groupby('user.id', sort=False, observed=True).cumcount(ascending=False)
+    return df_events[(from_latest < n).to_numpy()].reset_index(drop=True)
+
+
+def compare_with_backend(df_events_latest, df_backend, calendar=None):
+    """
+    Comparative analysis of the event-based payment dates and the backend system dates.
+
+    Merges the latest event of each user (with its 'next_expected_payment_date') with the backend table and adds:
+    - 'is_next_payment_day_correct': next_expected_payment_date matches the backend next_payment_day.
+    - 'timestamp_diff': difference between the event timestamp and the backend updated_at.
+    - 'next_payment_day_from_updated_at': next payment day calculated from updated_at.
+    - 'match_with_updated_at': next_payment_day_from_updated_at matches the backend next_payment_day.
+
+    Args:
+        df_events_latest (pd.DataFrame): Latest event per user, with 'next_expected_payment_date'.
+        df_backend (pd.DataFrame): Typed backend table.
+        calendar (dict, optional): Schedule calendar to look next_payment_day_from_updated_at up in.
+
+    Returns:
+        pd.DataFrame: The merged table with the comparison columns.
+    """
+    # Left join to keep all events, even those without a match in the backend
+    df_events_merged = left_join(df_events_latest, 'user.id', df_backend, 'uuid')
+
+    df_events_merged['next_payment_day'] = df_events_merged['next_payment_day'].fillna(0).astype(int).astype(str).str.zfill(2)
+
+    # Creating new column with comparison results
+    df_events_merged['is_next_payment_day_correct'] = (
+        df_events_merged['next_expected_payment_date'] == df_events_merged['next_payment_day']
+    )
+
+    # Calculating the timestamp difference between the backend and events tables
+    df_events_merged['timestamp_diff'] = df_events_merged['event.timestamp'] - df_events_merged['updated_at']
+
+    # Day of the month of the next payment calculated from updated_at (masked when it can't be calculated)
+    next_payment_day_from_updated_at = calculate_incremented_date_vectorized(
+        df_events_merged["updated_at"],
+        df_events_merged["frequency"],
+        df_events_merged["day"],
+        calendar=calendar
+    )
+
+    # Keeping the same 'dd' format used by next_payment_day and next_expected_payment_date
+    df_events_merged["next_payment_day_from_updated_at"] = pd.Series(
+        next_payment_day_from_updated_at, index=df_events_merged.index
+    ).astype("string").str.zfill(2)
+
+    # Comparison between fields 'next_payment_day' from backend and new calculated field 'next_payment_day_from_updated_at'
+    df_events_merged['match_with_updated_at'] = (
+        df_events_merged['next_payment_day'].astype(int).to_numpy() == next_payment_day_from_updated_at
+    ).fillna(False).to_numpy(dtype=bool)
+
+    return df_events_merged
+
+
+def classify_rows(df, rules, default):
+    """
+    Declarative classification engine: labels every row of `df` with the first rule whose predicate holds.
+    Predicates are evaluated once over whole columns as boolean masks and dispatched with np.select,
+    so adding a category is adding a rule, not another pass over the rows.
+
+    Args:
+        df (pd.DataFrame): Table to classify.
+        rules (list of tuple): (label, predicate) pairs, in priority order. A predicate receives `df`
+                               and returns a boolean mask over its rows (missing values count as False).
+        default (str): Label of the rows that match no rule.
+
+    Returns:
+        pd.Categorical: The label of each row, with the rule labels and the default as categories.
+    """
+    labels = [label for label, _ in rules] + [default]
+    categories = list(dict.fromkeys(labels))
+    label_codes = np.array([categories.index(label) for label in labels])
+
+    # Position of the first matching rule of each row (len(rules) when none matches)
+    conditions = [pd.array(predicate(df), dtype="boolean").fillna(False).to_numpy(dtype=bool) for _, predicate in rules]
+    if conditions:
+        matched_rule = np.select(conditions, np.arange(len(rules)), default=len(rules))
+    else:
+        matched_rule = np.zeros(len(df), dtype=np.int64)
+
+    return pd.Categorical.from_codes(label_codes[matched_rule], categories=categories)
+
+
+def _days_mismatch(df):
+    """Rows where the backend next_payment_day matches updated_at but not the event-based day."""
+    return df['match_with_updated_at'].to_numpy(dtype=bool) & ~df['is_next_payment_day_correct'].to_numpy(dtype=bool)
+
+
+# Rules of 'reason_of_discrepancy', evaluated in order: a discrepancy where the backend day matches updated_at is a
+# 'backend logic issues' when the event and updated_at are less than 1 day apart, otherwise a 'timestamp delay issue'
+DISCREPANCY_RULES = [
+    ('backend logic issues', lambda df: _days_mismatch(df) & (df['timestamp_diff'].abs() < pd.Timedelta(days=1)).to_numpy(dtype=bool)),
+    ('timestamp delay issue', _days_mismatch)
+]
+
+# Rules of 'payment_date_status', evaluated in order (the users without payment rows have no payment_date)
+PAYMENT_DATE_STATUS_RULES = [
+    ('no payment rows', lambda df: df['payment_date'].isna().to_numpy()),
+    ('backend error - logic', lambda df: (df['payment_date'] == df['next_payment_day']) & (df['payment_date'] != df['next_expected_payment_date'])),
+    ('backend error - timestamp', lambda df: (df['payment_date'] != df['next_payment_day']) & (df['payment_date'] == df['next_expected_payment_date'])),
+    ('unknown error', lambda df: (df['payment_date'] != df['next_payment_day']) & (df['payment_date'] != df['next_expected_payment_date']))
+]
+
+
+def flag_discrepancies(df_events_merged):
+    """
+    Keeps the rows of the comparative analysis with a discrepancy and adds 'reason_of_discrepancy'
+    to the rows where the backend day matches updated_at but not the event-based day.
+
+    Args:
+        df_events_merged (pd.DataFrame): Result of `compare_with_backend`.
+
+    Returns:
+        pd.DataFrame: Rows where 'match_with_updated_at' and 'is_next_payment_day_correct' are not both True.
+    """
+    # Removing rows where 'match_with_updated_at' is True and 'is_next_payment_day_correct' is True
+    df_events_adjusted = df_events_merged[~((df_events_merged['match_with_updated_at'] == True) &
+                                          (df_events_merged['is_next_payment_day_correct'] == True))].copy()
+
+    # Adding reason_of_discrepancy only to rows where match_with_updated_at is True and is_next_payment_day_correct is False
+    df_events_adjusted['reason_of_discrepancy'] = classify_rows(df_events_adjusted, DISCREPANCY_RULES, default='')
+
+    return df_events_adjusted
+
+
+def _day_number(series):
+    """Day column as integers, through its two-digit text (as the payment dates are compared)."""
+    return series.astype(str).str.zfill(2).astype(int)
+
+
+# Columns of the per-user payment schedule summary output
+PAYMENT_SUMMARY_COLUMNS = [
+    'user_id', 'payment_rows', 'payment_dates', 'first_payment_date', 'last_payment_date',
+    'next_payment_day', 'next_expected_payment_date', 'payment_schedule_status'
+]
+
+# Rules of 'payment_schedule_status', evaluated in order: users without payment rows and users with several
+# payment rows are categories of their own, and the single payment_date of the other users gets the rules
+# of 'payment_date_status'
+PAYMENT_SCHEDULE_STATUS_RULES = [
+    ('no payment rows', lambda df: df['payment_rows'].to_numpy() == 0),
+    ('duplicate payment rows', lambda df: df['payment_rows'].to_numpy() > 1)
+] + PAYMENT_DATE_STATUS_RULES[1:]
+
+
+def aggregate_payment_schedule(df_payment):
+    """
+    Compact form of the payment schedule table: one row per user with payment rows, read from the key index
+    of the table (its rows grouped by user in table order), so duplicated users don't multiply later joins.
+
+    Args:
+        df_payment (pd.DataFrame): Typed payment schedule table.
+
+    Returns:
+        pd.DataFrame: 'user_id' (encoded over the same dictionary when the table is), 'payment_rows' (number of
+        rows), 'payment_dates' (distinct payment dates, ascending, joined by '|'), 'first_payment_date' and
+        'last_payment_date' (of the first and last rows in table order).
+    """
+    index = table_key_index(df_payment, 'user_id')
+    # Rows without a user id (the last slot) never match
+    counts = index['counts'][:-1]
+    users = np.flatnonzero(counts)
+    starts = index['starts'][users]
+    dates = df_payment['payment_date'].to_numpy()[index['order']]
+
+    # Distinct dates of the users with several rows; a single row is its own set
+    payment_dates = dates[starts].astype(str).astype(object)
+    several = np.flatnonzero(counts[users] > 1)
+    if len(several):
+        slots = index['slots'][index['order']]
+        repeated = np.isin(slots, users[several])
+        df_distinct = pd.DataFrame({'slot': slots[repeated], 'date': dates[repeated]}).drop_duplicates().sort_values(['slot', 'date'])
+        joined = df_distinct.groupby('slot', sort=True)['date'].agg(lambda values: '|'.join(map(str, values)))
+        payment_dates[several] = joined.loc[users[several]].to_numpy()
+
+    dictionary = index['dictionary']
+    if isinstance(df_payment['user_id'].dtype, pd.CategoricalDtype):
+        user_ids = pd.Categorical.from_codes(users, categories=dictionary)
+    else:
+        user_ids = pd.array(dictionary[users], dtype=df_payment['user_id'].dtype)
+
+    return pd.DataFrame({
+        'user_id': user_ids,
+        'payment_rows': counts[users],
+        'payment_dates': payment_dates,
+        'first_payment_date': dates[starts],
+        'last_payment_date': dates[starts + counts[users] - 1]
+    })
+
+
+def summarize_payment_schedule(df_events_merged, df_payment_aggregate):
+    """
+    Joins the comparative analysis with the aggregated payment schedule (one row per user, see
+    `aggregate_payment_schedule`) and categorizes each user once in 'payment_schedule_status'.
+
+    Args:
+        df_events_merged (pd.DataFrame): Result of `compare_with_backend`.
+        df_payment_aggregate (pd.DataFrame): Result of `aggregate_payment_schedule`.
+
+    Returns:
+        pd.DataFrame: 'user.id' and PAYMENT_SUMMARY_COLUMNS of every row of df_events_merged. The users without
+        payment rows have 0 'payment_rows' and no payment dates.
+    """
+    df_summary = left_join(
+        df_events_merged[['user.id', 'next_payment_day', 'next_expected_payment_date']],
+        'user.id',
+        df_payment_aggregate,
+        'user_id',
+        columns=['payment_rows', 'payment_dates', 'first_payment_date', 'last_payment_date']
+    )
+    for column in ('next_payment_day', 'next_expected_payment_date'):
+        df_summary[column] = _day_number(df_summary[column])
+
+    # The users without payment rows keep the id of their events, with missing payment dates
+    df_summary['user_id'] = df_summary['user.id']
+    df_summary['payment_rows'] = df_summary['payment_rows'].fillna(0).astype(int)
+    for column in ('first_payment_date', 'last_payment_date'):
+        df_summary[column] = df_summary[column].astype('Int64')
+
+    # The rules of a single payment row read it as 'payment_date'
+    df_summary['payment_date'] = df_summary['first_payment_date']
+    df_summary['payment_schedule_status'] = classify_rows(df_summary, PAYMENT_SCHEDULE_STATUS_RULES, default='correct payment date')
+
+    return df_summary[['user.id'] + PAYMENT_SUMMARY_COLUMNS]
+
+
+# Columns of the payment schedule discrepancy output
+PAYMENT_STATUS_COLUMNS = ['user_id', 'payment_date', 'next_payment_day', 'next_expected_payment_date', 'payment_date_status']
+
+
+def expand_payment_summary(df_summary, df_payment):
+    """
+    Categorizes each payment_date in 'payment_date_status', one row per payment row of each user, from the
+    per-user summary instead of joining the comparative analysis with the whole payment schedule table again.
+    A user with a single payment row (or none) keeps the row of the summary; only the users with duplicate
+    payment rows are expanded, with their payment dates gathered from the key index of the table.
+
+    Args:
+        df_summary (pd.DataFrame): Result of `summarize_payment_schedule`.
+        df_payment (pd.DataFrame): Typed payment schedule table the summary was aggregated from.
+
+    Returns:
+        pd.DataFrame: 'user.id' and PAYMENT_STATUS_COLUMNS, in the order of the summary and, for each user, of
+        the payment schedule table. The users without payment rows have a single row without payment_date.
+    """
+    payment_rows = df_summary['payment_rows'].to_numpy()
+    repeats = np.maximum(payment_rows, 1)
+    summary_rows = np.repeat(np.arange(len(df_summary)), repeats)
+
+    df_status = df_summary[['user.id', 'user_id', 'next_payment_day', 'next_expected_payment_date']].iloc[summary_rows].reset_index(drop=True)
+    payment_dates = df_summary['first_payment_date'].array.take(summary_rows)
+
+    # Rows of the users with several payment rows, in the order of the table
+    several = np.flatnonzero(payment_rows > 1)
+    if len(several):
+        index = table_key_index(df_payment, 'user_id')
+        slots = lookup_slots(index, df_summary['user_id'].iloc[several])
+        counts = payment_rows[several]
+        match_number = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        first_rows = (np.cumsum(repeats) - repeats)[several]
+        table_rows = index['order'][np.repeat(index['starts'][slots], counts) + match_number]
+        payment_dates[np.repeat(first_rows, counts) + match_number] = df_payment['payment_date'].to_numpy()[table_rows]
+
+    df_status['payment_date'] = payment_dates
+    df_status['payment_date_status'] = classify_rows(df_status, PAYMENT_DATE_STATUS_RULES, default='correct payment date')
+
+    return df_status[['user.id'] + PAYMENT_STATUS_COLUMNS]
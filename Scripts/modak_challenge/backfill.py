@@ -0,0 +1,119 @@
+"""
+Backfill of the reconciliation over a range of as-of dates.
+
+Instead of running the pipeline once per as-of date, the latest event of every user is found for all
+the dates at once over a (user x as-of date) grid, and the schedule calculation and the comparison with
+the backend table run once over the whole grid.
+"""
+
+import numpy as np #For the searches over the (user x as-of date) grid.
+import pandas as pd #For data manipulation and analysis.
+
+from .analysis import DISCREPANCY_RULES, classify_rows, compare_with_backend, remove_disabled_users
+from .schedule_engine import calculate_next_ocurrence_vectorized
+
+
+# Rules of 'reason_of_discrepancy' in the backfill, which keeps the rows without discrepancy
+BACKFILL_DISCREPANCY_RULES = [
+    ('no discrepancy', lambda df: df['match_with_updated_at'].to_numpy(dtype=bool) & df['is_next_payment_day_correct'].to_numpy(dtype=bool))
+] + DISCREPANCY_RULES
+
+# Columns of the backfill output
+BACKFILL_COLUMNS = [
+    'user.id', 'as_of_date', 'event.timestamp', 'allowance.scheduled.frequency', 'allowance.scheduled.day',
+    'next_expected_payment_date', 'next_payment_day', 'next_payment_day_from_updated_at',
+    'is_next_payment_day_correct', 'match_with_updated_at', 'reason_of_discrepancy'
+]
+
+
+def latest_events_as_of(df_events, as_of_dates):
+    """
+    Latest event of each user as known at the end of each as-of date, for all the dates in one pass.
+
+    Events and as-of dates are ranked over a shared timestamp domain, so each (user, timestamp) pair becomes
+    a single sortable integer key. After one sort of the events, the latest event of every (user, as-of date)
+    cell of the grid is a binary search for the cell key. Ties keep the first event in table order, as in
+    `latest_events_per_user`.
+
+    Args:
+        df_events (pd.DataFrame): Typed events table.
+        as_of_dates (array-like of datetime): As-of dates; events up to the end of each day are known.
+
+    Returns:
+        pd.DataFrame: The latest event of each user per as-of date, with the 'as_of_date' column.
+                      Users without events up to an as-of date have no row for it.
+    """
+    as_of = np.unique(pd.to_datetime(pd.Series(as_of_dates, copy=False)).to_numpy(dtype="datetime64[ns]"))
+    cutoff = as_of.astype("datetime64[D]").astype("datetime64[ns]") + np.timedelta64(1, "D")
+
+    user_codes, users = pd.factorize(df_events["user.id"])
+    timestamps = df_events["event.timestamp"].to_numpy(dtype="datetime64[ns]")
+    rows = np.flatnonzero((user_codes >= 0) & ~np.isnat(timestamps))
+
+    # Shared ranks of the event timestamps and of the cutoffs, and one integer key per (user, rank)
+    domain = np.unique(np.concatenate([timestamps[rows], cutoff]))
+    width = len(domain)
+    keys = user_codes[rows].astype(np.int64) * width + np.searchsorted(domain, timestamps[rows])
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+
+    # Last event strictly before the cutoff of each cell, moved back to the first event with the same timestamp
+    grid_users = np.repeat(np.arange(len(users), dtype=np.int64), len(as_of))
+    grid_dates = np.tile(np.arange(len(as_of)), len(users))
+    position = np.searchsorted(sorted_keys, grid_users * width + np.searchsorted(domain, cutoff)[grid_dates]) - 1
+    found = position >= 0
+    found[found] = sorted_keys[position[found]] // width == grid_users[found]
+    first = np.searchsorted(sorted_keys, sorted_keys[position[found]])
+
+    df_latest = df_events.iloc[rows[order[first]]].reset_index(drop=True)
+    df_latest.insert(1, "as_of_date", as_of[grid_dates[found]])
+    return df_latest
+
+
+def backfill_reconciliation(df_events, df_backend, as_of_dates, calendar=None):
+    """
+    Expected next payment days and discrepancy categories of every user for every as-of date.
+
+    Disabled users are removed, the latest event of each user per as-of date comes from `latest_events_as_of`,
+    and 'next_expected_payment_date' is calculated with each row's as-of date as the limit date, in a single
+    vectorized call over the grid. The comparison with the backend table is the same as in a full run.
+
+    Args:
+        df_events (pd.DataFrame): Typed events table.
+        df_backend (pd.DataFrame): Typed backend table.
+        as_of_dates (array-like of datetime): As-of dates of the backfill.
+        calendar (dict, optional): Schedule calendar to look next_payment_day_from_updated_at up in.
+
+    Returns:
+        pd.DataFrame: One row per user and as-of date (BACKFILL_COLUMNS), with 'reason_of_discrepancy'
+                      'no discrepancy' when both comparisons match.
+    """
+    df_grid = latest_events_as_of(remove_disabled_users(df_events, df_backend), as_of_dates)
+
+    df_grid["next_expected_payment_date"] = calculate_next_ocurrence_vectorized(
+        df_grid["event.timestamp"],
+        df_grid["allowance.scheduled.frequency"],
+        df_grid["allowance.scheduled.day"],
+        limit_date=df_grid["as_of_date"]
+    )
+
+    df_grid = compare_with_backend(df_grid, df_backend, calendar)
+    df_grid["reason_of_discrepancy"] = classify_rows(df_grid, BACKFILL_DISCREPANCY_RULES, default='unclassified discrepancy')
+
+    return df_grid[BACKFILL_COLUMNS]
+
+
+def summarize_backfill(df_backfill):
+    """
+    Number of users in each discrepancy category per as-of date.
+
+    Args:
+        df_backfill (pd.DataFrame): Result of `backfill_reconciliation`.
+
+    Returns:
+        pd.DataFrame: One row per as-of date with the number of users and the count of each category.
+    """
+    summary = pd.crosstab(df_backfill["as_of_date"], df_backfill["reason_of_discrepancy"], dropna=False)
+    summary.columns = summary.columns.astype(str)
+    summary.insert(0, "users", summary.sum(axis=1))
+    return summary.reset_index().rename_axis(columns=None)
@@ -0,0 +1,195 @@
+"""
+Scaling benchmarks of the pipeline stages over synthetic data.
+
+For each size tier (a multiple of the users in the sample files) a seeded synthetic dataset is generated,
+every stage is timed (best of `repeat` runs) and its peak memory is measured with tracemalloc in a separate
+run (tracing slows the stages down), and the results are stored as JSON. A previous results file can be
+given as baseline to flag the stages that got slower.
+"""
+
+import json #For the results file.
+import os #For the datasets of the tiers.
+import platform #For the environment of the results.
+import time #For timing the stages.
+import tracemalloc #For the peak memory of the stages.
+from datetime import datetime, timezone #For the date of the results.
+
+import numpy as np #For the versions in the results.
+import pandas as pd #For data manipulation and analysis.
+
+from .analysis import (
+    aggregate_payment_schedule,
+    compare_with_backend,
+    expand_payment_summary,
+    flag_discrepancies,
+    latest_events_per_user,
+    remove_disabled_users,
+    summarize_payment_schedule
+)
+from .concurrent_loading import INPUT_SOURCES, load_input_tables
+from .loading import read_events
+from .pipeline import analyze_duplicate_events, load_backend_table, load_calendar, load_payment_table
+from .schedule_engine import calculate_next_ocurrence_vectorized
+from .synthetic import SAMPLE_USERS, generate_dataset
+
+
+def _next_expected_payment_dates(ctx):
+    """Adds 'next_expected_payment_date' to a copy of the latest events (the stage can run several times)."""
+    df_events_latest = ctx["latest_events"].copy()
+    df_events_latest["next_expected_payment_date"] = calculate_next_ocurrence_vectorized(
+        df_events_latest["event.timestamp"],
+        df_events_latest["allowance.scheduled.frequency"],
+        df_events_latest["allowance.scheduled.day"],
+        calendar=ctx["calendar"]
+    )
+    return df_events_latest
+
+
+# Stages of the pipeline, in order: each one receives the results of the previous ones (by stage name)
+BENCHMARK_STAGES = [
+    ("load_events", lambda ctx: read_events(ctx["paths"]["events"])),
+    ("load_backend", lambda ctx: load_backend_table(ctx["paths"]["backend"], verbose=False)),
+    ("load_payment", lambda ctx: load_payment_table(ctx["paths"]["payment"], verbose=False)),
+    ("load_inputs_concurrent", lambda ctx: load_input_tables(
+        {source: ctx["paths"][source] for source in INPUT_SOURCES}, log=lambda *args: None
+    )),
+    ("calendar", lambda ctx: load_calendar(None, ctx["load_events"]["event.timestamp"], ctx["load_backend"]["updated_at"])),
+    ("remove_disabled_users", lambda ctx: remove_disabled_users(ctx["load_events"], ctx["load_backend"])),
+    ("latest_events", lambda ctx: latest_events_per_user(ctx["remove_disabled_users"])),
+    ("schedule", _next_expected_payment_dates),
+    ("compare_with_backend", lambda ctx: compare_with_backend(ctx["schedule"], ctx["load_backend"], ctx["calendar"])),
+    ("flag_discrepancies", lambda ctx: flag_discrepancies(ctx["compare_with_backend"])),
+    ("payment_summary", lambda ctx: summarize_payment_schedule(ctx["compare_with_backend"], aggregate_payment_schedule(ctx["load_payment"]))),
+    ("payment_schedule", lambda ctx: expand_payment_summary(ctx["payment_summary"], ctx["load_payment"])),
+    ("duplicates", lambda ctx: analyze_duplicate_events(ctx["load_events"], verbose=False))
+]
+
+
+def _run_stages(paths, trace_memory=False):
+    """
+    Runs the stages once over the files in `paths`.
+
+    Returns:
+        dict: Seconds (or peak memory in MB, when `trace_memory`) of each stage.
+    """
+    ctx = {"paths": paths}
+    measures = {}
+    for name, stage in BENCHMARK_STAGES:
+        if trace_memory:
+            tracemalloc.start()
+            ctx[name] = stage(ctx)
+            measures[name] = tracemalloc.get_traced_memory()[1] / 2 ** 20
+            tracemalloc.stop()
+        else:
+            start = time.perf_counter()
+            ctx[name] = stage(ctx)
+            measures[name] = time.perf_counter() - start
+    return measures
+
+
+def benchmark_tier(paths, repeat=3):
+    """
+    Times and measures the peak memory of every stage over one dataset.
+
+    Args:
+        paths (dict): Paths of the input files ('events', 'backend' and 'payment').
+        repeat (int): Number of timed runs (the fastest one is kept).
+
+    Returns:
+        dict: {stage: {'seconds': ..., 'peak_memory_mb': ...}}.
+    """
+    timings = [_run_stages(paths) for _ in range(repeat)]
+    memory = _run_stages(paths, trace_memory=True)
+    return {
+        name: {
+            "seconds": round(min(run[name] for run in timings), 6),
+            "peak_memory_mb": round(memory[name], 3)
+        }
+        for name, _ in BENCHMARK_STAGES
+    }
+
+
+def run_benchmarks(tiers=(1, 10), seed=0, work_dir=".benchmark", results_file="benchmark_results.json", repeat=3, log=print):
+    """
+    Runs the benchmarks of every size tier and writes the results file.
+
+    Args:
+        tiers (iterable of int): Size tiers, as multiples of the users in the sample files.
+        seed (int): Seed of the synthetic data.
+        work_dir (str): Directory of the synthetic datasets (reused when they already exist).
+        results_file (str): Path to the JSON results file.
+        repeat (int): Number of timed runs of each tier.
+        log (callable): Function used to report the progress.
+
+    Returns:
+        dict: The results, as written to `results_file`.
+    """
+    results = {
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "seed": seed,
+        "repeat": repeat,
+        "environment": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count()
+        },
+        "tiers": []
+    }
+
+    for tier in tiers:
+        dataset_dir = os.path.abspath(os.path.join(work_dir, f"tier_{tier}_seed_{seed}"))
+        manifest_path = os.path.join(dataset_dir, "dataset.json")
+        if os.path.exists(manifest_path):
+            with open(manifest_path, "r", encoding="utf-8") as f:
+                dataset = json.load(f)
+        else:
+            log(f"Generating tier {tier} ({tier * SAMPLE_USERS} users) in {dataset_dir}")
+            dataset = generate_dataset(dataset_dir, n_users=tier * SAMPLE_USERS, seed=seed)
+            with open(manifest_path, "w", encoding="utf-8") as f:
+                json.dump(dataset, f, indent=2)
+
+        stages = benchmark_tier(dataset, repeat)
+        total = sum(stage["seconds"] for stage in stages.values())
+        results["tiers"].append({
+            "tier": tier,
+            "users": dataset["n_users"],
+            "events": dataset["n_events"],
+            "total_seconds": round(total, 6),
+            "stages": stages
+        })
+        log(f"Tier {tier}: {dataset['n_events']} events in {total:.3f}s")
+
+    os.makedirs(os.path.dirname(os.path.abspath(results_file)), exist_ok=True)
+    with open(results_file, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    return results
+
+
+def find_regressions(results, baseline, tolerance=0.25, min_seconds=0.05):
+    """
+    Compares benchmark results with a baseline and lists the stages that got slower.
+
+    Args:
+        results (dict): Output of `run_benchmarks`.
+        baseline (dict): Previous output of `run_benchmarks`.
+        tolerance (float): Allowed relative slowdown (0.25 = 25% slower).
+        min_seconds (float): Stages faster than this in the baseline are ignored (too noisy).
+
+    Returns:
+        list of str: Description of each regression (empty when there is none).
+    """
+    baseline_tiers = {tier["tier"]: tier for tier in baseline.get("tiers", [])}
+    regressions = []
+    for tier in results["tiers"]:
+        previous = baseline_tiers.get(tier["tier"])
+        if previous is None:
+            continue
+        for name, stage in tier["stages"].items():
+            before = previous["stages"].get(name, {}).get("seconds")
+            if before is None or before < min_seconds:
+                continue
+            if stage["seconds"] > before * (1 + tolerance):
+                regressions.append(f"tier {tier['tier']} {name}: {before:.4f}s -> {stage['seconds']:.4f}s")
+    return regressions
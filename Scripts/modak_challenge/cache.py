@@ -0,0 +1,175 @@
+"""
+Typed columnar cache of the input tables.
+"""
+
+import os #For accessing the cache directories.
+import json #For the manifest of each cached table.
+import shutil #For replacing the cache directories of the typed tables.
+import hashlib #For fingerprinting source files by content.
+import numpy as np #For storing the columns as .npy files.
+import pandas as pd #For rebuilding the cached DataFrames.
+
+
+# Version of the cache layout: bump it whenever the cached types or conversions change
+CACHE_VERSION = 2
+
+
+def _source_fingerprint(source_path, use_hash=False):
+    """
+    Identifies the current content of a source file, to decide whether its cache is still valid.
+    By default the size and modification time are used; with `use_hash` the SHA-256 of the content.
+    """
+    if use_hash:
+        digest = hashlib.sha256()
+        with open(source_path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        return {"sha256": digest.hexdigest()}
+
+    stat = os.stat(source_path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def save_columnar_cache(df, cache_path, fingerprint):
+    """
+    Stores a typed DataFrame on disk as one binary NumPy file per column, plus a manifest
+    with the dtypes, the categories and the fingerprint of the source file.
+
+    Category columns are stored as their integer codes, datetimes as int64 and strings as
+    fixed-width unicode with a missing-value mask. The cache directory is replaced atomically.
+
+    Args:
+        df (pd.DataFrame): Typed table to store.
+        cache_path (str): Directory of the cache of this table.
+        fingerprint (dict): Fingerprint of the source file the table was loaded from.
+    """
+    temporary_path = f"{cache_path}.tmp-{os.getpid()}"
+    shutil.rmtree(temporary_path, ignore_errors=True)
+    os.makedirs(temporary_path)
+
+    columns = []
+    for position, (name, values) in enumerate(df.items()):
+        column = {"name": name, "dtype": str(values.dtype), "file": f"column_{position}.npy"}
+
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            column["kind"] = "category"
+            column["categories"] = values.cat.categories.tolist()
+            data = values.cat.codes.to_numpy()
+        elif isinstance(values.dtype, pd.StringDtype):
+            column["kind"] = "string"
+            column["mask_file"] = f"column_{position}_mask.npy"
+            mask = values.isna().to_numpy()
+            np.save(os.path.join(temporary_path, column["mask_file"]), mask)
+            data = values.fillna("").to_numpy(dtype=str)
+        elif np.issubdtype(values.dtype, np.datetime64):
+            column["kind"] = "datetime"
+            data = values.to_numpy().view(np.int64)
+        elif values.dtype.kind in "biuf":
+            column["kind"] = "numeric"
+            data = values.to_numpy()
+        else:
+            raise TypeError(f"Column {name} of dtype {values.dtype} can't be cached")
+
+        np.save(os.path.join(temporary_path, column["file"]), data)
+        columns.append(column)
+
+    manifest = {"version": CACHE_VERSION, "source": fingerprint, "rows": len(df), "columns": columns}
+    with open(os.path.join(temporary_path, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+
+    shutil.rmtree(cache_path, ignore_errors=True)
+    os.replace(temporary_path, cache_path)
+
+
+def load_columnar_cache(cache_path, fingerprint):
+    """
+    Loads a table stored by `save_columnar_cache`, memory-mapping its column files.
+
+    Args:
+        cache_path (str): Directory of the cache of this table.
+        fingerprint (dict): Fingerprint of the current source file.
+
+    Returns:
+        pd.DataFrame: The cached table, or None if there is no cache or it is stale.
+    """
+    manifest_path = os.path.join(cache_path, "manifest.json")
+    if not os.path.exists(manifest_path):
+        return None
+
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("version") != CACHE_VERSION or manifest.get("source") != fingerprint:
+        return None
+
+    frame = {}
+    for column in manifest["columns"]:
+        data = np.load(os.path.join(cache_path, column["file"]), mmap_mode="r")
+
+        if column["kind"] == "category":
+            frame[column["name"]] = pd.Categorical.from_codes(data, categories=column["categories"])
+        elif column["kind"] == "string":
+            mask = np.load(os.path.join(cache_path, column["mask_file"]), mmap_mode="r")
+            values = data.astype(object)
+            values[mask] = None
+            frame[column["name"]] = pd.array(values, dtype="string")
+        elif column["kind"] == "datetime":
+            frame[column["name"]] = data.view(column["dtype"])
+        else:
+            frame[column["name"]] = data
+
+    return pd.DataFrame(frame, copy=False)
+
+
+def read_cached_table(source_path, cache_dir, use_hash=False):
+    """
+    Returns the typed table of a source file from the columnar cache, without loading the source file.
+
+    Args:
+        source_path (str): Full path to the source file (JSON or CSV).
+        cache_dir (str): Directory where the cached tables are stored.
+        use_hash (bool): Validate the cache with a content hash instead of size and modification time.
+
+    Returns:
+        pd.DataFrame: The cached table, or None if there is no valid cache for the file.
+    """
+    cache_path = os.path.join(cache_dir, os.path.basename(source_path))
+    return load_columnar_cache(cache_path, _source_fingerprint(source_path, use_hash))
+
+
+def load_cached_table(source_path, loader, cache_dir, use_hash=False, verbose=True):
+    """
+    Returns the typed table of a source file, from the columnar cache when it is still valid
+    for the file, otherwise by calling `loader` and refreshing the cache.
+
+    Args:
+        source_path (str): Full path to the source file (JSON or CSV).
+        loader (callable): Function that receives `source_path` and returns the typed DataFrame.
+        cache_dir (str): Directory where the cached tables are stored.
+        use_hash (bool): Validate the cache with a content hash instead of size and modification time.
+        verbose (bool): Whether to report the tables loaded from the cache.
+
+    Returns:
+        pd.DataFrame: Typed table.
+
+    Raises:
+        FileNotFoundError: If the source file does not exist. The errors of `loader` propagate.
+    """
+    if not os.path.exists(source_path):
+        raise FileNotFoundError(f"File not found: {source_path}")
+
+    cache_path = os.path.join(cache_dir, os.path.basename(source_path))
+    fingerprint = _source_fingerprint(source_path, use_hash)
+
+    df = load_columnar_cache(cache_path, fingerprint)
+    if df is not None:
+        if verbose:
+            print(f"Loaded {source_path} from cache {cache_path}")
+        return df
+
+    df = loader(source_path)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        save_columnar_cache(df, cache_path, fingerprint)
+    except (OSError, TypeError) as e:
+        print(f"Could not cache {source_path}: {e}")
+    return df
@@ -0,0 +1,239 @@
+"""
+Command line entry point: python -m modak_challenge run [options]
+
+The pipeline modules (and pandas) are only imported once the arguments are parsed.
+"""
+
+import argparse #For parsing the command line arguments.
+import os #For the default directories.
+
+
+def _non_negative_int(value):
+    """
+    Argument type of the counts where 0 has a meaning of its own (e.g. the whole history).
+    """
+    try:
+        number = int(value)
+    except ValueError:
+        number = -1
+    if number < 0:
+        raise argparse.ArgumentTypeError(f"expected 0 or a positive integer, got {value}")
+    return number
+
+
+def _add_input_arguments(parser):
+    """
+    Adds the options shared by the subcommands: input files, output directory, cache and quiet mode.
+    """
+    parser.add_argument("--data-dir", default=".", help="Directory of the input files with their default names (default: current directory).")
+    parser.add_argument("--events", help="Path to the events file: a JSON array or NDJSON, plain or compressed (.gz, .bz2, .xz, .zst).")
+    parser.add_argument("--backend", help="Path to the allowance backend table.")
+    parser.add_argument("--output-dir", default=".", help="Directory where the outputs are written (default: current directory).")
+    parser.add_argument("--cache-dir", help="Directory of the typed columnar cache (default: .cache in the data directory).")
+    parser.add_argument("--no-cache", action="store_true", help="Load the input files without the columnar cache.")
+    parser.add_argument("--parse-jobs", type=int, help="Worker processes parsing an NDJSON events file by byte ranges (default: one per CPU).")
+    parser.add_argument("-q", "--quiet", action="store_true", help="Don't print the analyses.")
+
+
+def build_parser():
+    """
+    Builds the argument parser of the command line.
+
+    Returns:
+        argparse.ArgumentParser: The parser, with one subcommand per mode.
+    """
+    parser = argparse.ArgumentParser(
+        prog="modak_challenge",
+        description="Reconciliation of the allowance events with the backend payment tables."
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="Run the full (or incremental) reconciliation and write the CSV outputs.")
+    _add_input_arguments(run)
+    run.add_argument("--payments", help="Path to the payment schedule backend table.")
+    run.add_argument("--incremental", action="store_true", help="Reconcile only the users with events later than their stored latest event, reading only the appended events.")
+    run.add_argument("--state-dir", help="Directory of the per-user state of the incremental mode (default: .state in the data directory).")
+    run.add_argument("-j", "--jobs", type=int, default=1, help="Worker processes of the per-user stages, sharded by user id (default: 1).")
+    run.add_argument("--load-jobs", type=int, default=3, help="Worker processes loading the three input tables concurrently (default: 3; 1 loads them in sequence).")
+    run.add_argument("--duplicate-lookback", type=_non_negative_int, default=1,
+                     help="Latest events of each user checked for a duplicate of the event before them; 0 means the full "
+                          "history of each user (default: 1).")
+    run.add_argument("--engine", choices=["pandas", "sqlite", "external"], default="pandas",
+                     help="Execution engine: in-memory pandas, or sqlite or external (sorted runs spilled to disk) for inputs larger than memory (default: pandas).")
+    run.add_argument("--work-dir", help="Directory of the temporary files of the out-of-core engines (default: system temporary directory).")
+    run.add_argument("--memory-limit", type=int, default=512, help="Memory budget in MB of the out-of-core engines before spilling to disk (default: 512).")
+    run.add_argument("--format", dest="output_format", choices=["csv", "parquet", "arrow"], default="csv",
+                     help="Format of the outputs (parquet and arrow require pyarrow; default: csv).")
+    run.add_argument("--compression", help="Compression of the outputs, e.g. gzip for CSV or zstd for parquet and arrow.")
+    run.add_argument("--partition", action="store_true",
+                     help="Write the discrepancies and payment status outputs as one file per category (hive-style directories).")
+    run.add_argument("--report", help="Write a JSON run report with the time, memory and rows of each stage to this path.")
+    run.add_argument("--trace-memory", action="store_true", help="Record the peak traced memory of each stage in the report (slower).")
+    run.add_argument("--profile-dir", help="Write a cProfile file of each stage to this directory (the report defaults to run_report.json in the output directory).")
+
+    backfill = commands.add_parser("backfill", help="Reconcile every as-of date of a range in one pass.")
+    _add_input_arguments(backfill)
+    backfill.add_argument("--start", required=True, help="First as-of date (YYYY-MM-DD).")
+    backfill.add_argument("--end", required=True, help="Last as-of date (YYYY-MM-DD).")
+    backfill.add_argument("--every", default="D", help="Spacing of the as-of dates, as a pandas frequency (default: D, daily).")
+
+    serve = commands.add_parser("serve", help="Load the tables once and answer per-user reconciliation queries over local HTTP.")
+    _add_input_arguments(serve)
+    serve.add_argument("--payments", help="Path to the payment schedule backend table.")
+    serve.add_argument("--host", default="127.0.0.1", help="Address to listen on (default: 127.0.0.1, local connections only).")
+    serve.add_argument("--port", type=int, default=8765, help="Port to listen on (default: 8765).")
+
+    stream = commands.add_parser("stream", help="Follow an append-only NDJSON events file and write a record per discrepancy as it appears.")
+    _add_input_arguments(stream)
+    stream.add_argument("--payments", help="Path to the payment schedule backend table.")
+    stream.add_argument("--output", help="Path to the NDJSON records (default: reconciliation_stream.ndjson in the output directory).")
+    stream.add_argument("--checkpoint", help="Path to the checkpoint of the stream (default: the records path with .checkpoint).")
+    stream.add_argument("--batch-events", type=int, default=1000, help="Maximum event lines per micro-commit (default: 1000).")
+    stream.add_argument("--poll-interval", type=float, default=0.5, help="Seconds between checks for new events (default: 0.5).")
+    stream.add_argument("--no-follow", action="store_true", help="Stop at the end of the events file instead of waiting for new events.")
+
+    generate = commands.add_parser("generate", help="Write a seeded synthetic set of the input files.")
+    generate.add_argument("--users", type=int, default=2882, help="Number of users (default: 2882, as in the sample files).")
+    generate.add_argument("--seed", type=int, default=0, help="Seed of the random generator (default: 0).")
+    generate.add_argument("--output-dir", default=".", help="Directory where the files are written (default: current directory).")
+    generate.add_argument("--events-format", choices=["json", "ndjson"], default="json", help="Format of the events file (default: json, a JSON array).")
+
+    benchmark = commands.add_parser("benchmark", help="Time and measure the memory of every stage over synthetic data of several sizes.")
+    benchmark.add_argument("--tiers", type=int, nargs="+", default=[1, 10], help="Size tiers, as multiples of the sample users (default: 1 10).")
+    benchmark.add_argument("--seed", type=int, default=0, help="Seed of the synthetic data (default: 0).")
+    benchmark.add_argument("--repeat", type=int, default=3, help="Timed runs of each tier, the fastest is kept (default: 3).")
+    benchmark.add_argument("--work-dir", default=".benchmark", help="Directory of the synthetic datasets (default: .benchmark).")
+    benchmark.add_argument("--results", default="benchmark_results.json", help="Path to the JSON results file (default: benchmark_results.json).")
+    benchmark.add_argument("--baseline", help="Previous results file: exit with status 1 if a stage got slower than the tolerance.")
+    benchmark.add_argument("--tolerance", type=float, default=0.25, help="Allowed relative slowdown against the baseline (default: 0.25).")
+
+    return parser
+
+
+def main(argv=None):
+    """
+    Runs the command line.
+
+    Args:
+        argv (list of str, optional): Arguments (default: sys.argv[1:]).
+
+    Returns:
+        int: Exit status.
+    """
+    args = build_parser().parse_args(argv)
+
+    if args.command == "generate":
+        from .synthetic import generate_dataset
+
+        dataset = generate_dataset(args.output_dir, n_users=args.users, seed=args.seed, events_format=args.events_format)
+        print(f"{dataset['n_users']} users and {dataset['n_events']} events written to {args.output_dir}")
+        return 0
+
+    if args.command == "benchmark":
+        import json
+        from .benchmark import find_regressions, run_benchmarks
+
+        results = run_benchmarks(args.tiers, args.seed, args.work_dir, args.results, args.repeat)
+        print(f"Results saved to {args.results}")
+        if args.baseline:
+            with open(args.baseline, "r", encoding="utf-8") as f:
+                regressions = find_regressions(results, json.load(f), args.tolerance)
+            for regression in regressions:
+                print(f"Regression: {regression}")
+            return 1 if regressions else 0
+        return 0
+
+    cache_dir = None if args.no_cache else (args.cache_dir or os.path.join(args.data_dir, ".cache"))
+
+    from .concurrent_loading import InputLoadError
+
+    try:
+        _run_command(args, cache_dir)
+    except InputLoadError as e:
+        print(e)
+        return 1
+    return 0
+
+
+def _run_command(args, cache_dir):
+    """
+    Runs the 'run', 'serve', 'stream' or 'backfill' subcommand.
+    """
+    if args.command == "run":
+        from .instrumentation import finish_run_report, start_run_report
+        from .pipeline import run_pipeline
+
+        report = None
+        if args.report or args.profile_dir or args.trace_memory:
+            report = start_run_report(trace_memory=args.trace_memory, profile_dir=args.profile_dir)
+
+        run_pipeline(
+            data_dir=args.data_dir,
+            output_dir=args.output_dir,
+            events_path=args.events,
+            backend_path=args.backend,
+            payment_path=args.payments,
+            cache_dir=cache_dir,
+            incremental=args.incremental,
+            state_dir=args.state_dir or os.path.join(args.data_dir, ".state"),
+            quiet=args.quiet,
+            jobs=args.jobs,
+            report=report,
+            output_format=args.output_format,
+            compression=args.compression,
+            partition=args.partition,
+            engine=args.engine,
+            work_dir=args.work_dir,
+            memory_limit_mb=args.memory_limit,
+            load_jobs=args.load_jobs,
+            parse_jobs=args.parse_jobs,
+            duplicate_lookback=args.duplicate_lookback or None
+        )
+        if report is not None:
+            finish_run_report(report, args.report or os.path.join(args.output_dir, "run_report.json"))
+    elif args.command == "serve":
+        from .pipeline import run_service
+
+        run_service(
+            data_dir=args.data_dir,
+            events_path=args.events,
+            backend_path=args.backend,
+            payment_path=args.payments,
+            cache_dir=cache_dir,
+            host=args.host,
+            port=args.port,
+            quiet=args.quiet,
+            parse_jobs=args.parse_jobs
+        )
+    elif args.command == "stream":
+        from .pipeline import run_stream
+
+        run_stream(
+            data_dir=args.data_dir,
+            output_dir=args.output_dir,
+            events_path=args.events,
+            backend_path=args.backend,
+            payment_path=args.payments,
+            cache_dir=cache_dir,
+            output_path=args.output,
+            checkpoint_path=args.checkpoint,
+            follow=not args.no_follow,
+            batch_events=args.batch_events,
+            poll_interval=args.poll_interval,
+            quiet=args.quiet
+        )
+    elif args.command == "backfill":
+        from .pipeline import run_backfill
+
+        run_backfill(
+            args.start,
+            args.end,
+            frequency=args.every,
+            data_dir=args.data_dir,
+            output_dir=args.output_dir,
+            events_path=args.events,
+            backend_path=args.backend,
+            cache_dir=cache_dir,
+            quiet=args.quiet,
+            parse_jobs=args.parse_jobs
+        )
@@ -0,0 +1,160 @@
+"""
+Concurrent loading of the input tables.
+
+Each source (events JSON, backend CSV, payment schedule CSV) is read, parsed and typed in its own worker
+process, so the type conversion of a table starts as soon as its own parse finishes and the loading takes
+about as long as the largest file instead of the sum of the three. When a typed columnar cache is given, the
+sources with a valid cache are memory-mapped in the calling process instead, as a table returned by a worker
+is pickled and copied; only the sources to parse go to the workers, which refresh their cache. Every source
+that fails is reported with its error, and the failures of a load are raised together as an `InputLoadError`
+instead of leaving a None table to fail later in the run.
+"""
+
+import os #For checking the input files.
+from concurrent.futures import ProcessPoolExecutor, as_completed #For loading the sources on several cores.
+
+import pandas as pd #For reading the CSV tables.
+
+from .cache import load_cached_table, read_cached_table
+from .instrumentation import measure, record_span
+from .loading import convert_backend_types, convert_payment_types, read_events
+
+
+# Input sources, in the order they are reported
+INPUT_SOURCES = ("events", "backend", "payment")
+
+
+class InputLoadError(Exception):
+    """
+    Raised when input tables could not be loaded. `errors` maps each failed source to its error message.
+    """
+
+    def __init__(self, errors):
+        self.errors = errors
+        details = "\n".join(f"  {source}: {message}" for source, message in errors.items())
+        super().__init__(f"Could not load the input tables:\n{details}")
+
+
+def load_source(source, path, cache_dir=None, parse_jobs=1):
+    """
+    Loads and types one input table, through the columnar cache when a cache directory is given
+    (run in the worker processes).
+
+    Args:
+        source (str): One of INPUT_SOURCES.
+        path (str): Full path to the source file.
+        cache_dir (str, optional): Directory of the columnar cache; None loads the source file directly.
+        parse_jobs (int, optional): Number of worker processes parsing an NDJSON events file (see `read_events`).
+
+    Returns:
+        tuple: (typed pd.DataFrame, list of (step, measures) of the steps run, e.g. [('read_csv', {...})];
+               empty when the table came from the cache).
+    """
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"File not found: {path}")
+
+    steps = []
+
+    def loader(path):
+        # The streaming parser of the events already returns the typed columns
+        if source == "events":
+            with measure() as measures:
+                df = read_events(path, jobs=parse_jobs)
+            steps.append(("parse", measures))
+            return df
+
+        with measure() as measures:
+            df = pd.read_csv(path)
+        steps.append(("read_csv", measures))
+        with measure() as measures:
+            df = convert_backend_types(df, verbose=False) if source == "backend" else convert_payment_types(df)
+        steps.append(("type_conversion", measures))
+        return df
+
+    if cache_dir is None:
+        return loader(path), steps
+    return load_cached_table(path, loader, cache_dir, verbose=False), steps
+
+
+def _measured_load(source, path, cache_dir, parse_jobs):
+    """Loads a source and measures the whole load (run in the worker processes)."""
+    with measure() as measures:
+        df, steps = load_source(source, path, cache_dir, parse_jobs)
+    return df, measures, steps
+
+
+def load_input_tables(paths, cache_dir=None, workers=len(INPUT_SOURCES), report=None, log=print, parse_jobs=1):
+    """
+    Loads the typed input tables concurrently, one worker process per source to parse. The sources with a
+    valid columnar cache are loaded in this process (see the module docstring).
+
+    Args:
+        paths (dict): Path of each source to load, e.g. {'events': ..., 'backend': ..., 'payment': ...}.
+        cache_dir (str, optional): Directory of the typed columnar cache; None loads the source files directly.
+        workers (int): Maximum number of worker processes, capped by the number of CPUs and of sources to
+                       parse; 1 loads the sources one after the other in this process.
+        report (dict, optional): Run report, where a span of each source (and of its steps) is recorded.
+        log (callable): Function receiving the progress messages.
+        parse_jobs (int, optional): Number of worker processes parsing an NDJSON events file (see `read_events`).
+
+    Returns:
+        dict: Typed pd.DataFrame of each source, in the order of `paths`.
+
+    Raises:
+        InputLoadError: If any source could not be loaded, with the error of each of them.
+    """
+    unknown = set(paths) - set(INPUT_SOURCES)
+    if unknown:
+        raise ValueError(f"Unknown input sources {sorted(unknown)} (expected some of {', '.join(INPUT_SOURCES)})")
+
+    results = {}
+    errors = {}
+
+    # Cache hits are loaded here, only the other sources are parsed by the workers
+    pending = {}
+    for source, path in paths.items():
+        if cache_dir is None or not os.path.exists(path):
+            pending[source] = path
+            continue
+        try:
+            with measure() as measures:
+                df = read_cached_table(path, cache_dir)
+        except Exception as e:
+            errors[source] = f"{type(e).__name__}: {e}"
+            continue
+        if df is None:
+            pending[source] = path
+        else:
+            results[source] = (df, measures, [])
+
+    workers = min(workers, len(pending), os.cpu_count() or 1)
+    if workers <= 1:
+        for source, path in pending.items():
+            try:
+                results[source] = _measured_load(source, path, cache_dir, parse_jobs)
+            except Exception as e:
+                errors[source] = f"{type(e).__name__}: {e}"
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(_measured_load, source, path, cache_dir, parse_jobs): source for source, path in pending.items()
+            }
+            for future in as_completed(futures):
+                source = futures[future]
+                try:
+                    results[source] = future.result()
+                except Exception as e:
+                    errors[source] = f"{type(e).__name__}: {e}"
+
+    if errors:
+        raise InputLoadError({source: errors[source] for source in paths if source in errors})
+
+    tables = {}
+    for source, path in paths.items():
+        df, measures, steps = results[source]
+        tables[source] = df
+        record_span(report, f"load_{source}", measures, rows_out=len(df))
+        for step, step_measures in steps:
+            record_span(report, f"{step}.{source}", step_measures, parent=f"load_{source}")
+        log(f"Loaded {source} ({len(df)} rows) from {path}" + ("" if steps else " (cached)"))
+    return tables
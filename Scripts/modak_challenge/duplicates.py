@@ -0,0 +1,76 @@
+"""
+Detection of duplicate events (same schedule within a few seconds) in the events history.
+"""
+
+import pandas as pd #For data manipulation and analysis.
+
+from .analysis import latest_events_per_user
+
+
+# Function to check for duplicates timestamps in allowance.events json file
+def check_duplicate(row):
+    if row['event.timestamp'] == row['prev_timestamp']:
+        return row['allowance.scheduled.frequency'] == row['prev_frequency'] and row['allowance.scheduled.day'] == row['prev_day']
+    elif row['allowance.scheduled.frequency'] == row['prev_frequency'] and row['allowance.scheduled.day'] == row['prev_day']:
+        time_diff = (row['event.timestamp'] - row['prev_timestamp']).total_seconds()
+        return abs(time_diff) <= 20
+    return False
+
+
+def _transition(before, after):
+    """Builds the 'before → after' text of two label columns, rendering missing values as 'nan'."""
+    return before.astype("string").fillna("nan") + " → " + after.astype("string").fillna("nan")
+
+
+def detect_duplicate_events(df_events, tolerance_seconds=20, lookback=1, presorted=False):
+    """
+    Vectorized duplicate-event detection (same rule as `check_duplicate`) over consecutive events of each user.
+
+    The events are sorted once by user.id and event.timestamp (skipped when `presorted`, e.g. for the output
+    of `latest_events_per_user`) and reduced to the window of each user; the previous and the one-before-previous
+    events of each user are obtained by shifting the sorted columns (masked at user boundaries), so every
+    consecutive pair of the history is compared without per-row Python or merges.
+    An event is duplicated when it has the same frequency and day as the previous event and
+    the timestamps are at most `tolerance_seconds` apart.
+
+    Args:
+        df_events (pd.DataFrame): Typed events table.
+        tolerance_seconds (float): Maximum time between two events to consider them duplicated.
+        lookback (int or None): Number of latest events of each user compared with their previous event
+                                (1 compares only the last event, None the whole history).
+        presorted (bool): `df_events` is already sorted by user.id and event.timestamp.
+
+    Returns:
+        pd.DataFrame: The compared events with 'prev_*' and 'preprev_*' timestamp, frequency and day,
+        'timestamp_duplicated', 'frequency_transition', 'day_transition' and 'frequency_day_transition'
+        (transitions from the one-before-previous to the previous event), sorted by user and timestamp.
+    """
+    # Each compared event needs the two events before it
+    if lookback is not None:
+        events = latest_events_per_user(df_events, n=lookback + 2, presorted=presorted)
+    elif not presorted:
+        events = df_events.sort_values(by=['user.id', 'event.timestamp'], kind='stable').reset_index(drop=True)
+    else:
+        events = df_events.reset_index(drop=True)
+    user = events['user.id']
+
+    for shift, prefix in ((1, 'prev'), (2, 'preprev')):
+        same_user = (user == user.shift(shift)).fillna(False)
+        events[f'{prefix}_timestamp'] = events['event.timestamp'].shift(shift).where(same_user)
+        events[f'{prefix}_frequency'] = events['allowance.scheduled.frequency'].shift(shift).where(same_user)
+        events[f'{prefix}_day'] = events['allowance.scheduled.day'].shift(shift).where(same_user)
+
+    if lookback is not None:
+        events = events[(events.groupby('user.id', sort=False, observed=True).cumcount(ascending=False) < lookback).to_numpy()].reset_index(drop=True)
+
+    same_schedule = (
+        (events['allowance.scheduled.frequency'] == events['prev_frequency']).fillna(False) &
+        (events['allowance.scheduled.day'] == events['prev_day']).fillna(False)
+    )
+    within_tolerance = (events['event.timestamp'] - events['prev_timestamp']).abs() <= pd.Timedelta(seconds=tolerance_seconds)
+    events['timestamp_duplicated'] = (same_schedule & within_tolerance).to_numpy(dtype=bool)
+
+    events['frequency_transition'] = _transition(events['preprev_frequency'], events['prev_frequency'])
+    events['day_transition'] = _transition(events['preprev_day'], events['prev_day'])
+    events['frequency_day_transition'] = events['frequency_transition'] + " | " + events['day_transition']
+    return events
@@ -0,0 +1,386 @@
+"""
+Chunked out-of-core reconciliation over an external sort of the tables by user.
+
+Each input table is read in chunks that fit the memory budget. Every chunk is sorted by user (the events
+also by timestamp, missing timestamps last, and file order) and spilled to the work directory as a run of
+fixed-size blocks. The runs are merged k-way: one block of each run is in memory at a time, and the rows
+of the users below the smallest last user of the loaded blocks are complete, so they are emitted in key
+order as groups of whole users. When there are more runs than the merge fan-in, groups of runs are merged
+into longer runs first.
+
+The sorted events stream through the stages of the in-memory pipeline one batch of users at a time,
+together with the rows of the same users in the sorted backend and payment tables (a merge join):
+disabled users, latest event, expected payment days, comparisons and duplicate detection. Peak memory
+depends on the budget, not on the size of the inputs (plus the history of the single largest user, as
+the rows of a user are never split). The results of each batch are appended to the CSV outputs, which are
+identical to the ones of the in-memory engine.
+"""
+
+import os #For the runs and the work directory.
+import pickle #For the blocks of the sorted runs.
+import tempfile #For the work directory of a run.
+
+import pandas as pd #For data manipulation and analysis.
+
+from .analysis import (
+    PAYMENT_STATUS_COLUMNS,
+    PAYMENT_SUMMARY_COLUMNS,
+    aggregate_payment_schedule,
+    compare_with_backend,
+    expand_payment_summary,
+    flag_discrepancies,
+    latest_events_per_user,
+    remove_disabled_users,
+    summarize_payment_schedule
+)
+from .duplicates import detect_duplicate_events
+from .loading import BACKEND_NANOSECOND_COLUMNS, convert_backend_types, convert_payment_types, iter_events_chunks
+from .schedule_engine import calculate_next_ocurrence_vectorized, load_schedule_calendar
+from .sinks import CsvBatchWriter
+
+
+# Maximum number of runs merged at once, and fewest rows of a run block
+MERGE_FAN_IN = 16
+MIN_BLOCK_ROWS = 1_000
+
+# Rows of the first chunk, used to measure the memory of a row of each table
+SAMPLE_ROWS = 10_000
+
+# Memory allowed per row parsed from the input files (with the parser buffers), and most rows parsed at a time
+PARSE_ROW_BYTES = 1_024
+MAX_CHUNK_ROWS = 100_000
+
+# Order of the rows of each table: user key, then timestamp (events) and file order
+_SEQUENCE = "_seq"
+EVENT_SORT_COLUMNS = ["user.id", "event.timestamp", _SEQUENCE]
+BACKEND_SORT_COLUMNS = ["uuid", _SEQUENCE]
+PAYMENT_SORT_COLUMNS = ["user_id", _SEQUENCE]
+
+
+def _sort_rows(df, by):
+    """Sorts rows by `by`, missing values last (as the stable sort of the in-memory pipeline)."""
+    return df.sort_values(by=by, na_position="last", kind="stable").reset_index(drop=True)
+
+
+class SortedRuns:
+    """
+    External sort of a table: sorted runs of fixed-size blocks spilled to a directory.
+
+    Args:
+        run_dir (str): Directory of the run files.
+        name (str): Name of the table, prefix of its run files.
+        by (list of str): Sort columns; the first one is the key the merge groups by.
+        memory_limit_mb (int): Memory budget of the sort and of the merge.
+    """
+
+    def __init__(self, run_dir, name, by, memory_limit_mb):
+        self.prefix = os.path.join(run_dir, name)
+        self.by = by
+        self.key = by[0]
+        self.budget = memory_limit_mb * 1024 * 1024
+        self.runs = []
+        self.runs_written = 0
+        self.categories = []
+        self.rows = 0
+        self.empty = None
+        self.run_rows = None
+        self.block_rows = None
+
+    def _size_blocks(self, chunk):
+        """Sizes the runs and their blocks from the memory of the rows of the first chunk."""
+        sample = chunk.iloc[:SAMPLE_ROWS]
+        row_bytes = max(1, sample.memory_usage(index=False, deep=True).sum() / max(1, len(sample)))
+        # A sort holds the chunk and its sorted copy; a merge holds a block of each run and their merge
+        self.run_rows = max(MIN_BLOCK_ROWS, int(self.budget / (4 * row_bytes)))
+        self.block_rows = max(MIN_BLOCK_ROWS, self.run_rows // (MERGE_FAN_IN + 1))
+
+    def _write_run(self, blocks):
+        """Writes the blocks of a sorted run, returning (path, number of blocks)."""
+        path = f"{self.prefix}-{self.runs_written}.run"
+        self.runs_written += 1
+        count = 0
+        with open(path, "wb") as f:
+            for block in blocks:
+                pickle.dump(block, f, protocol=pickle.HIGHEST_PROTOCOL)
+                count += 1
+        self.runs.append((path, count))
+        return path, count
+
+    def _rechunk(self, frames):
+        """Splits a stream of sorted frames into blocks of `block_rows` rows."""
+        pending = []
+        rows = 0
+        for df in frames:
+            pending.append(df)
+            rows += len(df)
+            while rows >= self.block_rows:
+                df = pd.concat(pending, ignore_index=True) if len(pending) > 1 else pending[0]
+                yield df.iloc[:self.block_rows].reset_index(drop=True)
+                pending = [df.iloc[self.block_rows:]]
+                rows = len(pending[0])
+        if rows:
+            yield pd.concat(pending, ignore_index=True)
+
+    def spill(self, chunks):
+        """
+        Sorts the chunks of a table in runs of about the memory budget and spills them, numbering the rows
+        in file order. Rows without a key are dropped, as they never match another table.
+
+        Args:
+            chunks (iterable of pd.DataFrame): Typed chunks of the table, in file order.
+
+        Returns:
+            SortedRuns: self.
+        """
+        pending = []
+        pending_rows = 0
+        for chunk in chunks:
+            if self.run_rows is None:
+                self._size_blocks(chunk)
+                self.categories = [column for column in chunk.columns if isinstance(chunk[column].dtype, pd.CategoricalDtype)]
+            chunk = chunk.assign(**{_SEQUENCE: range(self.rows, self.rows + len(chunk))})
+            self.rows += len(chunk)
+            # Chunks with different categories would be concatenated as objects anyway
+            chunk = chunk.astype({column: object for column in self.categories})
+            if self.empty is None:
+                self.empty = chunk.iloc[:0]
+            chunk = chunk[chunk[self.key].notna().to_numpy()]
+            # Chunks larger than a run are split between runs
+            while len(chunk):
+                pending.append(chunk.iloc[:self.run_rows - pending_rows])
+                chunk = chunk.iloc[len(pending[-1]):]
+                pending_rows += len(pending[-1])
+                if pending_rows >= self.run_rows:
+                    self._spill_run(pending)
+                    pending, pending_rows = [], 0
+        if pending_rows:
+            self._spill_run(pending)
+        return self
+
+    def _spill_run(self, frames):
+        df = _sort_rows(pd.concat(frames, ignore_index=True), self.by)
+        self._write_run(self._rechunk([df]))
+
+    def _iter_blocks(self, path):
+        with open(path, "rb") as f:
+            while True:
+                try:
+                    yield pickle.load(f)
+                except EOFError:
+                    return
+
+    def _merge(self, runs):
+        """
+        Merges sorted runs k-way, yielding sorted frames of whole key groups in key order.
+        """
+        readers = [self._iter_blocks(path) for path, _ in runs]
+        remaining = [count for _, count in runs]
+        buffers = [None] * len(runs)
+        bound_key = None
+
+        while True:
+            # Each run with an empty buffer, or with only the rows of the bounding key left, reads its next block
+            for number, reader in enumerate(readers):
+                buffer = buffers[number]
+                if remaining[number] and (buffer is None or len(buffer) == 0 or buffer[self.key].iat[-1] == bound_key):
+                    block = next(reader)
+                    remaining[number] -= 1
+                    buffers[number] = block if buffer is None or len(buffer) == 0 else pd.concat([buffer, block], ignore_index=True)
+
+            active = [buffer for buffer in buffers if buffer is not None and len(buffer)]
+            if not active:
+                return
+
+            # The keys below the smallest last key of the runs with more blocks are complete
+            pending_keys = [buffers[number][self.key].iat[-1] for number in range(len(runs))
+                            if remaining[number] and buffers[number] is not None and len(buffers[number])]
+            bound_key = min(pending_keys) if pending_keys else None
+
+            parts = []
+            for number, buffer in enumerate(buffers):
+                if buffer is None or len(buffer) == 0:
+                    continue
+                cut = len(buffer) if bound_key is None else int(buffer[self.key].to_numpy(dtype=object).searchsorted(bound_key, side="left"))
+                if cut:
+                    parts.append(buffer.iloc[:cut])
+                    buffers[number] = buffer.iloc[cut:].reset_index(drop=True)
+            if parts:
+                yield _sort_rows(pd.concat(parts, ignore_index=True), self.by)
+
+    def _restore(self, df):
+        """Restores the categorical columns of a merged frame."""
+        return df.astype({column: "category" for column in self.categories})
+
+    def iter_groups(self, log=None):
+        """
+        Streams the sorted table as frames of whole key groups, in key order (merging in several passes
+        when there are more runs than the fan-in).
+
+        Yields:
+            pd.DataFrame: Sorted rows of complete groups, with their file order in the '_seq' column.
+        """
+        passes = 0
+        while len(self.runs) > MERGE_FAN_IN:
+            runs, self.runs = self.runs, []
+            for start in range(0, len(runs), MERGE_FAN_IN):
+                group = runs[start:start + MERGE_FAN_IN]
+                self._write_run(self._rechunk(self._merge(group)))
+                for path, _ in group:
+                    os.remove(path)
+            passes += 1
+        if log is not None and passes:
+            log(f"{passes} intermediate merge passes of {os.path.basename(self.prefix)}")
+
+        merged = False
+        for df in self._merge(self.runs):
+            merged = True
+            yield self._restore(df)
+        # A table without rows is a single empty frame with its columns
+        if not merged and self.empty is not None:
+            yield self._restore(self.empty)
+
+
+class _KeyRangeReader:
+    """
+    Reader of the rows of ascending key ranges of a sorted table (the right side of a merge join).
+    """
+
+    def __init__(self, runs, log=None):
+        self.groups = runs.iter_groups(log)
+        self.key = runs.key
+        self.buffer = None
+        self.empty = None if runs.empty is None else runs._restore(runs.empty)
+
+    def take(self, low, high):
+        """Rows with a key between `low` and `high` (inclusive), in sort order; lower keys are skipped."""
+        parts = []
+        while True:
+            if self.buffer is None:
+                self.buffer = next(self.groups, None)
+                if self.buffer is None:
+                    break
+            keys = self.buffer[self.key].to_numpy(dtype=object)
+            start = int(keys.searchsorted(low, side="left"))
+            end = int(keys.searchsorted(high, side="right"))
+            if end > start:
+                parts.append(self.buffer.iloc[start:end])
+            if end < len(keys):
+                self.buffer = self.buffer.iloc[end:]
+                break
+            self.buffer = None
+        if not parts:
+            return self.empty
+        return pd.concat(parts, ignore_index=True) if len(parts) > 1 else parts[0].reset_index(drop=True)
+
+
+def _date_range(first, last, values):
+    """Updates the (first, last) range of dates with the values of a chunk."""
+    values = values.dropna()
+    if values.empty:
+        return first, last
+    low, high = values.min(), values.max()
+    return (low if first is None else min(first, low)), (high if last is None else max(last, high))
+
+
+def _table_order(df):
+    """Rows of a merge-join slice in file order, without the sequence column."""
+    return df.sort_values(_SEQUENCE, kind="stable").drop(columns=_SEQUENCE).reset_index(drop=True)
+
+
+def run_external_reconciliation(events_path, backend_path, payment_path, outputs, work_dir=None, cache_dir=None,
+                                memory_limit_mb=512, chunk_rows=None, tolerance_seconds=20,
+                                duplicate_lookback=1, log=print):
+    """
+    Runs the full reconciliation over external sorts of the three tables and writes the CSV
+    outputs, identical to the ones of the in-memory pipeline.
+
+    Args:
+        events_path (str): Path to the events file (JSON array or NDJSON, plain or compressed).
+        backend_path (str): Path to the allowance backend table.
+        payment_path (str): Path to the payment schedule backend table.
+        outputs (dict): Paths of the 'discrepancies', 'payment_status', 'payment_summary' and 'duplicates' CSV outputs.
+        work_dir (str, optional): Directory of the sorted runs (default: the system
+                                  temporary directory). The files are removed at the end of the run.
+        cache_dir (str, optional): Directory of the calendar index; None builds it in memory only.
+        memory_limit_mb (int): Memory budget of the sorts and of the merges.
+        chunk_rows (int, optional): Rows parsed from the input files at a time (default: as many as fit in the
+                                    budget, up to MAX_CHUNK_ROWS).
+        tolerance_seconds (int): Maximum distance, in seconds, between duplicate events.
+        duplicate_lookback (int, optional): Number of latest events of each user checked for duplicates (None: all).
+        log (callable): Function used to report the progress.
+
+    Returns:
+        dict: Number of rows written to each output.
+    """
+    if work_dir is not None:
+        os.makedirs(work_dir, exist_ok=True)
+    if chunk_rows is None:
+        chunk_rows = max(MIN_BLOCK_ROWS, min(MAX_CHUNK_ROWS, memory_limit_mb * 1024 * 1024 // PARSE_ROW_BYTES))
+
+    with tempfile.TemporaryDirectory(prefix="reconciliation-", dir=work_dir) as run_dir:
+        # Sorted runs of the three tables, and the range of the dates of the calendar
+        dates = [None, None]
+
+        def events_chunks():
+            for chunk in iter_events_chunks(events_path, chunk_rows):
+                dates[:] = _date_range(*dates, chunk["event.timestamp"])
+                yield chunk
+
+        def backend_chunks():
+            for chunk in pd.read_csv(backend_path, chunksize=chunk_rows):
+                chunk = convert_backend_types(chunk, verbose=False)
+                dates[:] = _date_range(*dates, chunk["updated_at"])
+                yield chunk
+
+        events = SortedRuns(run_dir, "events", EVENT_SORT_COLUMNS, memory_limit_mb).spill(events_chunks())
+        backend = SortedRuns(run_dir, "backend", BACKEND_SORT_COLUMNS, memory_limit_mb).spill(backend_chunks())
+        payment = SortedRuns(run_dir, "payment", PAYMENT_SORT_COLUMNS, memory_limit_mb).spill(
+            convert_payment_types(chunk) for chunk in pd.read_csv(payment_path, chunksize=chunk_rows)
+        )
+        log(f"Sorted runs spilled: {len(events.runs)} of events, {len(backend.runs)} of backend, {len(payment.runs)} of payment")
+
+        calendar = None
+        if dates[0] is not None:
+            calendar = load_schedule_calendar(cache_dir, dates[0], dates[1])
+
+        writers = {name: CsvBatchWriter(outputs[name], BACKEND_NANOSECOND_COLUMNS) for name in ("discrepancies", "payment_status", "payment_summary", "duplicates")}
+        try:
+            backend_reader = _KeyRangeReader(backend, log)
+            payment_reader = _KeyRangeReader(payment, log)
+
+            # Stages of the pipeline over each batch of whole users, in user order
+            for df_events in events.iter_groups(log):
+                user_ids = df_events["user.id"]
+                low, high = (user_ids.iat[0], user_ids.iat[-1]) if len(df_events) else ("", "")
+                df_events = df_events.drop(columns=_SEQUENCE)
+                df_backend = _table_order(backend_reader.take(low, high))
+                df_payment = _table_order(payment_reader.take(low, high))
+
+                df_compare = detect_duplicate_events(df_events, tolerance_seconds, lookback=duplicate_lookback, presorted=True)
+                df_duplicates = df_compare[df_compare["timestamp_duplicated"] == True]
+                writers["duplicates"].append(df_duplicates.drop(columns=["allowance.amount"]))
+
+                df_events = remove_disabled_users(df_events, df_backend)
+                df_events_latest = latest_events_per_user(df_events)
+                df_events_latest["next_expected_payment_date"] = calculate_next_ocurrence_vectorized(
+                    df_events_latest["event.timestamp"],
+                    df_events_latest["allowance.scheduled.frequency"],
+                    df_events_latest["allowance.scheduled.day"],
+                    calendar=calendar
+                )
+                df_events_merged = compare_with_backend(df_events_latest, df_backend, calendar)
+                writers["discrepancies"].append(flag_discrepancies(df_events_merged))
+                df_payment_summary = summarize_payment_schedule(df_events_merged, aggregate_payment_schedule(df_payment))
+                writers["payment_status"].append(expand_payment_summary(df_payment_summary, df_payment)[PAYMENT_STATUS_COLUMNS])
+                writers["payment_summary"].append(df_payment_summary[PAYMENT_SUMMARY_COLUMNS])
+        except BaseException:
+            for writer in writers.values():
+                writer.discard()
+            raise
+
+        counts = {}
+        for name, writer in writers.items():
+            writer.close()
+            counts[name] = writer.rows
+            log(f"{writer.rows} rows saved to {outputs[name]}")
+        return counts
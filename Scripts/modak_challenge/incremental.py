@@ -0,0 +1,258 @@
+"""
+Incremental reconciliation: only users with new events are reconciled again.
+
+The state directory keeps the latest event of each user, used as the watermark of that user, and a checkpoint
+of the events file (see `events_checkpoint`), so an incremental run only parses the events appended since.
+"""
+
+import os #For accessing the state directory and the outputs.
+import csv #For reading the user id of the rows of the outputs.
+import heapq #For merging the new rows into the outputs in user order.
+import json #For the checkpoint of the events file.
+import numpy as np #For the ids of the reconciled users and the per-user watermarks.
+import pandas as pd #For data manipulation and analysis.
+
+from .analysis import (
+    PAYMENT_STATUS_COLUMNS,
+    PAYMENT_SUMMARY_COLUMNS,
+    aggregate_payment_schedule,
+    compare_with_backend,
+    expand_payment_summary,
+    flag_discrepancies,
+    latest_events_per_user,
+    remove_disabled_users,
+    summarize_payment_schedule
+)
+from .cache import load_columnar_cache, save_columnar_cache
+from .loading import BACKEND_NANOSECOND_COLUMNS, EVENT_CATEGORY_COLUMNS, EVENT_COLUMNS, events_checkpoint, iter_events_chunks, read_events_after
+from .schedule_engine import calculate_next_ocurrence_vectorized
+from .sinks import render_csv, write_csv
+
+
+# Columns kept in the per-user state of the incremental reconciliation
+USER_STATE_COLUMNS = EVENT_COLUMNS + ["next_expected_payment_date"]
+
+
+def save_user_state(df_events_latest, state_dir):
+    """
+    Stores the per-user state of the reconciliation: the latest event of each user
+    (timestamp, frequency, day, ...) and its calculated 'next_expected_payment_date'.
+
+    Args:
+        df_events_latest (pd.DataFrame): Latest event per user, with 'next_expected_payment_date'.
+        state_dir (str): Directory where the state is stored.
+    """
+    state = df_events_latest[USER_STATE_COLUMNS].copy()
+    for column in EVENT_CATEGORY_COLUMNS:
+        state[column] = state[column].astype("category")
+    state["next_expected_payment_date"] = state["next_expected_payment_date"].astype("string")
+
+    os.makedirs(state_dir, exist_ok=True)
+    save_columnar_cache(state, os.path.join(state_dir, "user_state"), {"table": "user_state"})
+
+
+def load_user_state(state_dir):
+    """
+    Loads the per-user state stored by `save_user_state`.
+
+    Args:
+        state_dir (str): Directory where the state is stored.
+
+    Returns:
+        pd.DataFrame: Latest event per user with 'next_expected_payment_date', or None if there is no state.
+    """
+    state = load_columnar_cache(os.path.join(state_dir, "user_state"), {"table": "user_state"})
+    if state is None:
+        return None
+
+    state = state.copy()
+    state["next_expected_payment_date"] = state["next_expected_payment_date"].to_numpy(dtype=object, na_value=None)
+    return state
+
+
+def save_events_checkpoint(checkpoint, state_dir):
+    """
+    Stores the checkpoint of the events file read into the state (see `events_checkpoint`), so the next
+    incremental run only reads the events appended after it. None removes a previous checkpoint.
+
+    Args:
+        checkpoint (dict, optional): Checkpoint of the events file.
+        state_dir (str): Directory where the state is stored.
+    """
+    checkpoint_file = os.path.join(state_dir, "events_checkpoint.json")
+    if checkpoint is None:
+        if os.path.exists(checkpoint_file):
+            os.remove(checkpoint_file)
+        return
+
+    os.makedirs(state_dir, exist_ok=True)
+    temporary_file = f"{checkpoint_file}.tmp-{os.getpid()}"
+    with open(temporary_file, "w", encoding="utf-8") as f:
+        json.dump(checkpoint, f)
+    os.replace(temporary_file, checkpoint_file)
+
+
+def load_events_checkpoint(state_dir, events_path):
+    """
+    Loads the checkpoint stored by `save_events_checkpoint`.
+
+    Args:
+        state_dir (str): Directory where the state is stored.
+        events_path (str): Path to the events file of the run.
+
+    Returns:
+        dict: The checkpoint, or None if there is none or it belongs to another events file.
+    """
+    checkpoint_file = os.path.join(state_dir, "events_checkpoint.json")
+    if not os.path.exists(checkpoint_file):
+        return None
+    with open(checkpoint_file, "r", encoding="utf-8") as f:
+        checkpoint = json.load(f)
+    if checkpoint.get("path") != os.path.abspath(events_path):
+        return None
+    return checkpoint
+
+
+def filter_new_events(df_events, state):
+    """
+    Boolean mask of the events later than the latest event stored for their user (a watermark per user);
+    every event of a user without a stored event is new. As in `latest_events_per_user`, missing timestamps
+    are the oldest ones and an event with the timestamp of the stored one is not later.
+
+    Args:
+        df_events (pd.DataFrame): Typed events.
+        state (pd.DataFrame): Per-user state (see `load_user_state`), one row per user.
+
+    Returns:
+        np.ndarray: Boolean mask over `df_events`.
+    """
+    stored_users = pd.Index(state["user.id"].to_numpy(dtype=object, na_value=None))
+    positions = stored_users.get_indexer(df_events["user.id"].to_numpy(dtype=object, na_value=None))
+
+    # Unknown users (-1) look up the extra slot at the end, which is never compared
+    watermarks = np.append(state["event.timestamp"].fillna(pd.Timestamp.min).to_numpy(), np.datetime64(pd.Timestamp.min))
+    timestamps = df_events["event.timestamp"].fillna(pd.Timestamp.min).to_numpy()
+    return (positions < 0) | (timestamps > watermarks[positions])
+
+
+def upsert_csv_rows(output_file, df_rows, user_ids, key_column):
+    """
+    Replaces the rows of the given users in a CSV output by `df_rows`, keeping the other rows untouched.
+    Rows are matched by the user id in `key_column`, found by its name in the header; the file is rewritten atomically.
+
+    The outputs of a full run are sorted by user id, so the new rows are merged in by their user id (the rows
+    of a user in the order of `df_rows`): after an update the output is the file a full run would write.
+
+    Args:
+        output_file (str): Path to the CSV output.
+        df_rows (pd.DataFrame): New rows of the users, with the same columns as the output.
+        user_ids (iterable of str): Users whose previous rows are replaced.
+        key_column (str): Column of the output with the user id of each row.
+    """
+    df_rows = df_rows.iloc[df_rows[key_column].astype(str).to_numpy().argsort(kind="stable")]
+    if not os.path.exists(output_file):
+        write_csv(df_rows, output_file, nanosecond_columns=BACKEND_NANOSECOND_COLUMNS)
+        return
+
+    user_ids = set(user_ids)
+    temporary_file = f"{output_file}.tmp-{os.getpid()}"
+    new_lines = render_csv(df_rows, nanosecond_columns=BACKEND_NANOSECOND_COLUMNS).splitlines(keepends=True)
+    new_rows = zip(df_rows[key_column].astype(str), new_lines)
+
+    with open(output_file, "r", encoding="utf-8", newline="") as source, \
+         open(temporary_file, "w", encoding="utf-8", newline="") as target:
+        header = source.readline()
+        columns = next(csv.reader([header]))
+        if key_column not in columns:
+            raise ValueError(f"{output_file} has no '{key_column}' column to update the rows of the users")
+        key_position = columns.index(key_column)
+
+        def kept_rows():
+            for line in source:
+                key = next(csv.reader([line]))[key_position]
+                if key not in user_ids:
+                    yield key, line
+
+        target.write(header)
+        for _, line in heapq.merge(kept_rows(), new_rows, key=lambda row: row[0]):
+            target.write(line)
+
+    os.replace(temporary_file, output_file)
+
+
+def run_incremental_reconciliation(events_path, df_backend, df_payment, state_dir,
+                                   discrepancies_file, payment_status_file, chunk_size=100_000, calendar=None,
+                                   payment_summary_file=None):
+    """
+    Reconciles only the users with events later than their stored latest event (see `filter_new_events`).
+
+    Only the events appended to the events file after the stored checkpoint are parsed. Without a checkpoint
+    that matches the file (compressed, replaced or rewritten files) the whole file is streamed instead, and
+    the same per-user filter keeps only the new events. The latest event and the 'next_expected_payment_date'
+    of the affected users are recalculated, joined with the backend and payment tables, and only their rows
+    are replaced in the CSV outputs and in the stored state, before the checkpoint moves past the events read.
+
+    Note that only event changes are tracked: changes in the backend tables of users without new events
+    require a full run.
+
+    Args:
+        events_path (str): Full path to the events file.
+        df_backend (pd.DataFrame): Typed backend table.
+        df_payment (pd.DataFrame): Typed payment schedule table.
+        state_dir (str): Directory of the per-user state.
+        discrepancies_file (str): Path to the discrepancies_in_payment_dates CSV output.
+        payment_status_file (str): Path to the payment_table_discrepancy CSV output.
+        chunk_size (int): Number of events parsed at a time.
+        calendar (dict, optional): Schedule calendar to look the payment days up in.
+        payment_summary_file (str, optional): Path to the payment_schedule_summary CSV output, updated too when given.
+
+    Returns:
+        np.ndarray: The ids of the users reconciled again, or None if there is no state yet (a full run is needed).
+    """
+    state = load_user_state(state_dir)
+    if state is None:
+        return None
+
+    # Only the appended events are parsed when the file still starts with the checkpointed bytes
+    checkpoint = load_events_checkpoint(state_dir, events_path)
+    appended = None if checkpoint is None else read_events_after(checkpoint, chunk_size)
+    if appended is not None:
+        new_events, checkpoint = appended
+        new_events = new_events[filter_new_events(new_events, state)]
+    else:
+        checkpoint = events_checkpoint(events_path)
+        new_events = pd.concat(
+            [chunk[filter_new_events(chunk, state)] for chunk in iter_events_chunks(events_path, chunk_size)],
+            ignore_index=True
+        )
+
+    new_events = remove_disabled_users(new_events, df_backend)
+    if new_events.empty:
+        save_events_checkpoint(checkpoint, state_dir)
+        return np.array([], dtype=object)
+
+    for column in EVENT_CATEGORY_COLUMNS:
+        new_events[column] = new_events[column].astype("category")
+
+    df_events_latest = latest_events_per_user(new_events)
+    df_events_latest["next_expected_payment_date"] = calculate_next_ocurrence_vectorized(
+        df_events_latest["event.timestamp"],
+        df_events_latest["allowance.scheduled.frequency"],
+        df_events_latest["allowance.scheduled.day"],
+        calendar=calendar
+    )
+    user_ids = df_events_latest["user.id"].to_numpy(dtype=object)
+
+    # Comparative and payment analyses only for the affected users
+    df_events_merged = compare_with_backend(df_events_latest, df_backend, calendar)
+    upsert_csv_rows(discrepancies_file, flag_discrepancies(df_events_merged), user_ids, "user.id")
+    df_payment_summary = summarize_payment_schedule(df_events_merged, aggregate_payment_schedule(df_payment))
+    upsert_csv_rows(payment_status_file, expand_payment_summary(df_payment_summary, df_payment)[PAYMENT_STATUS_COLUMNS], user_ids, "user_id")
+    if payment_summary_file is not None:
+        upsert_csv_rows(payment_summary_file, df_payment_summary[PAYMENT_SUMMARY_COLUMNS], user_ids, "user_id")
+
+    # The checkpoint moves after the state: events read again after an interruption are not later than it
+    state = pd.concat([state[~state["user.id"].isin(user_ids)], df_events_latest[USER_STATE_COLUMNS]], ignore_index=True)
+    save_user_state(state, state_dir)
+    save_events_checkpoint(checkpoint, state_dir)
+    return user_ids
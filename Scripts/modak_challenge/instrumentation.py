@@ -0,0 +1,192 @@
+"""
+Stage-level instrumentation of the pipeline runs.
+
+A run report collects one span per stage with its wall and CPU time, the peak memory and the number of
+input and output rows, and is written as JSON at the end of the run. Each top-level stage can also be
+profiled with cProfile. Without a report (`report=None`) a span is an empty context manager, so the
+instrumented code pays nothing but the call.
+"""
+
+import contextlib #For the spans as context managers.
+import cProfile #For the optional profile of each stage.
+import json #For the run report.
+import os #For the report and profile paths.
+import sys #For the platform of the peak RSS units.
+import time #For the wall and CPU times.
+import tracemalloc #For the peak traced memory of each stage.
+from datetime import datetime, timezone #For the start time of the run.
+
+try:
+    import resource #For the peak RSS of the process (not available on Windows).
+except ImportError:
+    resource = None
+
+
+def _max_rss_mb():
+    """
+    Peak resident set size of the process so far, in MB (None where it is not available).
+    """
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes and macOS bytes
+    return round(max_rss / (2 ** 20 if sys.platform == "darwin" else 2 ** 10), 3)
+
+
+def start_run_report(trace_memory=False, profile_dir=None):
+    """
+    Starts a run report.
+
+    Args:
+        trace_memory (bool): Whether to record the peak memory allocated in each stage with tracemalloc
+                             (exact, but slows the stages down).
+        profile_dir (str, optional): Directory where a cProfile file (<stage>.prof) of each top-level stage is written.
+
+    Returns:
+        dict: The report, to be passed to `span` and `finish_run_report`.
+    """
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    if profile_dir is not None:
+        os.makedirs(profile_dir, exist_ok=True)
+
+    return {
+        "started_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "options": {"trace_memory": trace_memory, "profile_dir": profile_dir},
+        "spans": [],
+        "_open": [],
+        "_start": (time.perf_counter(), time.process_time())
+    }
+
+
+@contextlib.contextmanager
+def _recorded_span(report, name, rows_in):
+    open_spans = report["_open"]
+    parent = open_spans[-1] if open_spans else None
+    record = {"stage": name, "parent": parent["stage"] if parent else None, "rows_in": rows_in, "rows_out": None}
+    report["spans"].append(record)
+
+    # The peak of a span includes the peaks of its nested spans
+    tracing = report["options"]["trace_memory"]
+    if tracing:
+        if parent is not None:
+            parent["_peak"] = max(parent["_peak"], tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+    record["_peak"] = 0
+
+    profiler = None
+    if report["options"]["profile_dir"] is not None and parent is None:
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    open_spans.append(record)
+    wall, cpu = time.perf_counter(), time.process_time()
+    try:
+        yield record
+    finally:
+        record["wall_seconds"] = round(time.perf_counter() - wall, 6)
+        record["cpu_seconds"] = round(time.process_time() - cpu, 6)
+        open_spans.pop()
+
+        if profiler is not None:
+            profiler.disable()
+            profile_path = os.path.join(report["options"]["profile_dir"], f"{name}.prof")
+            profiler.dump_stats(profile_path)
+            record["profile"] = profile_path
+
+        if tracing:
+            peak = max(record["_peak"], tracemalloc.get_traced_memory()[1])
+            record["peak_traced_mb"] = round(peak / 2 ** 20, 3)
+            if parent is not None:
+                parent["_peak"] = max(parent["_peak"], peak)
+            tracemalloc.reset_peak()
+        record["max_rss_mb"] = _max_rss_mb()
+        del record["_peak"]
+
+
+def span(report, name, rows_in=None):
+    """
+    Context manager measuring a stage of the run. The yielded record accepts the number of output rows:
+
+        with span(report, "payment_analysis", rows_in=len(df)) as stage:
+            result = ...
+            stage["rows_out"] = len(result)
+
+    Args:
+        report (dict or None): Report from `start_run_report`; None disables the instrumentation.
+        name (str): Name of the stage.
+        rows_in (int, optional): Number of input rows of the stage.
+
+    Returns:
+        A context manager yielding the record of the stage (a throwaway dict when disabled).
+    """
+    if report is None:
+        return contextlib.nullcontext({})
+    return _recorded_span(report, name, rows_in)
+
+
+@contextlib.contextmanager
+def measure():
+    """
+    Measures a block outside of any report, e.g. a stage run in a worker process, so it can be
+    recorded later with `record_span`. Yields the dict of measures, filled when the block exits.
+    """
+    measures = {}
+    wall, cpu = time.perf_counter(), time.process_time()
+    try:
+        yield measures
+    finally:
+        measures["wall_seconds"] = round(time.perf_counter() - wall, 6)
+        measures["cpu_seconds"] = round(time.process_time() - cpu, 6)
+        measures["max_rss_mb"] = _max_rss_mb()
+
+
+def record_span(report, name, measures, rows_in=None, rows_out=None, parent=None):
+    """
+    Records a stage measured with `measure` (e.g. in a worker process) as a span nested in the open span.
+
+    Args:
+        report (dict or None): Report from `start_run_report`; None records nothing.
+        name (str): Name of the stage.
+        measures (dict): Measures of the stage, from `measure`.
+        rows_in (int, optional): Number of input rows of the stage.
+        rows_out (int, optional): Number of output rows of the stage.
+        parent (str, optional): Name of the parent stage (default: the open span).
+    """
+    if report is None:
+        return
+    if parent is None and report["_open"]:
+        parent = report["_open"][-1]["stage"]
+    report["spans"].append({
+        "stage": name,
+        "parent": parent,
+        "rows_in": rows_in,
+        "rows_out": rows_out,
+        **measures
+    })
+
+
+def finish_run_report(report, path=None):
+    """
+    Completes the report with the totals of the run and writes it as JSON.
+
+    Args:
+        report (dict): Report from `start_run_report`.
+        path (str, optional): Path to the JSON file.
+
+    Returns:
+        dict: The completed report.
+    """
+    wall, cpu = report.pop("_start")
+    report.pop("_open")
+    report["wall_seconds"] = round(time.perf_counter() - wall, 6)
+    report["cpu_seconds"] = round(time.process_time() - cpu, 6)
+    report["max_rss_mb"] = _max_rss_mb()
+    if report["options"]["trace_memory"]:
+        tracemalloc.stop()
+
+    if path is not None:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    return report
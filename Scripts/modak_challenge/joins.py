@@ -0,0 +1,168 @@
+"""
+Index-based joins on the user id columns.
+
+The key index of a table groups its row positions by user id once (a stable sort of the key codes), and is
+kept for as long as the table lives, so every stage joining with the same table reuses it instead of
+building a new hash table per `pd.merge`. On top of it:
+- `semi_join` / `anti_join`: which rows of another table have (or don't have) a match, e.g. the disabled users.
+- `left_join`: the rows of a table with only the requested columns of the matches gathered by position,
+  with the rows and the order of `pd.merge(how='left')`.
+
+Missing ids match each other, as in `pd.merge`. Tables are treated as immutable once indexed.
+"""
+
+import weakref #For keeping the index of a table only while the table lives.
+
+import numpy as np #For the positions of the matches.
+import pandas as pd #For data manipulation and analysis.
+
+from .keys import is_encoded, user_codes
+
+
+# Key indexes of the live tables: {(id(table), column): (weak reference to the table, index)}
+_TABLE_INDEXES = {}
+
+
+def build_key_index(keys):
+    """
+    Builds the key index of a column of user ids.
+
+    Args:
+        keys (pd.Series): User ids, encoded (see `keys`) or not.
+
+    Returns:
+        dict: 'dictionary' (pd.Index of the ids; missing ids have the slot after it), 'slots' (slot of each row),
+              'order' (row positions grouped by slot, in table order), 'starts' and 'counts' (range of each slot
+              in 'order') and 'unique' (whether no id has several rows).
+    """
+    if is_encoded(keys):
+        dictionary = keys.cat.categories
+        codes = user_codes(keys)
+    else:
+        codes, dictionary = pd.factorize(keys)
+        dictionary = pd.Index(dictionary)
+
+    slots = np.where(codes < 0, len(dictionary), codes).astype(np.int64)
+    counts = np.bincount(slots, minlength=len(dictionary) + 1)
+    return {
+        "dictionary": dictionary,
+        "slots": slots,
+        "order": np.argsort(slots, kind="stable"),
+        "starts": np.cumsum(counts) - counts,
+        "counts": counts,
+        "unique": len(slots) == 0 or counts.max() <= 1
+    }
+
+
+def table_key_index(df, column):
+    """
+    Key index of `df[column]`, built on first use and reused while `df` lives.
+
+    Args:
+        df (pd.DataFrame): Indexed table.
+        column (str): Column of user ids.
+
+    Returns:
+        dict: Output of `build_key_index`.
+    """
+    entry = _TABLE_INDEXES.get((id(df), column))
+    if entry is not None and entry[0]() is df and len(entry[1]["slots"]) == len(df):
+        return entry[1]
+
+    index = build_key_index(df[column])
+    key = (id(df), column)
+    _TABLE_INDEXES[key] = (weakref.ref(df, lambda _: _TABLE_INDEXES.pop(key, None)), index)
+    return index
+
+
+def lookup_slots(index, keys):
+    """
+    Slots of the index matching each of `keys` (the missing-id slot for missing ids, -1 for unknown ids).
+    Keys encoded over the dictionary of the index are looked up by code, other encoded keys by their
+    categories and plain keys by value.
+    """
+    dictionary = index["dictionary"]
+    missing_slot = len(dictionary)
+    if is_encoded(keys):
+        if keys.cat.categories.equals(dictionary):
+            codes = user_codes(keys)
+            return np.where(codes < 0, missing_slot, codes)
+        category_slots = np.append(dictionary.get_indexer(keys.cat.categories), missing_slot)
+        return category_slots[user_codes(keys)]
+
+    slots = dictionary.get_indexer(keys.to_numpy(dtype=object, na_value=None))
+    slots[keys.isna().to_numpy()] = missing_slot
+    return slots
+
+
+def semi_join(keys, index, rows=None):
+    """
+    Boolean mask of the `keys` with a match in an indexed table (semi-join).
+
+    Args:
+        keys (pd.Series): User ids to look up.
+        index (dict): Key index of the other table.
+        rows (np.ndarray, optional): Boolean mask of the rows of the other table that can match
+                                     (e.g. the disabled users); default: all of them.
+
+    Returns:
+        np.ndarray: Boolean mask over `keys`.
+    """
+    if rows is None:
+        matched = index["counts"] > 0
+    else:
+        matched = np.zeros(len(index["counts"]), dtype=bool)
+        matched[index["slots"][np.asarray(rows, dtype=bool)]] = True
+
+    # Unknown ids (-1) look up the extra False slot at the end
+    return np.append(matched, False)[lookup_slots(index, keys)]
+
+
+def anti_join(keys, index, rows=None):
+    """
+    Boolean mask of the `keys` without a match in an indexed table (anti-join), see `semi_join`.
+    """
+    return ~semi_join(keys, index, rows)
+
+
+def left_join(left, left_on, right, right_on, columns=None):
+    """
+    Left join gathering only `columns` of `right` by position. The result has the rows and the order of
+    `pd.merge(left, right, left_on=left_on, right_on=right_on, how='left')`: every left row once per match
+    (the matches in the order of `right`), or once with missing values when it has none.
+
+    Args:
+        left (pd.DataFrame): Left table, whose columns are all kept.
+        left_on (str): Column of user ids of `left`.
+        right (pd.DataFrame): Right table, indexed on `right_on` (see `table_key_index`).
+        right_on (str): Column of user ids of `right`.
+        columns (list of str, optional): Columns of `right` to gather (default: all of them).
+                                         They must not be columns of `left`.
+
+    Returns:
+        pd.DataFrame: The joined table, with a clean sequential index.
+    """
+    index = table_key_index(right, right_on)
+    columns = list(right.columns) if columns is None else list(columns)
+
+    slots = lookup_slots(index, left[left_on])
+    counts = np.append(index["counts"], 0)[slots]
+    starts = np.append(index["starts"], 0)[slots]
+
+    # Row positions of the matches, with a -1 after them for the left rows without a match
+    order = np.append(index["order"], -1)
+    no_match = len(order) - 1
+    if index["unique"]:
+        joined = left.reset_index(drop=True)
+        right_rows = order[np.where(counts > 0, starts, no_match)]
+    else:
+        # Left rows repeated once per match (at least once), and the number of each match of a left row
+        repeats = np.maximum(counts, 1)
+        left_rows = np.repeat(np.arange(len(left)), repeats)
+        match_number = np.arange(len(left_rows)) - np.repeat(np.cumsum(repeats) - repeats, repeats)
+        joined = left.iloc[left_rows].reset_index(drop=True)
+        right_rows = order[np.where(np.repeat(counts, repeats) > 0, np.repeat(starts, repeats) + match_number, no_match)]
+
+    # Positions -1 aren't labels of the RangeIndex, so the rows without a match get missing values
+    gathered = right[columns].reset_index(drop=True).reindex(right_rows).reset_index(drop=True)
+    return pd.concat([joined, gathered], axis=1)
@@ -0,0 +1,101 @@
+"""
+Dictionary encoding of the user ids shared by the three tables.
+
+The user ids (UUID strings) are the join key of every stage: 'user.id' in the events, 'uuid' in the backend
+table and 'user_id' in the payment schedule table. The three columns are encoded as categoricals over one
+sorted dictionary of ids, so each id is stored once and every row holds a small integer code. Joins, filters,
+sorts and groupbys between encoded columns compare codes instead of hashing strings, the codes sort as the
+ids do, and the ids are only rendered back when the outputs are written.
+"""
+
+import numpy as np #For the code lookups.
+import pandas as pd #For the categorical columns.
+
+
+# Columns holding a user id, in the input tables and in the merged outputs
+USER_KEY_COLUMNS = ("user.id", "uuid", "user_id")
+
+
+def is_encoded(keys):
+    """
+    Whether a column of user ids is dictionary-encoded (categorical).
+    """
+    return isinstance(keys.dtype, pd.CategoricalDtype)
+
+
+def encode_tables(df_events, df_backend, df_payment=None):
+    """
+    Encodes the user id columns of the input tables over one shared dictionary.
+
+    Args:
+        df_events (pd.DataFrame): Typed events table.
+        df_backend (pd.DataFrame): Typed backend table.
+        df_payment (pd.DataFrame, optional): Typed payment schedule table.
+
+    Returns:
+        tuple: The tables (same order, the payment schedule table only when given) with encoded user ids.
+    """
+    tables = [(df_events, "user.id"), (df_backend, "uuid")]
+    if df_payment is not None:
+        tables.append((df_payment, "user_id"))
+
+    # A single sorted factorization of the ids of all the tables gives the dictionary and every code
+    values = pd.concat([df[column].astype("string") for df, column in tables], ignore_index=True)
+    codes, dictionary = pd.factorize(values, sort=True)
+    dtype = pd.CategoricalDtype(pd.Index(dictionary))
+
+    encoded = []
+    start = 0
+    for df, column in tables:
+        keys = pd.Categorical.from_codes(codes[start:start + len(df)], dtype=dtype)
+        encoded.append(df.assign(**{column: pd.Series(keys, index=df.index, name=column)}))
+        start += len(df)
+    return tuple(encoded)
+
+
+def user_codes(keys):
+    """
+    Integer codes of an encoded column of user ids (-1 for missing ids).
+    """
+    return keys.cat.codes.to_numpy()
+
+
+def restrict_user_dictionary(keys, selected):
+    """
+    Re-encodes an encoded column over a subset of its dictionary, e.g. the ids of one shard.
+
+    Args:
+        keys (pd.Series): Encoded user ids, all of them in the subset (or missing).
+        selected (np.ndarray): Boolean mask over the dictionary of `keys`.
+
+    Returns:
+        pd.Series: The ids as a categorical over the selected part of the dictionary.
+    """
+    new_codes = np.append(np.cumsum(selected) - 1, -1)
+    codes = new_codes[user_codes(keys)]
+    dtype = pd.CategoricalDtype(keys.cat.categories[selected])
+    return pd.Series(pd.Categorical.from_codes(codes, dtype=dtype), index=keys.index, name=keys.name)
+
+
+def restore_user_dictionary(df, dictionary):
+    """
+    Re-encodes the encoded user id columns of a table over `dictionary`, e.g. the shared dictionary of a
+    table built from shards (so the outputs of all the shards can be concatenated and sorted by code).
+
+    Args:
+        df (pd.DataFrame): Table with user id columns (see USER_KEY_COLUMNS).
+        dictionary (pd.Index): Dictionary containing the ids of every encoded column.
+
+    Returns:
+        pd.DataFrame: The table with its encoded user id columns over `dictionary`.
+    """
+    columns = {}
+    for column in USER_KEY_COLUMNS:
+        if column in df and is_encoded(df[column]) and not df[column].cat.categories.equals(dictionary):
+            keys = df[column]
+            new_codes = np.append(dictionary.get_indexer(keys.cat.categories), -1)
+            codes = new_codes[user_codes(keys)]
+            columns[column] = pd.Series(
+                pd.Categorical.from_codes(codes, dtype=pd.CategoricalDtype(dictionary)), index=keys.index, name=column
+            )
+    return df.assign(**columns) if columns else df
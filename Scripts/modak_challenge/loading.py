@@ -0,0 +1,719 @@
+"""
+Loading of the input files and conversion of their types.
+"""
+
+import os #For checking the input files.
+import array #For compact typed buffers while streaming the events file.
+import bz2 #For the bzip2-compressed events files.
+import collections #For the queue of blocks being parsed.
+import functools #For binding the file of the parsed byte ranges.
+import gzip #For the gzip-compressed events files.
+import hashlib #For the digest of the events already read by incremental runs.
+import io #For reading the compressed events files as text.
+import itertools #For peeking at the first decompressed blocks.
+import json #For reading data from the JSON file containing the events.
+import lzma #For the xz-compressed events files.
+import mmap #For parsing byte ranges of the NDJSON events files without reading them.
+from concurrent.futures import ProcessPoolExecutor #For parsing the NDJSON events on several cores.
+import numpy as np #For parsing the timestamps column by column.
+import pandas as pd #For data manipulation and analysis, converting JSON/CSV data into DataFrames.
+
+
+def load_initial_file(file_path, file_type="json"):
+    """
+    Loads a JSON or CSV file into a Pandas DataFrame.
+    
+    Args:
+        file_path (str): Full path to the file.
+        file_type (str): Type of file: 'json' or 'csv'.
+        
+    Returns:
+        pd.DataFrame: DataFrame loaded from the file.
+
+    Raises:
+        FileNotFoundError: If the file doesn't exist.
+        ValueError: If the file type is unknown or the file can't be parsed.
+    """
+    if not os.path.exists(file_path):
+        raise FileNotFoundError(f"File not found: {file_path}")
+
+    if file_type == "json":
+        with open(file_path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return pd.json_normalize(data)
+    if file_type == "csv":
+        return pd.read_csv(file_path)
+    raise ValueError(f"Unknown file type: {file_type} (expected 'json' or 'csv')")
+
+
+# Openers of the compressed events files, by file suffix (.zst needs the optional zstandard package)
+COMPRESSED_EVENT_OPENERS = {".gz": gzip.open, ".bz2": bz2.open, ".xz": lzma.open}
+
+# Minimum size of the byte ranges (or decompressed blocks) of an NDJSON file parsed by each worker
+NDJSON_RANGE_BYTES = 8 << 20
+
+
+def _open_events_file(file_path):
+    """
+    Opens an events file for reading bytes, decompressing it on the fly when its suffix is
+    .gz, .bz2, .xz or .zst.
+    """
+    suffix = os.path.splitext(file_path)[1].lower()
+    if suffix == ".zst":
+        try:
+            import zstandard #For the zstd-compressed events files.
+        except ImportError as error:
+            raise ImportError("Reading zstd-compressed events requires zstandard (pip install zstandard)") from error
+        return zstandard.open(file_path, "rb")
+    return COMPRESSED_EVENT_OPENERS.get(suffix, open)(file_path, "rb")
+
+
+def is_compressed_events_file(file_path):
+    """
+    Whether an events file is compressed (by its suffix, see `_open_events_file`).
+    """
+    return os.path.splitext(file_path)[1].lower() in (*COMPRESSED_EVENT_OPENERS, ".zst")
+
+
+def events_file_format(file_path):
+    """
+    Format of an events file, from its first non-blank character: 'json' for a JSON array of events,
+    'ndjson' for newline-delimited events (one JSON object per line, also for blank files without events).
+
+    Args:
+        file_path (str): Full path to the events file, plain or compressed.
+
+    Returns:
+        str: 'json' or 'ndjson'.
+    """
+    with _open_events_file(file_path) as f:
+        while True:
+            block = f.read(4096)
+            if not block:
+                return "ndjson"
+            start = block.lstrip()
+            if start:
+                return "json" if start.startswith(b"[") else "ndjson"
+
+
+# Characters at the end of a block within which a decode error means the value continues in the next block
+# (a partial literal, number or escape) rather than invalid JSON
+JSON_TRUNCATION_CHARS = 32
+
+
+def _is_truncated(error):
+    """
+    Whether a JSONDecodeError comes from the end of the decoded block (the value continues in the next one)
+    rather than from invalid JSON.
+    """
+    return error.msg.startswith("Unterminated string") or len(error.doc) - error.pos <= JSON_TRUNCATION_CHARS
+
+
+def _iter_json_array(file_path, read_size=1 << 20):
+    """
+    Yields the objects of a top-level JSON array one at a time, reading the file in blocks
+    of `read_size` characters, so the whole document never needs to be in memory.
+
+    A value cut by the end of a block is decoded again with the next block appended (the read doubles
+    while the value doesn't fit); any other decode error, or a missing comma between the objects, is raised
+    at once.
+
+    Args:
+        file_path (str): Full path to the JSON file. It must contain an array of objects.
+        read_size (int): Number of characters read from the file at a time.
+
+    Yields:
+        dict: Each object of the array, in file order.
+
+    Raises:
+        ValueError: If the file is not a well-formed JSON array (json.JSONDecodeError for invalid objects).
+    """
+    decoder = json.JSONDecoder()
+
+    with io.TextIOWrapper(_open_events_file(file_path), encoding="utf-8") as f:
+        buffer = f.read(read_size).lstrip()
+        if not buffer.startswith("["):
+            raise ValueError(f"Expected a JSON array in {file_path}")
+        position = 1
+        # What comes next: 'first' (an object or the closing bracket), 'value' (an object, after a comma)
+        # or 'separator' (a comma or the closing bracket, after an object)
+        expected = "first"
+
+        while True:
+            while position < len(buffer) and buffer[position] in " \t\r\n":
+                position += 1
+            if position == len(buffer):
+                buffer, position = f.read(read_size), 0
+                if not buffer:
+                    raise ValueError(f"Unterminated JSON array in {file_path}")
+                continue
+
+            if buffer[position] == "]" and expected != "value":
+                return
+            if expected == "separator":
+                if buffer[position] != ",":
+                    raise ValueError(f"Expected ',' or ']' between the objects of {file_path}, got {buffer[position]!r}")
+                position += 1
+                expected = "value"
+                continue
+
+            try:
+                item, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError as e:
+                if not _is_truncated(e):
+                    raise
+                # The value continues in the next block: keep the unread part and read at least as much again
+                block = f.read(max(read_size, len(buffer) - position))
+                if not block:
+                    raise
+                buffer = buffer[position:] + block
+                position = 0
+                continue
+
+            expected = "separator"
+            yield item
+
+
+def _iter_ndjson(lines):
+    """
+    Yields the events of lines of NDJSON (bytes), skipping the blank lines.
+    """
+    for line in lines:
+        if line.strip():
+            yield json.loads(line)
+
+
+def _iter_events(file_path):
+    """
+    Yields the events of an events file in file order, whatever its format (see `events_file_format`).
+    """
+    if events_file_format(file_path) == "json":
+        yield from _iter_json_array(file_path)
+        return
+    with _open_events_file(file_path) as f:
+        yield from _iter_ndjson(f)
+
+
+# Columns of the events table, in the order produced by pd.json_normalize
+EVENT_COLUMNS = [
+    "user.id",
+    "event.timestamp",
+    "event.name",
+    "allowance.scheduled.frequency",
+    "allowance.scheduled.day",
+    "allowance.amount"
+]
+
+# Columns of the events table stored as categorical codes
+EVENT_CATEGORY_COLUMNS = ["event.name", "allowance.scheduled.frequency"]
+
+
+def _iter_event_buffers(events, chunk_size, categories):
+    """
+    Fills typed columnar buffers with the parsed events, yielding them every `chunk_size` events
+    (None yields a single buffer with all of them).
+
+    Categorical columns are dictionary encoded on the fly: `categories` maps each categorical column
+    to a dict {label: code} shared by all chunks, so codes stay valid as new labels are found.
+
+    Yields:
+        dict: Column name -> NumPy array with the values of the chunk (int codes for categorical columns).
+    """
+    def new_buffers():
+        return {
+            "user.id": [],
+            "event.timestamp": [],
+            "event.name": array.array("i"),
+            "allowance.scheduled.frequency": array.array("i"),
+            "allowance.scheduled.day": [],
+            "allowance.amount": array.array("d")
+        }
+
+    def encode(column, label):
+        if label is None:
+            return -1
+        return categories[column].setdefault(label, len(categories[column]))
+
+    def to_arrays(buffers):
+        return {
+            "user.id": np.array(buffers["user.id"], dtype=object),
+            "event.timestamp": pd.to_datetime(buffers["event.timestamp"], format="%Y-%m-%d %H:%M:%S").to_numpy(),
+            "event.name": np.frombuffer(buffers["event.name"], dtype=np.int32),
+            "allowance.scheduled.frequency": np.frombuffer(buffers["allowance.scheduled.frequency"], dtype=np.int32),
+            "allowance.scheduled.day": np.array(buffers["allowance.scheduled.day"], dtype=object),
+            "allowance.amount": np.frombuffer(buffers["allowance.amount"], dtype=np.float64)
+        }
+
+    buffers = new_buffers()
+    size = 0
+
+    for event in events:
+        user = event.get("user") or {}
+        details = event.get("event") or {}
+        allowance = event.get("allowance") or {}
+        scheduled = allowance.get("scheduled") or {}
+        amount = allowance.get("amount")
+
+        buffers["user.id"].append(user.get("id"))
+        buffers["event.timestamp"].append(details.get("timestamp"))
+        buffers["event.name"].append(encode("event.name", details.get("name")))
+        buffers["allowance.scheduled.frequency"].append(encode("allowance.scheduled.frequency", scheduled.get("frequency")))
+        buffers["allowance.scheduled.day"].append(scheduled.get("day"))
+        buffers["allowance.amount"].append(np.nan if amount is None else amount)
+        size += 1
+
+        if size == chunk_size:
+            yield to_arrays(buffers)
+            buffers = new_buffers()
+            size = 0
+
+    if size:
+        yield to_arrays(buffers)
+
+
+def _events_frame(columns, categories):
+    """
+    Builds the typed events DataFrame from columnar buffers, with the same dtypes
+    the type conversion of the events table produces.
+    """
+    frame = {}
+    for column in EVENT_COLUMNS:
+        values = columns[column]
+        if column in EVENT_CATEGORY_COLUMNS:
+            labels = list(categories[column])
+            values = pd.Categorical.from_codes(values, categories=labels).set_categories(sorted(labels))
+        elif column in ("user.id", "allowance.scheduled.day"):
+            values = pd.array(values, dtype="string")
+        frame[column] = values
+    return pd.DataFrame(frame)
+
+
+def iter_events_chunks(file_path, chunk_size=100_000):
+    """
+    Streams the allowance events file as typed DataFrames of at most `chunk_size` events,
+    keeping memory bounded by the chunk size instead of the file size.
+
+    Args:
+        file_path (str): Full path to the events file (JSON array or NDJSON, plain or compressed).
+        chunk_size (int): Maximum number of events in each chunk.
+
+    Yields:
+        pd.DataFrame: Typed events ('category' for event.name and frequency, 'datetime64' for event.timestamp).
+    """
+    categories = {column: {} for column in EVENT_CATEGORY_COLUMNS}
+    for columns in _iter_event_buffers(_iter_events(file_path), chunk_size, categories):
+        yield _events_frame(columns, categories)
+
+
+def read_events(file_path, chunk_size=100_000, jobs=1):
+    """
+    Parses the allowance events file (JSON array or NDJSON, plain or compressed) into a single typed DataFrame,
+    incrementally. Only the typed columns are kept in memory: categorical codes for event.name and frequency,
+    datetime64 for event.timestamp, instead of the whole JSON document plus an object-dtype frame.
+
+    NDJSON files are parsed by up to `jobs` worker processes: plain files are split into byte ranges
+    aligned on line ends, which each worker parses through a memory map of the file, and compressed files
+    are decompressed here in blocks of whole lines that the workers parse. The typed columns of the parts
+    are concatenated in file order. JSON arrays are always parsed in this process.
+
+    Args:
+        file_path (str): Full path to the events file (JSON array or NDJSON, plain or compressed).
+        chunk_size (int): Number of events parsed into each intermediate buffer.
+        jobs (int, optional): Number of worker processes parsing an NDJSON file (None: one per CPU).
+
+    Returns:
+        pd.DataFrame: Typed events table.
+
+    Raises:
+        FileNotFoundError: If the file does not exist.
+    """
+    if not os.path.exists(file_path):
+        raise FileNotFoundError(f"File not found: {file_path}")
+
+    jobs = (os.cpu_count() or 1) if jobs is None else jobs
+    if jobs > 1 and events_file_format(file_path) == "ndjson":
+        columns, categories = _parse_ndjson_parallel(file_path, jobs)
+        return _events_frame(columns, categories)
+
+    categories = {column: {} for column in EVENT_CATEGORY_COLUMNS}
+    chunks = list(_iter_event_buffers(_iter_events(file_path), chunk_size, categories))
+    return _events_frame(_concatenate_buffers(chunks), categories)
+
+
+def parse_events(events):
+    """
+    Types events already parsed from JSON (dicts with the nested layout of the events file),
+    e.g. events received by the reconciliation service, as the loaders type the events file.
+
+    Args:
+        events (iterable of dict): Events, in order.
+
+    Returns:
+        pd.DataFrame: Typed events table.
+    """
+    categories = {column: {} for column in EVENT_CATEGORY_COLUMNS}
+    chunks = list(_iter_event_buffers(events, None, categories))
+    return _events_frame(_concatenate_buffers(chunks), categories)
+
+
+# Bytes at the start of the file and before the checkpointed offset that identify the events already read
+CHECKPOINT_DIGEST_BYTES = 4096
+
+
+def _checkpoint_digest(f, offset):
+    """SHA-256 of the first bytes of a file and of the bytes before `offset` (see CHECKPOINT_DIGEST_BYTES)."""
+    digest = hashlib.sha256()
+    f.seek(0)
+    digest.update(f.read(min(offset, CHECKPOINT_DIGEST_BYTES)))
+    f.seek(max(0, offset - CHECKPOINT_DIGEST_BYTES))
+    digest.update(f.read(offset - f.tell()))
+    return digest.hexdigest()
+
+
+def events_checkpoint(file_path):
+    """
+    Checkpoint of a plain events file, from which `read_events_after` reads only the events appended later.
+
+    The offset is the end of the last complete line of NDJSON, or the end of the last object of a JSON array
+    (before its closing bracket, which an append moves). The digest of the bytes before it tells whether the
+    file was only appended to since.
+
+    Args:
+        file_path (str): Full path to the events file.
+
+    Returns:
+        dict: 'path', 'format', 'offset' and 'digest', or None for compressed or missing files and for
+        JSON files that don't end a JSON array (they can only be read whole).
+    """
+    if not os.path.exists(file_path) or is_compressed_events_file(file_path):
+        return None
+
+    file_format = events_file_format(file_path)
+    size = os.path.getsize(file_path)
+    with open(file_path, "rb") as f:
+        if size == 0:
+            offset = 0
+        else:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                if file_format == "ndjson":
+                    offset = mm.rfind(b"\n") + 1
+                else:
+                    tail_start = max(0, size - CHECKPOINT_DIGEST_BYTES)
+                    tail = mm[tail_start:].rstrip()
+                    if not tail.endswith(b"]"):
+                        return None
+                    closing = tail_start + len(tail) - 1
+                    # End of the last object (or the opening bracket of an empty array)
+                    offset = closing
+                    while offset > 0 and mm[offset - 1:offset] in (b" ", b"\t", b"\r", b"\n"):
+                        offset -= 1
+        digest = _checkpoint_digest(f, offset)
+
+    return {"path": os.path.abspath(file_path), "format": file_format, "offset": offset, "digest": digest}
+
+
+def _iter_json_array_tail(text, after_bracket=False):
+    """
+    Yields the objects of the rest of a JSON array, from after an object (or after the opening bracket) to
+    the closing bracket, with the position in `text` after each of them.
+    """
+    decoder = json.JSONDecoder()
+    position = 0
+    # What comes next, as in `_iter_json_array`
+    expected = "first" if after_bracket else "separator"
+    while True:
+        while position < len(text) and text[position] in " \t\r\n":
+            position += 1
+        if position == len(text):
+            raise ValueError("The JSON array of the events is not closed")
+        if text[position] == "]" and expected != "value":
+            return
+        if expected == "separator":
+            if text[position] != ",":
+                raise ValueError(f"Expected ',' or ']' between the events, got {text[position]!r}")
+            position += 1
+            expected = "value"
+            continue
+        item, position = decoder.raw_decode(text, position)
+        expected = "separator"
+        yield item, position
+
+
+def read_events_after(checkpoint, chunk_size=100_000):
+    """
+    Parses the events appended to a plain events file since a checkpoint of `events_checkpoint`, reading
+    only the bytes after its offset. A last NDJSON line without its line end is left for the next read.
+
+    Args:
+        checkpoint (dict): Checkpoint of the events file (its 'path' is read).
+        chunk_size (int): Number of events parsed into each intermediate buffer.
+
+    Returns:
+        tuple: (typed events DataFrame of the appended events, checkpoint after them), or None when the file
+        no longer starts with the checkpointed bytes (it was replaced or rewritten) and must be read whole.
+    """
+    file_path = checkpoint["path"]
+    if not os.path.exists(file_path) or os.path.getsize(file_path) < checkpoint["offset"]:
+        return None
+
+    with open(file_path, "rb") as f:
+        if events_file_format(file_path) != checkpoint["format"] or _checkpoint_digest(f, checkpoint["offset"]) != checkpoint["digest"]:
+            return None
+
+        f.seek(checkpoint["offset"])
+        events = []
+        offset = checkpoint["offset"]
+        if checkpoint["format"] == "ndjson":
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                offset += len(line)
+                if line.strip():
+                    events.append(json.loads(line))
+        else:
+            f.seek(offset - 1)
+            after_bracket = f.read(1) == b"["
+            text = f.read().decode("utf-8")
+            end = 0
+            for event, end in _iter_json_array_tail(text, after_bracket):
+                events.append(event)
+            offset += len(text[:end].encode("utf-8"))
+        digest = _checkpoint_digest(f, offset)
+
+    categories = {column: {} for column in EVENT_CATEGORY_COLUMNS}
+    chunks = list(_iter_event_buffers(events, chunk_size, categories))
+    return _events_frame(_concatenate_buffers(chunks), categories), dict(checkpoint, offset=offset, digest=digest)
+
+
+def _concatenate_buffers(chunks):
+    """
+    Concatenates columnar buffers of events (typed empty columns when there are none).
+    """
+    columns = {
+        column: np.concatenate([chunk[column] for chunk in chunks]) if chunks else np.array([])
+        for column in EVENT_COLUMNS
+    }
+    if not chunks:
+        columns["event.timestamp"] = columns["event.timestamp"].astype("datetime64[ns]")
+        for column in EVENT_CATEGORY_COLUMNS:
+            columns[column] = columns[column].astype(np.int32)
+    return columns
+
+
+def _ndjson_ranges(file_path, n_ranges):
+    """
+    Splits a plain NDJSON file into at most `n_ranges` byte ranges (start, end) ending on line ends.
+    """
+    size = os.path.getsize(file_path)
+    if size == 0:
+        return []
+    with open(file_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        bounds = [0]
+        for number in range(1, n_ranges):
+            line_end = mm.find(b"\n", max(size * number // n_ranges, bounds[-1]))
+            if line_end == -1:
+                break
+            if line_end + 1 > bounds[-1]:
+                bounds.append(line_end + 1)
+    if bounds[-1] < size:
+        bounds.append(size)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def _parse_event_lines(lines):
+    """
+    Parses lines of NDJSON into typed columnar buffers (run in the worker processes).
+
+    Returns:
+        tuple: (dict of column buffers, or None without events, dict of the codes of the categorical columns)
+    """
+    categories = {column: {} for column in EVENT_CATEGORY_COLUMNS}
+    columns = next(_iter_event_buffers(_iter_ndjson(lines), None, categories), None)
+    return columns, categories
+
+
+def _iter_mmap_lines(mm, start, end):
+    """Yields the lines of a byte range of a memory map, copying one line at a time."""
+    while start < end:
+        line_end = mm.find(b"\n", start, end)
+        line_end = end if line_end == -1 else line_end + 1
+        yield mm[start:line_end]
+        start = line_end
+
+
+def _parse_ndjson_range(file_path, start, end):
+    """
+    Parses a byte range of a plain NDJSON file through a memory map (run in the worker processes).
+    """
+    with open(file_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        return _parse_event_lines(_iter_mmap_lines(mm, start, end))
+
+
+def _parse_ndjson_block(block):
+    """
+    Parses a block of whole NDJSON lines (run in the worker processes).
+    """
+    return _parse_event_lines(block.split(b"\n"))
+
+
+def _iter_ndjson_blocks(file_path, block_size):
+    """
+    Yields the decompressed content of a compressed NDJSON file in blocks of about `block_size` bytes
+    ending on line ends.
+    """
+    rest = b""
+    with _open_events_file(file_path) as f:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            block = rest + block
+            line_end = block.rfind(b"\n") + 1
+            rest = block[line_end:]
+            if line_end:
+                yield block[:line_end]
+    if rest:
+        yield rest
+
+
+def _merge_event_parts(parts):
+    """
+    Concatenates the typed columns parsed by the workers, in file order. Each part has its own codes
+    of the categorical columns, which are mapped to codes shared by all the parts.
+    """
+    categories = {column: {} for column in EVENT_CATEGORY_COLUMNS}
+    chunks = []
+    for columns, part_categories in parts:
+        if columns is None:
+            continue
+        for column in EVENT_CATEGORY_COLUMNS:
+            shared = categories[column]
+            new_codes = np.array([shared.setdefault(label, len(shared)) for label in part_categories[column]] + [-1], dtype=np.int32)
+            columns[column] = new_codes[columns[column]]
+        chunks.append(columns)
+    return _concatenate_buffers(chunks), categories
+
+
+def _parse_ndjson_parallel(file_path, jobs):
+    """
+    Parses an NDJSON file in a pool of `jobs` worker processes, by byte ranges of plain files
+    or by decompressed blocks of compressed files (see `read_events`). Files of a single range
+    or block are parsed in this process.
+
+    Returns:
+        tuple: (dict of the typed columns, dict of the codes of the categorical columns)
+    """
+    if not is_compressed_events_file(file_path):
+        n_ranges = min(jobs, -(-os.path.getsize(file_path) // NDJSON_RANGE_BYTES))
+        ranges = _ndjson_ranges(file_path, n_ranges)
+        if len(ranges) <= 1:
+            return _merge_event_parts([_parse_ndjson_range(file_path, start, end) for start, end in ranges])
+        starts, ends = zip(*ranges)
+        with ProcessPoolExecutor(max_workers=len(ranges)) as executor:
+            return _merge_event_parts(list(executor.map(functools.partial(_parse_ndjson_range, file_path), starts, ends)))
+
+    blocks = _iter_ndjson_blocks(file_path, NDJSON_RANGE_BYTES)
+    first_blocks = list(itertools.islice(blocks, 2))
+    if len(first_blocks) <= 1:
+        return _merge_event_parts([_parse_ndjson_block(block) for block in first_blocks])
+
+    # At most two blocks per worker wait in the pool, so the decompressed file is never held as a whole
+    parts = []
+    pending = collections.deque()
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        for block in itertools.chain(first_blocks, blocks):
+            pending.append(executor.submit(_parse_ndjson_block, block))
+            if len(pending) >= 2 * jobs:
+                parts.append(pending.popleft().result())
+        parts.extend(future.result() for future in pending)
+    return _merge_event_parts(parts)
+
+
+def parse_mixed_timestamps(values):
+    """
+    Parses a column mixing timestamp formats in a single pass: every value is classified by its shape
+    and each class is converted in bulk to timezone-naive datetime64[ns] (UTC wall time).
+
+    Detected formats:
+    - 'iso8601': ISO-8601 strings, with optional fraction (up to nanoseconds) and timezone (e.g. '2024-10-15T08:00:41.445627563Z').
+    - 'epoch_seconds': Unix timestamps in seconds (e.g. '1724659829').
+    - 'missing': empty or missing values.
+    - 'invalid': any other value, returned as NaT.
+
+    Args:
+        values (pd.Series or array-like): Timestamps as strings or numbers.
+
+    Returns:
+        tuple: (np.ndarray of datetime64[ns], dict with the number of values of each detected format)
+    """
+    text = pd.Series(values, copy=False).astype("string").str.strip()
+    missing = (text.isna() | (text == "")).to_numpy(dtype=bool)
+    epoch_seconds = text.str.fullmatch(r"-?\d+(\.\d+)?").fillna(False).to_numpy(dtype=bool)
+    iso8601 = text.str.match(r"\d{4}-\d{2}-\d{2}").fillna(False).to_numpy(dtype=bool) & ~epoch_seconds
+    invalid = ~(missing | epoch_seconds | iso8601)
+
+    result = np.full(len(text), np.datetime64("NaT"), dtype="datetime64[ns]")
+    if iso8601.any():
+        parsed = pd.to_datetime(text[iso8601], format="ISO8601", utc=True, errors="coerce")
+        result[iso8601] = parsed.dt.tz_localize(None).to_numpy(dtype="datetime64[ns]")
+    if epoch_seconds.any():
+        seconds = pd.to_numeric(text[epoch_seconds])
+        result[epoch_seconds] = pd.to_datetime(seconds, unit="s").to_numpy(dtype="datetime64[ns]")
+
+    counts = {
+        "iso8601": int(iso8601.sum()),
+        "epoch_seconds": int(epoch_seconds.sum()),
+        "missing": int(missing.sum()),
+        "invalid": int(invalid.sum())
+    }
+    return result, counts
+
+
+# Timestamp columns of the backend table written with all their nanosecond digits in the CSV outputs
+# ('updated_at' keeps the fraction of its ISO-8601 strings)
+BACKEND_NANOSECOND_COLUMNS = ["updated_at"]
+
+
+def convert_backend_types(allowance_backend_df, verbose=True):
+    """
+    Converts the columns of the allowance backend table to their proper data types.
+    'updated_at' mixes ISO-8601 strings and Unix timestamps, and 'creation_date' holds Unix timestamps:
+    both are parsed with `parse_mixed_timestamps` into timezone-naive datetimes.
+
+    Args:
+        allowance_backend_df (pd.DataFrame): Backend table as loaded from the CSV file.
+        verbose (bool): Whether to print the formats detected in the timestamp columns.
+
+    Returns:
+        pd.DataFrame: Typed backend table.
+    """
+    df_backend = allowance_backend_df.astype({
+        'uuid': 'string',
+        'frequency': 'category',
+        'day': 'string',
+        'next_payment_day': 'int',
+        'status': 'category'
+    })
+
+    for column in ('creation_date', 'updated_at'):
+        df_backend[column], formats = parse_mixed_timestamps(allowance_backend_df[column])
+        if verbose:
+            print(f"Formats detected in '{column}': {formats}")
+
+    return df_backend
+
+
+def convert_payment_types(payment_schedule_df):
+    """
+    Converts the columns of the payment schedule backend table to their proper data types.
+
+    Args:
+        payment_schedule_df (pd.DataFrame): Payment schedule table as loaded from the CSV file.
+
+    Returns:
+        pd.DataFrame: Typed payment schedule table.
+    """
+    return payment_schedule_df.astype({
+        'user_id': 'string',
+        'payment_date': 'int'
+    })
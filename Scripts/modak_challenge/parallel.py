@@ -0,0 +1,176 @@
+"""
+Parallel execution of the per-user stages, sharded by user id.
+
+Every stage after loading only combines rows of the same user, so the three tables are hash-partitioned
+by user id, each shard runs the stages in a process pool and the partial outputs are merged back in the
+order of a serial run.
+"""
+
+import functools #For binding the shared arguments of the shard tasks.
+from concurrent.futures import ProcessPoolExecutor #For running the shards on several cores.
+
+import numpy as np #For the shard numbers.
+import pandas as pd #For data manipulation and analysis.
+
+from .analysis import (
+    PAYMENT_STATUS_COLUMNS,
+    PAYMENT_SUMMARY_COLUMNS,
+    aggregate_payment_schedule,
+    compare_with_backend,
+    expand_payment_summary,
+    flag_discrepancies,
+    latest_events_per_user,
+    remove_disabled_users,
+    summarize_payment_schedule
+)
+from .duplicates import detect_duplicate_events
+from .keys import is_encoded, restore_user_dictionary, restrict_user_dictionary, user_codes
+from .schedule_engine import calculate_next_ocurrence_vectorized
+
+
+def shard_numbers(user_ids, n_shards):
+    """
+    Shard of each user id. The hash doesn't depend on the process (unlike `hash`), so every table and
+    every run assign a user to the same shard. Encoded ids (see `keys`) only hash their dictionary.
+
+    Args:
+        user_ids (array-like of str): User ids.
+        n_shards (int): Number of shards.
+
+    Returns:
+        np.ndarray: Shard number (0 to n_shards - 1) of each user id.
+    """
+    user_ids = pd.Series(user_ids, copy=False)
+    if is_encoded(user_ids):
+        # Shard of each id of the dictionary, and of the missing ids (code -1) in the last slot
+        dictionary_shards = shard_numbers(np.append(user_ids.cat.categories.to_numpy(dtype=object), ""), n_shards)
+        return dictionary_shards[user_codes(user_ids)]
+
+    values = user_ids.astype("string").fillna("").to_numpy(dtype=object)
+    return (pd.util.hash_array(values) % np.uint64(n_shards)).astype(np.int64)
+
+
+def partition_by_user(df, user_column, n_shards):
+    """
+    Splits a table into `n_shards` tables by the hash of the user id, keeping the order of the rows in each shard.
+    Encoded ids are re-encoded over the part of the dictionary in each shard, so a shard doesn't carry
+    the whole dictionary to its worker and its three tables still share a dictionary.
+
+    Args:
+        df (pd.DataFrame): Table to split.
+        user_column (str): Column with the user id ('user.id', 'uuid' or 'user_id').
+        n_shards (int): Number of shards.
+
+    Returns:
+        list of pd.DataFrame: The rows of each shard.
+    """
+    keys = df[user_column]
+    shards = shard_numbers(keys, n_shards)
+    parts = [df[shards == shard].reset_index(drop=True) for shard in range(n_shards)]
+    if not is_encoded(keys):
+        return parts
+
+    dictionary_shards = shard_numbers(keys.cat.categories, n_shards)
+    return [
+        part.assign(**{user_column: restrict_user_dictionary(part[user_column], dictionary_shards == shard)})
+        for shard, part in enumerate(parts)
+    ]
+
+
+def reconcile_shard(tables, calendar=None, tolerance_seconds=20, duplicate_lookback=1):
+    """
+    Runs the per-user stages of the pipeline over the tables of one shard.
+
+    Args:
+        tables (tuple): (events, backend, payment schedule) tables of the shard.
+        calendar (dict, optional): Schedule calendar to look the payment days up in.
+        tolerance_seconds (int): Maximum distance, in seconds, between duplicate events.
+        duplicate_lookback (int, optional): Number of latest events of each user checked for duplicates (None: all).
+
+    Returns:
+        dict: 'latest' (latest event per user with 'next_expected_payment_date'), 'discrepancies',
+              'payment_status' (with the 'user.id' of the events, also set for users without payment rows),
+              'payment_summary' (with the 'user.id' of the events) and 'duplicates' of the shard.
+    """
+    df_events, df_backend, df_payment = tables
+
+    df_events_latest = latest_events_per_user(remove_disabled_users(df_events, df_backend))
+    df_events_latest["next_expected_payment_date"] = calculate_next_ocurrence_vectorized(
+        df_events_latest["event.timestamp"],
+        df_events_latest["allowance.scheduled.frequency"],
+        df_events_latest["allowance.scheduled.day"],
+        calendar=calendar
+    )
+    df_events_merged = compare_with_backend(df_events_latest, df_backend, calendar)
+
+    df_payment_summary = summarize_payment_schedule(df_events_merged, aggregate_payment_schedule(df_payment))
+
+    df_compare = detect_duplicate_events(df_events, tolerance_seconds, lookback=duplicate_lookback)
+
+    return {
+        "latest": df_events_latest,
+        "discrepancies": flag_discrepancies(df_events_merged),
+        "payment_status": expand_payment_summary(df_payment_summary, df_payment),
+        "payment_summary": df_payment_summary,
+        "duplicates": df_compare[df_compare["timestamp_duplicated"] == True].drop(columns=["allowance.amount"])
+    }
+
+
+def merge_shard_outputs(shard_outputs, dictionary=None):
+    """
+    Merges the outputs of the shards. A serial run sorts its outputs by user id and each user is in a single
+    shard, so a stable sort by user id of the concatenated outputs gives the same rows in the same order,
+    whatever the number of shards.
+
+    Args:
+        shard_outputs (list of dict): Outputs of `reconcile_shard`.
+        dictionary (pd.Index, optional): Shared dictionary of the encoded user ids of the inputs, which the
+                                         ids of the outputs are encoded over again.
+
+    Returns:
+        dict: The merged outputs, with the same keys.
+    """
+    merged = {}
+    for name in ("latest", "discrepancies", "payment_status", "payment_summary", "duplicates"):
+        parts = [outputs[name] for outputs in shard_outputs]
+        if dictionary is not None:
+            parts = [restore_user_dictionary(part, dictionary) for part in parts]
+        df = pd.concat(parts, ignore_index=True)
+        merged[name] = df.sort_values("user.id", kind="stable").reset_index(drop=True)
+
+    merged["payment_status"] = merged["payment_status"][PAYMENT_STATUS_COLUMNS]
+    merged["payment_summary"] = merged["payment_summary"][PAYMENT_SUMMARY_COLUMNS]
+    return merged
+
+
+def reconcile_in_parallel(df_events, df_backend, df_payment, jobs, calendar=None, n_shards=None, tolerance_seconds=20,
+                          duplicate_lookback=1):
+    """
+    Runs the per-user stages over hash partitions of the tables in a process pool.
+
+    Args:
+        df_events (pd.DataFrame): Typed events table.
+        df_backend (pd.DataFrame): Typed backend table.
+        df_payment (pd.DataFrame): Typed payment schedule table.
+        jobs (int): Number of worker processes.
+        calendar (dict, optional): Schedule calendar to look the payment days up in.
+        n_shards (int, optional): Number of shards (default: 4 per worker, to balance uneven shards).
+        tolerance_seconds (int): Maximum distance, in seconds, between duplicate events.
+        duplicate_lookback (int, optional): Number of latest events of each user checked for duplicates (None: all).
+
+    Returns:
+        dict: The merged outputs of `reconcile_shard`.
+    """
+    n_shards = n_shards or 4 * jobs
+    shards = zip(
+        partition_by_user(df_events, "user.id", n_shards),
+        partition_by_user(df_backend, "uuid", n_shards),
+        partition_by_user(df_payment, "user_id", n_shards)
+    )
+    task = functools.partial(reconcile_shard, calendar=calendar, tolerance_seconds=tolerance_seconds, duplicate_lookback=duplicate_lookback)
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        shard_outputs = list(executor.map(task, shards))
+
+    dictionary = df_events["user.id"].cat.categories if is_encoded(df_events["user.id"]) else None
+    return merge_shard_outputs(shard_outputs, dictionary)
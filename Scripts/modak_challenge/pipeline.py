@@ -0,0 +1,734 @@
+"""
+Stages of the reconciliation pipeline and the full run over the three input files.
+
+Each stage receives the tables it needs and returns its result; the console output of the analyses
+(counts and previews of the tables) is only rendered when `verbose` is True.
+"""
+
+import os #For building the input and output paths.
+import pandas as pd #For data manipulation and analysis.
+
+from .analysis import (
+    PAYMENT_STATUS_COLUMNS,
+    PAYMENT_SUMMARY_COLUMNS,
+    aggregate_payment_schedule,
+    compare_with_backend,
+    expand_payment_summary,
+    flag_discrepancies,
+    latest_events_per_user,
+    remove_disabled_users,
+    summarize_payment_schedule
+)
+from .backfill import backfill_reconciliation, summarize_backfill
+from .concurrent_loading import INPUT_SOURCES, load_input_tables
+from .duplicates import detect_duplicate_events
+from .incremental import run_incremental_reconciliation, save_events_checkpoint, save_user_state
+from .instrumentation import span
+from .joins import semi_join, table_key_index
+from .keys import encode_tables
+from .loading import (
+    BACKEND_NANOSECOND_COLUMNS,
+    convert_backend_types,
+    convert_payment_types,
+    events_checkpoint,
+    events_file_format,
+    is_compressed_events_file,
+    load_initial_file
+)
+from .schedule_engine import calculate_next_ocurrence_vectorized, load_schedule_calendar
+from .sinks import check_output_format, output_path, write_output
+
+
+# Default names of the input files (in the data directory) and of the outputs (in the output directory)
+EVENTS_FILE = "allowance_events.json"
+EVENTS_NDJSON_FILE = "allowance_events.ndjson"
+BACKEND_FILE = "allowance_backend_table.csv"
+PAYMENT_SCHEDULE_FILE = "payment_schedule_backend_table.csv"
+DISCREPANCIES_FILE = "discrepancies_in_payment_dates.csv"
+PAYMENT_STATUS_FILE = "payment_table_discrepancy.csv"
+PAYMENT_SUMMARY_FILE = "payment_schedule_summary.csv"
+DUPLICATES_FILE = "timestamp_duplicates.csv"
+BACKFILL_FILE = "backfill_discrepancies.csv"
+BACKFILL_SUMMARY_FILE = "backfill_summary.csv"
+STREAM_FILE = "reconciliation_stream.ndjson"
+
+# Names of the events file looked up in the data directory, in order (NDJSON, plain or compressed, after the JSON array)
+EVENTS_FILES = (EVENTS_FILE, EVENTS_NDJSON_FILE, *(EVENTS_NDJSON_FILE + suffix for suffix in (".gz", ".bz2", ".xz", ".zst")))
+
+# Category column of each output split in partitions by `run_pipeline(partition=True)`
+PARTITION_COLUMNS = {
+    "discrepancies": "reason_of_discrepancy",
+    "payment_status": "payment_date_status",
+    "payment_summary": "payment_schedule_status"
+}
+
+
+def _logger(verbose):
+    """
+    Returns `print` when verbose, or a function that discards its arguments (so nothing is rendered).
+    """
+    if verbose:
+        return print
+    return lambda *args, **kwargs: None
+
+
+def find_events_file(data_dir):
+    """
+    Path of the events file of a data directory: the first of EVENTS_FILES that exists (EVENTS_FILE if none does).
+    """
+    for file_name in EVENTS_FILES:
+        path = os.path.join(data_dir, file_name)
+        if os.path.exists(path):
+            return path
+    return os.path.join(data_dir, EVENTS_FILE)
+
+
+def load_backend_table(path, verbose=True, report=None):
+    """
+    Loads the allowance backend table with its typed columns.
+    """
+    with span(report, "read_csv.backend") as stage:
+        df = load_initial_file(path, "csv")
+        stage["rows_out"] = len(df)
+    with span(report, "type_conversion.backend", rows_in=len(df)) as stage:
+        df = convert_backend_types(df, verbose)
+        stage["rows_out"] = len(df)
+    return df
+
+
+def load_payment_table(path, verbose=True, report=None):
+    """
+    Loads the payment schedule backend table with its typed columns.
+    """
+    with span(report, "read_csv.payment") as stage:
+        df = load_initial_file(path, "csv")
+        stage["rows_out"] = len(df)
+    with span(report, "type_conversion.payment", rows_in=len(df)) as stage:
+        df = convert_payment_types(df)
+        stage["rows_out"] = len(df)
+    return df
+
+
+def _write_output(df, name, outputs, sink, report=None):
+    """
+    Writes an output with the sink options of the run (in its own stage of the run report).
+    """
+    partition_by = PARTITION_COLUMNS.get(name) if sink["partition"] else None
+    with span(report, f"write.{os.path.basename(outputs[name])}", rows_in=len(df)):
+        write_output(df, outputs[name], sink["output_format"], sink["compression"], partition_by, sink["jobs"],
+                     BACKEND_NANOSECOND_COLUMNS)
+
+
+def load_calendar(cache_dir, *date_columns):
+    """
+    Loads the calendar index of the schedules over the range of the given date columns.
+
+    Args:
+        cache_dir (str, optional): Directory where the calendar is stored; None builds it in memory only.
+        *date_columns (pd.Series): Date columns whose range the calendar must cover.
+
+    Returns:
+        dict: The schedule calendar (see `build_schedule_calendar`).
+    """
+    dates_in_use = pd.concat(date_columns).dropna()
+    return load_schedule_calendar(cache_dir, dates_in_use.min(), dates_in_use.max())
+
+
+def analyze_disabled_users(df_events, df_backend, verbose=True):
+    """
+    Analysis of disabled users in the events and backend tables.
+
+    Args:
+        df_events (pd.DataFrame): Typed events table.
+        df_backend (pd.DataFrame): Typed backend table.
+        verbose (bool): Whether to print the analysis.
+
+    Returns:
+        pd.DataFrame: The events table without the events of disabled users.
+    """
+    log = _logger(verbose)
+
+    #Count users with 'disabled' status in backend table
+    disabled_users_backend = df_backend[df_backend["status"] == "disabled"]
+    num_disabled_users_backend = disabled_users_backend.shape[0]
+
+    # Display the number of users with 'disabled' status
+    log(f'Number of users with "disabled" status in the allowance_backend_table: {num_disabled_users_backend}')
+
+    # Print the users with 'disabled' status in allowance_backend_table
+    log("List of disabled users in the allowance_backend_table:")
+    log(disabled_users_backend)
+
+    # Display the backend table without the disabled users
+    log(df_backend[df_backend["status"] != "disabled"].reset_index(drop=True).head())
+
+    # Disabled users present in the events table
+    disabled = (df_backend["status"] == "disabled").to_numpy(dtype=bool)
+    disabled_users_events = df_events[semi_join(df_events["user.id"], table_key_index(df_backend, "uuid"), rows=disabled)]
+    disabled_user_ids_in_events = disabled_users_events["user.id"].unique()
+
+    # Display the number of disabled users present in the events table
+    log(f'Number of disabled users present in the events table: {len(disabled_user_ids_in_events)}')
+
+    #Remove these users from the df_events table, with a clean, sequential index after filtering
+    df_events_cleaned = remove_disabled_users(df_events, df_backend)
+
+    # Display the number of removed users
+    # The number of users removed in the df_events table is higher because a single user can be associated with multiple events.
+    log(f"Number of users removed: {len(df_events) - len(df_events_cleaned)}")
+
+    # Display the cleaned dataframe
+    log(f"The cleaned dataframe after removing disabled users is:")
+    log(df_events_cleaned.head())
+
+    return df_events_cleaned
+
+
+def analyze_latest_events(df_events_cleaned, df_backend, calendar=None, state_dir=None, verbose=True):
+    """
+    Comparative analysis of the payment dates expected from the latest event of each user
+    against the backend system dates.
+
+    Args:
+        df_events_cleaned (pd.DataFrame): Events table without the events of disabled users.
+        df_backend (pd.DataFrame): Typed backend table.
+        calendar (dict, optional): Schedule calendar to look the payment days up in.
+        state_dir (str, optional): Directory where the per-user state of the incremental mode is stored.
+        verbose (bool): Whether to print the analysis.
+
+    Returns:
+        pd.DataFrame: The latest events merged with the backend table (see `compare_with_backend`).
+    """
+    log = _logger(verbose)
+
+    ##### Filtering to keep only the latest entry per user #####
+    df_events_latest = latest_events_per_user(df_events_cleaned)
+
+    # Adding the 'next_expected_payment_date' column
+    df_events_latest["next_expected_payment_date"] = calculate_next_ocurrence_vectorized(
+        df_events_latest["event.timestamp"],
+        df_events_latest["allowance.scheduled.frequency"],
+        df_events_latest["allowance.scheduled.day"],
+        calendar=calendar
+    )
+    log(df_events_latest[["user.id", "event.timestamp", "next_expected_payment_date"]])
+
+    # Storing the per-user state used by the incremental mode in the next runs
+    if state_dir is not None:
+        save_user_state(df_events_latest, state_dir)
+
+    # Merging the latest events with df_backend and comparing the expected payment day with next_payment_day
+    # (is_next_payment_day_correct) and with the day calculated from updated_at (match_with_updated_at)
+    df_events_merged = compare_with_backend(df_events_latest, df_backend, calendar)
+
+    #Displaying results for first visual analysis
+    log(df_events_merged.head(30))
+
+    # Displaying new column next_payment_day_from_updated_at in dataframe:
+    log("Displaying new column next_payment_day_from_updated_at in dataframe:")
+    log(df_events_merged[['user.id', 'creation_date', 'frequency', 'day', 'updated_at', 'next_payment_day', 'next_payment_day_from_updated_at']])
+
+    return df_events_merged
+
+
+def analyze_discrepancies(df_events_merged, verbose=True):
+    """
+    Analysis of the payment date discrepancies in allowance_backend_table.
+
+    Args:
+        df_events_merged (pd.DataFrame): Output of `analyze_latest_events`.
+        verbose (bool): Whether to print the analysis.
+
+    Returns:
+        pd.DataFrame: The rows with discrepancies and their 'reason_of_discrepancy'.
+    """
+    log = _logger(verbose)
+
+    if verbose:
+        for is_correct in (True, False):
+            # Rows where match_with_updated_at is True, with is_next_payment_day_correct True and then False
+            filtered_rows = df_events_merged[(df_events_merged['match_with_updated_at'] == True) &
+                                             (df_events_merged['is_next_payment_day_correct'] == is_correct)]
+            percentage = (len(filtered_rows) / len(df_events_merged)) * 100
+
+            log(f"Percentage of rows where match_with_updated_at is TRUE and is_next_payment_day_correct is {str(is_correct).upper()}: {percentage:.2f}%")
+            log(f"Total number of records matching both criteria: {len(filtered_rows)}")
+            log(filtered_rows.head()) #adjust here if you want to see all filtered_rows
+
+    # Removing rows where 'match_with_updated_at' is True and 'is_next_payment_day_correct' is True,
+    # and adding reason_of_discrepancy to the remaining rows
+    df_events_adjusted = flag_discrepancies(df_events_merged)
+
+    if verbose:
+        # Count the number of rows for each category
+        category_counts = df_events_adjusted['reason_of_discrepancy'].value_counts()
+        log("Count of rows categorized by reason_of_discrepancy:")
+        log(category_counts)
+
+        # Print rows for each category
+        for category in category_counts.index:
+            log(f"\nRows categorized as '{category}':")
+            log(df_events_adjusted[df_events_adjusted['reason_of_discrepancy'] == category][['user.id', 'reason_of_discrepancy']].head())
+
+    return df_events_adjusted
+
+
+def analyze_payment_summary(df_events_merged, df_payment, verbose=True):
+    """
+    Per-user analysis of the payment schedule: the payment rows of each user are aggregated before the join,
+    so each user is categorized once and users with several (or no) payment rows are reported as such.
+
+    Args:
+        df_events_merged (pd.DataFrame): Output of `analyze_latest_events`.
+        df_payment (pd.DataFrame): Typed payment schedule table.
+        verbose (bool): Whether to print the analysis.
+
+    Returns:
+        pd.DataFrame: The payment schedule status of each user ('user.id' and PAYMENT_SUMMARY_COLUMNS).
+    """
+    log = _logger(verbose)
+
+    df_payment_aggregate = aggregate_payment_schedule(df_payment)
+    log(f"Users with several payment rows: {(df_payment_aggregate['payment_rows'] > 1).sum()}")
+
+    df_payment_summary = summarize_payment_schedule(df_events_merged, df_payment_aggregate)
+    log("Count of users categorized by payment_schedule_status:")
+    log(df_payment_summary['payment_schedule_status'].value_counts())
+
+    return df_payment_summary
+
+
+def analyze_payment_schedule(df_payment_summary, df_payment, verbose=True):
+    """
+    Analysis of the payment schedule backend table: the status of each payment row, derived from the
+    per-user summary (see `expand_payment_summary`).
+
+    Args:
+        df_payment_summary (pd.DataFrame): Output of `analyze_payment_summary`.
+        df_payment (pd.DataFrame): Typed payment schedule table.
+        verbose (bool): Whether to print the analysis.
+
+    Returns:
+        pd.DataFrame: The payment date status of each row (PAYMENT_STATUS_COLUMNS).
+    """
+    log = _logger(verbose)
+
+    if verbose:
+        # Checking for duplicates in the user_id column
+        user_id_counts = df_payment['user_id'].value_counts()
+        duplicate_user_ids = user_id_counts[user_id_counts > 1]
+        log(f"Number of duplicate user_ids: {len(duplicate_user_ids)}")
+        log(duplicate_user_ids)
+
+    # Expanding the users with several payment rows and categorizing the payment date matches in payment_date_status
+    df_payment_status = expand_payment_summary(df_payment_summary, df_payment)[PAYMENT_STATUS_COLUMNS]
+    log(df_payment_status.head())
+
+    return df_payment_status
+
+
+def analyze_duplicate_events(df_events, tolerance_seconds=20, lookback=1, verbose=True):
+    """
+    v2 - Additional analyses for timestamps duplicated in the events file.
+
+    Compares the `lookback` latest events of each user with the event before each of them (keeping the one
+    before it for the transitions), flagging events repeated within `tolerance_seconds` with the same frequency and day.
+
+    Args:
+        df_events (pd.DataFrame): Typed events table.
+        tolerance_seconds (int): Maximum distance, in seconds, between duplicate events.
+        lookback (int or None): Number of latest events of each user compared (None: the whole history).
+        verbose (bool): Whether to print the analysis.
+
+    Returns:
+        pd.DataFrame: The duplicate events with their transitions.
+    """
+    log = _logger(verbose)
+
+    # The compared events and the two before each of them come from a single sort of the events table
+    df_compare = detect_duplicate_events(df_events, tolerance_seconds=tolerance_seconds, lookback=lookback)
+
+    # Filter only the records with timestamp_duplicated = True
+    df_duplicates = df_compare[df_compare['timestamp_duplicated'] == True]
+
+    # Display the transitions and frequencies
+    log(f"Frequency Transitions:\n{df_duplicates['frequency_transition'].value_counts().reset_index()}\n")
+    log(f"Frequency Count:\n{df_duplicates['allowance.scheduled.frequency'].value_counts().reset_index()}\n")
+
+    return df_duplicates.drop(columns=['allowance.amount'])
+
+
+def run_pipeline(data_dir=".", output_dir=".", events_path=None, backend_path=None, payment_path=None,
+                 cache_dir=None, incremental=False, state_dir=None, quiet=False, jobs=1, report=None,
+                 output_format="csv", compression=None, partition=False, engine="pandas", work_dir=None,
+                 memory_limit_mb=512, load_jobs=len(INPUT_SOURCES), parse_jobs=1, duplicate_lookback=1):
+    """
+    Runs the full reconciliation and writes the outputs (CSV files by default).
+
+    Args:
+        data_dir (str): Directory of the input files with their default names.
+        output_dir (str): Directory where the outputs are written.
+        events_path (str, optional): Path to the events file, a JSON array or NDJSON, plain or compressed
+            (default: the first of EVENTS_FILES in data_dir).
+        backend_path (str, optional): Path to the allowance backend table (default: BACKEND_FILE in data_dir).
+        payment_path (str, optional): Path to the payment schedule table (default: PAYMENT_SCHEDULE_FILE in data_dir).
+        cache_dir (str, optional): Directory of the typed columnar cache and of the calendar index; None disables the cache.
+        incremental (bool): Whether to reconcile only the users with events later than their stored latest event,
+            parsing only the events appended since the last run (falls back to a full run when there is no state).
+        state_dir (str, optional): Directory of the per-user state of the incremental mode; None doesn't store it.
+        quiet (bool): Whether to skip the console output of the analyses.
+        jobs (int): Number of worker processes of the per-user stages. With more than one, the tables are
+            sharded by user id (see `reconcile_in_parallel`) and only the category counts are printed.
+            Large CSV outputs are also rendered by this number of processes.
+        report (dict, optional): Run report from `start_run_report`, where a span of each stage is recorded.
+        output_format (str): Format of the outputs: 'csv', 'parquet' or 'arrow' (Arrow IPC); see `sinks`.
+        compression (str, optional): Compression of the outputs (e.g. 'gzip' for CSV, 'zstd' for Parquet).
+        partition (bool): Whether to split the discrepancies and the payment status outputs in one file per
+            category (see PARTITION_COLUMNS), in directories named after the outputs.
+        engine (str): 'pandas' (in memory), 'sqlite', which runs the reconciliation out of core on an embedded
+            SQL engine (see `run_sql_reconciliation`), or 'external', which streams external sorts of the tables
+            by user through the stages in chunks (see `run_external_reconciliation`); both give the same CSV outputs.
+        work_dir (str, optional): Directory of the temporary files of the out-of-core engines (default: system temporary directory).
+        memory_limit_mb (int): Memory budget of the out-of-core engines, beyond which they spill to temporary files.
+        load_jobs (int): Number of worker processes loading the input tables concurrently (see `load_input_tables`);
+            1 loads them one after the other.
+        parse_jobs (int, optional): Number of worker processes parsing an NDJSON events file by byte ranges
+            (None: one per CPU; see `read_events`).
+        duplicate_lookback (int, optional): Number of latest events of each user checked for duplicates of the
+            event before them (None: the whole history; see `detect_duplicate_events`).
+
+    Returns:
+        dict: Paths of the outputs written ('discrepancies', 'payment_status', 'payment_summary' and, in full runs, 'duplicates').
+
+    Raises:
+        InputLoadError: If input tables could not be loaded.
+    """
+    verbose = not quiet
+    log = _logger(verbose)
+
+    events_path = events_path or find_events_file(data_dir)
+    backend_path = backend_path or os.path.join(data_dir, BACKEND_FILE)
+    payment_path = payment_path or os.path.join(data_dir, PAYMENT_SCHEDULE_FILE)
+
+    if incremental and (output_format != "csv" or compression is not None or partition):
+        raise ValueError("The incremental mode only updates uncompressed, unpartitioned CSV outputs")
+    check_output_format(output_format)
+    if duplicate_lookback is not None and duplicate_lookback < 1:
+        raise ValueError(f"The duplicate look-back must be a positive number of events or None, not {duplicate_lookback}")
+    if engine not in ("pandas", "sqlite", "external"):
+        raise ValueError(f"Unknown engine '{engine}' (expected 'pandas', 'sqlite' or 'external')")
+    if engine != "pandas" and (incremental or output_format != "csv" or compression is not None or partition):
+        raise ValueError(f"The {engine} engine only runs full reconciliations with uncompressed, unpartitioned CSV outputs")
+
+    os.makedirs(output_dir, exist_ok=True)
+    sink = {"output_format": output_format, "compression": compression, "partition": partition, "jobs": jobs}
+    outputs = {
+        name: output_path(output_dir, file_name, output_format, compression, partition and name in PARTITION_COLUMNS)
+        for name, file_name in (
+            ("discrepancies", DISCREPANCIES_FILE),
+            ("payment_status", PAYMENT_STATUS_FILE),
+            ("payment_summary", PAYMENT_SUMMARY_FILE),
+            ("duplicates", DUPLICATES_FILE)
+        )
+    }
+
+    if engine == "sqlite":
+        from .sql_engine import run_sql_reconciliation
+
+        with span(report, "sql_reconciliation") as stage:
+            counts = run_sql_reconciliation(
+                events_path, backend_path, payment_path, outputs, work_dir, cache_dir, memory_limit_mb,
+                duplicate_lookback=duplicate_lookback, log=log
+            )
+            stage["rows_out"] = sum(counts.values())
+        return outputs
+    if engine == "external":
+        from .external_sort import run_external_reconciliation
+
+        with span(report, "external_reconciliation") as stage:
+            counts = run_external_reconciliation(
+                events_path, backend_path, payment_path, outputs, work_dir, cache_dir, memory_limit_mb,
+                duplicate_lookback=duplicate_lookback, log=log
+            )
+            stage["rows_out"] = sum(counts.values())
+        return outputs
+
+    # The three tables are loaded concurrently; the events are left out of incremental runs, which only
+    # load them when there is no state to update
+    paths = {} if incremental else {"events": events_path}
+    paths.update(backend=backend_path, payment=payment_path)
+    # Checkpoint of the events file for the next incremental runs, taken before it is read
+    checkpoint = events_checkpoint(events_path) if state_dir is not None and not incremental else None
+    with span(report, "load_inputs") as stage:
+        tables = load_input_tables(paths, cache_dir, load_jobs, report, log, parse_jobs)
+        stage["rows_out"] = sum(len(df) for df in tables.values())
+    df_backend, df_payment = tables["backend"], tables["payment"]
+
+    if incremental:
+        if state_dir is None:
+            raise ValueError("The incremental mode requires a state directory")
+
+        # Calendar index over the backend dates (new events outside of it are calculated directly)
+        calendar = load_calendar(cache_dir, df_backend['updated_at'])
+        with span(report, "incremental_reconciliation") as stage:
+            affected_users = run_incremental_reconciliation(
+                events_path, df_backend, df_payment, state_dir, outputs["discrepancies"], outputs["payment_status"],
+                calendar=calendar, payment_summary_file=outputs["payment_summary"]
+            )
+            stage["rows_out"] = None if affected_users is None else len(affected_users)
+        if affected_users is not None:
+            log(f"Incremental reconciliation: {len(affected_users)} users updated in {outputs['discrepancies']}, {outputs['payment_status']} and {outputs['payment_summary']}")
+            del outputs["duplicates"]
+            return outputs
+        log("No reconciliation state found: running the full reconciliation")
+
+    if "events" in tables:
+        df_events = tables["events"]
+    else:
+        checkpoint = events_checkpoint(events_path)
+        with span(report, "load_inputs") as stage:
+            df_events = load_input_tables({"events": events_path}, cache_dir, 1, report, log, parse_jobs)["events"]
+            stage["rows_out"] = len(df_events)
+
+    # Calendar index of the schedules over the dates in use, built once per as-of date and reused across runs:
+    # the next payment days become a lookup by (date, frequency, day) instead of a calculation per row
+    with span(report, "calendar"):
+        calendar = load_calendar(cache_dir, df_events['event.timestamp'], df_backend['updated_at'])
+
+    # The user ids of the three tables become integer codes over one shared dictionary (see `keys`)
+    with span(report, "encode_user_keys", rows_in=len(df_events) + len(df_backend) + len(df_payment)):
+        df_events, df_backend, df_payment = encode_tables(df_events, df_backend, df_payment)
+
+    #Print to check if the data was correctly hadled
+    for df in (df_events, df_backend, df_payment):
+        log(df.dtypes)
+        log(df.head())
+
+    # Check where the conversion of 'updated_at' failed (values as 'NaT')
+    log(df_backend[df_backend['updated_at'].isna()])
+
+    if jobs > 1:
+        from .parallel import reconcile_in_parallel
+
+        # Per-user stages sharded by user id in a process pool, merged in the order of a serial run
+        with span(report, "parallel_reconciliation", rows_in=len(df_events)) as stage:
+            results = reconcile_in_parallel(df_events, df_backend, df_payment, jobs, calendar, duplicate_lookback=duplicate_lookback)
+            stage["rows_out"] = len(results["latest"])
+        if state_dir is not None:
+            save_user_state(results["latest"], state_dir)
+            save_events_checkpoint(checkpoint, state_dir)
+
+        for name in ("discrepancies", "payment_status", "payment_summary", "duplicates"):
+            _write_output(results[name], name, outputs, sink, report)
+
+        log("Count of rows categorized by reason_of_discrepancy:")
+        log(results["discrepancies"]['reason_of_discrepancy'].value_counts())
+        log("Count of rows categorized by payment_date_status:")
+        log(results["payment_status"]['payment_date_status'].value_counts())
+        log("Count of users categorized by payment_schedule_status:")
+        log(results["payment_summary"]['payment_schedule_status'].value_counts())
+        log(f"Frequency Transitions:\n{results['duplicates']['frequency_transition'].value_counts().reset_index()}\n")
+        log(f"Outputs saved to {outputs['discrepancies']}, {outputs['payment_status']}, {outputs['payment_summary']} and {outputs['duplicates']}")
+        return outputs
+
+    with span(report, "disabled_users", rows_in=len(df_events)) as stage:
+        df_events_cleaned = analyze_disabled_users(df_events, df_backend, verbose)
+        stage["rows_out"] = len(df_events_cleaned)
+
+    with span(report, "comparative_analysis", rows_in=len(df_events_cleaned)) as stage:
+        df_events_merged = analyze_latest_events(df_events_cleaned, df_backend, calendar, state_dir, verbose)
+        stage["rows_out"] = len(df_events_merged)
+    if state_dir is not None:
+        save_events_checkpoint(checkpoint, state_dir)
+
+    # Saving the discrepancies with the new 'reason_of_discrepancy' column
+    with span(report, "discrepancy_analysis", rows_in=len(df_events_merged)) as stage:
+        df_events_adjusted = analyze_discrepancies(df_events_merged, verbose)
+        stage["rows_out"] = len(df_events_adjusted)
+    _write_output(df_events_adjusted, "discrepancies", outputs, sink, report)
+    log(f"\nThe final DataFrame has been saved to {outputs['discrepancies']}")
+
+    with span(report, "payment_summary", rows_in=len(df_events_merged)) as stage:
+        df_payment_summary = analyze_payment_summary(df_events_merged, df_payment, verbose)
+        stage["rows_out"] = len(df_payment_summary)
+    _write_output(df_payment_summary[PAYMENT_SUMMARY_COLUMNS], "payment_summary", outputs, sink, report)
+
+    with span(report, "payment_analysis", rows_in=len(df_payment_summary)) as stage:
+        df_payment_status = analyze_payment_schedule(df_payment_summary, df_payment, verbose)
+        stage["rows_out"] = len(df_payment_status)
+    _write_output(df_payment_status, "payment_status", outputs, sink, report)
+
+    # Export the duplicate records
+    with span(report, "duplicate_analysis", rows_in=len(df_events)) as stage:
+        df_duplicates = analyze_duplicate_events(df_events, lookback=duplicate_lookback, verbose=verbose)
+        stage["rows_out"] = len(df_duplicates)
+    _write_output(df_duplicates, "duplicates", outputs, sink, report)
+    log(f"Duplicate file saved at: {os.path.abspath(outputs['duplicates'])}")
+
+    return outputs
+
+
+def run_backfill(start_date, end_date, frequency="D", data_dir=".", output_dir=".", events_path=None, backend_path=None,
+                 cache_dir=None, quiet=False, load_jobs=len(INPUT_SOURCES), parse_jobs=1):
+    """
+    Runs the reconciliation for every as-of date in [start_date, end_date] in one pass and writes
+    the per-user results and the daily summary of the discrepancy categories.
+
+    Args:
+        start_date (str or datetime): First as-of date.
+        end_date (str or datetime): Last as-of date.
+        frequency (str): Spacing of the as-of dates, as a pandas frequency (default: daily).
+        data_dir (str): Directory of the input files with their default names.
+        output_dir (str): Directory where the outputs are written.
+        events_path (str, optional): Path to the events file, a JSON array or NDJSON, plain or compressed
+            (default: the first of EVENTS_FILES in data_dir).
+        backend_path (str, optional): Path to the allowance backend table (default: BACKEND_FILE in data_dir).
+        cache_dir (str, optional): Directory of the typed columnar cache; None disables the cache.
+        quiet (bool): Whether to skip the console output.
+        load_jobs (int): Number of worker processes loading the input tables concurrently.
+        parse_jobs (int, optional): Number of worker processes parsing an NDJSON events file (None: one per CPU).
+
+    Returns:
+        dict: Paths of the outputs written ('backfill' and 'summary').
+
+    Raises:
+        InputLoadError: If input tables could not be loaded.
+    """
+    verbose = not quiet
+    log = _logger(verbose)
+
+    events_path = events_path or find_events_file(data_dir)
+    backend_path = backend_path or os.path.join(data_dir, BACKEND_FILE)
+
+    os.makedirs(output_dir, exist_ok=True)
+    outputs = {
+        "backfill": os.path.join(output_dir, BACKFILL_FILE),
+        "summary": os.path.join(output_dir, BACKFILL_SUMMARY_FILE)
+    }
+
+    as_of_dates = pd.date_range(start_date, end_date, freq=frequency)
+    if as_of_dates.empty:
+        raise ValueError(f"No as-of dates between {start_date} and {end_date}")
+
+    tables = load_input_tables({"events": events_path, "backend": backend_path}, cache_dir, load_jobs, log=log, parse_jobs=parse_jobs)
+    df_events, df_backend = encode_tables(tables["events"], tables["backend"])
+
+    # The backfill only looks up the days calculated from updated_at (the expected days depend on each as-of date)
+    calendar = load_calendar(cache_dir, df_backend['updated_at'])
+
+    df_backfill = backfill_reconciliation(df_events, df_backend, as_of_dates, calendar)
+    df_backfill.to_csv(outputs["backfill"], index=False)
+
+    summary = summarize_backfill(df_backfill)
+    summary.to_csv(outputs["summary"], index=False)
+    log(summary.to_string(index=False))
+    log(f"\nBackfill of {len(as_of_dates)} as-of dates saved to {outputs['backfill']} and {outputs['summary']}")
+
+    return outputs
+
+
+def run_service(data_dir=".", events_path=None, backend_path=None, payment_path=None, cache_dir=None,
+                host=None, port=None, quiet=False, load_jobs=len(INPUT_SOURCES), parse_jobs=1):
+    """
+    Loads the three tables once and serves the per-user reconciliation over local HTTP until interrupted
+    (see `service` for the requests).
+
+    Args:
+        data_dir (str): Directory of the input files with their default names.
+        events_path (str, optional): Path to the events file (default: the first of EVENTS_FILES in data_dir).
+        backend_path (str, optional): Path to the allowance backend table (default: BACKEND_FILE in data_dir).
+        payment_path (str, optional): Path to the payment schedule table (default: PAYMENT_SCHEDULE_FILE in data_dir).
+        cache_dir (str, optional): Directory of the typed columnar cache and of the calendar index; None disables the cache.
+        host (str, optional): Address to listen on (default: DEFAULT_HOST of `service`).
+        port (int, optional): Port to listen on (default: DEFAULT_PORT of `service`).
+        quiet (bool): Whether to skip the console output.
+        load_jobs (int): Number of worker processes loading the input tables concurrently.
+        parse_jobs (int, optional): Number of worker processes parsing an NDJSON events file (None: one per CPU).
+
+    Raises:
+        InputLoadError: If input tables could not be loaded.
+    """
+    from .service import DEFAULT_HOST, DEFAULT_PORT, ReconciliationService, make_server
+
+    log = _logger(not quiet)
+
+    paths = {
+        "events": events_path or find_events_file(data_dir),
+        "backend": backend_path or os.path.join(data_dir, BACKEND_FILE),
+        "payment": payment_path or os.path.join(data_dir, PAYMENT_SCHEDULE_FILE)
+    }
+    tables = load_input_tables(paths, cache_dir, load_jobs, log=log, parse_jobs=parse_jobs)
+    calendar = load_calendar(cache_dir, tables["events"]["event.timestamp"], tables["backend"]["updated_at"])
+    service = ReconciliationService(tables["events"], tables["backend"], tables["payment"], calendar)
+
+    server = make_server(service, host or DEFAULT_HOST, DEFAULT_PORT if port is None else port)
+    log(f"Serving the reconciliation of {len(service.records)} users on http://{server.server_address[0]}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        log("Service stopped")
+    finally:
+        server.server_close()
+
+
+def run_stream(data_dir=".", output_dir=".", events_path=None, backend_path=None, payment_path=None, cache_dir=None,
+               output_path=None, checkpoint_path=None, follow=True, batch_events=1_000, poll_interval=0.5,
+               quiet=False, load_jobs=len(INPUT_SOURCES)):
+    """
+    Follows an append-only NDJSON events file and writes a record the moment a user's reconciliation
+    changes (see `streaming` for the records), resuming from the checkpoint of the previous run.
+
+    Args:
+        data_dir (str): Directory of the input files with their default names.
+        output_dir (str): Directory where the records and the checkpoint are written.
+        events_path (str, optional): Path to the plain NDJSON events file (default: EVENTS_NDJSON_FILE in data_dir).
+        backend_path (str, optional): Path to the allowance backend table (default: BACKEND_FILE in data_dir).
+        payment_path (str, optional): Path to the payment schedule table (default: PAYMENT_SCHEDULE_FILE in data_dir).
+        cache_dir (str, optional): Directory of the typed columnar cache and of the calendar index; None disables the cache.
+        output_path (str, optional): Path to the NDJSON records (default: STREAM_FILE in output_dir).
+        checkpoint_path (str, optional): Path to the checkpoint (default: the records path with '.checkpoint').
+        follow (bool): Whether to keep waiting for new events; False stops at the end of the file.
+        batch_events (int): Maximum number of event lines per micro-commit.
+        poll_interval (float): Seconds between two checks of the events file when it has no new lines.
+        quiet (bool): Whether to skip the console output.
+        load_jobs (int): Number of worker processes loading the backend tables concurrently.
+
+    Returns:
+        dict: Number of lines and records of each kind processed by this run.
+
+    Raises:
+        InputLoadError: If the backend tables could not be loaded.
+    """
+    from .streaming import StreamingReconciler
+
+    log = _logger(not quiet)
+
+    events_path = events_path or os.path.join(data_dir, EVENTS_NDJSON_FILE)
+    if not os.path.exists(events_path):
+        raise FileNotFoundError(f"File not found: {events_path}")
+    if is_compressed_events_file(events_path) or events_file_format(events_path) != "ndjson":
+        raise ValueError(f"The streaming mode follows a plain NDJSON events file, not {events_path}")
+    output_path = output_path or os.path.join(output_dir, STREAM_FILE)
+    checkpoint_path = checkpoint_path or f"{output_path}.checkpoint"
+    for path in (output_path, checkpoint_path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    paths = {
+        "backend": backend_path or os.path.join(data_dir, BACKEND_FILE),
+        "payment": payment_path or os.path.join(data_dir, PAYMENT_SCHEDULE_FILE)
+    }
+    tables = load_input_tables(paths, cache_dir, load_jobs, log=log)
+    # Calendar index over the backend dates (the dates of the events are not known in advance)
+    calendar = load_calendar(cache_dir, tables["backend"]["updated_at"])
+
+    reconciler = StreamingReconciler(
+        events_path, tables["backend"], tables["payment"], output_path, checkpoint_path, calendar, log=log
+    )
+    log(f"Following {events_path} from offset {reconciler.offset}, records in {output_path}")
+    try:
+        counts = reconciler.run(follow, batch_events, poll_interval)
+    except KeyboardInterrupt:
+        log(f"Stream stopped at offset {reconciler.offset}")
+        return None
+    log(f"Stream stopped at the end of {events_path} (offset {reconciler.offset}): {counts}")
+    return counts
@@ -0,0 +1,257 @@
+"""
+Reference (row by row) calculation of the payment schedules.
+
+This module only depends on the standard library, so the schedule functions can be imported
+(and called) without loading pandas.
+"""
+
+from datetime import datetime, timedelta #For manipulating dates and time intervals.
+
+
+# Reference date of the analysis: data reflects the backend tables up to December 3, 2024
+LIMIT_DATE = datetime(2024, 12, 3)
+
+# Python weekday numbers (monday = 0) for the days accepted by weekly and biweekly schedules
+WEEK_DAYS_MAP = {
+    "sunday": 6,
+    "monday": 0,
+    "tuesday": 1,
+    "wednesday": 2,
+    "thursday": 3,
+    "friday": 4,
+    "saturday": 5
+}
+
+
+def _is_missing(value):
+    """
+    Checks for null values without pandas: None, NaN and NaT are the only values not equal to themselves.
+    """
+    return value is None or value != value
+
+
+def calculate_next_ocurrence(start_date, frequency_type, target_day):
+    """
+    The function uses these inputs to determine the next occurrence of the specified frequency and day,
+    iterating until the calculated date reaches or exceeds a predefined limit (December 3, 2024).
+    
+    Args:
+        start_date (str, datetime, or pd.Timestamp): The initial date from which calculations will begin.
+        frequency_type (str): The frequency type for the calculation: 'weekly', 'biweekly', 'daily', or 'monthly'.
+        target_day (str): The target day for the calculation. For 'weekly' and 'biweekly', provide the day of the week (e.g., 'monday', 'sunday').
+                           For 'monthly', use 'first_day' or 'fifteenth_day'.
+
+    Returns:
+        str: The last calculated date in the format 'dd', or None if an invalid input is encountered.
+    """
+
+    # If start_date is NaT or null, return None to ignore
+    if _is_missing(start_date) or start_date == "NaT":
+        return None  
+
+    # If it's already a datetime (pd.Timestamp included), do nothing
+    if isinstance(start_date, datetime):
+        pass
+    else:
+        try:
+            # Remove milliseconds if present
+            start_date = start_date.split('.')[0]  
+            # Try to convert to datetime with time
+            start_date = datetime.strptime(start_date, "%Y-%m-%d %H:%M:%S")
+        except ValueError:
+            # If it fails, try the format without time
+            start_date = datetime.strptime(start_date, "%d/%m/%Y")
+
+    # Define the limit date as December 3, 2024
+    limit_date = LIMIT_DATE
+    result_date = None
+
+    while True:
+        if frequency_type == "weekly" or frequency_type == "biweekly":
+            if frequency_type == 'biweekly':
+                weekly_increment = 2
+            elif frequency_type == 'weekly':
+                weekly_increment = 1
+
+            week_days_map = {
+                "sunday": 6,
+                "monday": 0,
+                "tuesday": 1,
+                "wednesday": 2,
+                "thursday": 3,
+                "friday": 4,
+                "saturday": 5
+            }
+
+            if target_day not in week_days_map:
+                return "Invalid day for weekly or biweekly"
+
+            day_of_week = week_days_map[target_day]
+
+            # Calculate the next desired day in the week
+            days_until_next = (day_of_week - start_date.weekday()) % 7
+            if days_until_next == 0:
+                days_until_next = 7 * weekly_increment
+            else:
+                days_until_next += 7 * (weekly_increment - 1)
+
+            result_date = start_date + timedelta(days=days_until_next)
+
+        elif frequency_type == "daily":
+            # For daily, just add one day
+            result_date = start_date + timedelta(days=1)
+
+        elif frequency_type == "monthly":
+            # If frequency is monthly, adjust based on the day
+            if target_day == "first_day":
+                # If it's "first day", go to the first day of the next month
+                if start_date.month == 12:
+                    result_date = datetime(start_date.year + 1, 1, 1)
+                else:
+                    result_date = datetime(start_date.year, start_date.month + 1, 1)
+
+            elif target_day == "fifteenth_day":
+                # If it's "fifteenth day", check the current date
+                if start_date.day < 15:
+                    # If before or on the 15th, go to the 15th of the same month
+                    result_date = datetime(start_date.year, start_date.month, 15)
+                else:
+                    # If after the 15th, go to the 15th of the next month
+                    if start_date.month == 12:
+                        result_date = datetime(start_date.year + 1, 1, 15)
+                    else:
+                        result_date = datetime(start_date.year, start_date.month + 1, 15)
+            else:
+                return "Invalid day for monthly"
+
+        else:
+            return "Invalid frequency type"
+
+        # Update the start_date for the next calculation
+        start_date = result_date
+
+        # Check if the limit date has been reached
+        if result_date > limit_date:
+            break
+
+    # If the last date was on or before the limit, calculate once more
+    if result_date <= limit_date:
+        if frequency_type == "weekly" or frequency_type == "biweekly":
+            result_date += timedelta(weeks=weekly_increment)
+        elif frequency_type == "daily":
+            result_date += timedelta(days=1)
+        elif frequency_type == "monthly":
+            if target_day == "first_day":
+                if result_date.month == 12:
+                    result_date = datetime(result_date.year + 1, 1, 1)
+                else:
+                    result_date = datetime(result_date.year, result_date.month + 1, 1)
+            elif target_day == "fifteenth_day":
+                if result_date.month == 12:
+                    result_date = datetime(result_date.year + 1, 1, 15)
+                else:
+                    result_date = datetime(result_date.year, result_date.month + 1, 15)
+
+    return result_date.strftime("%d")
+
+
+
+def calculate_incremented_date(start_date, frequency_type, day):
+    """
+    Calculates the next exact occurrence based on the provided start date, frequency type, and target day.
+    This function does not use loops. It directly calculates the next valid date based on the given frequency
+    and target day.
+    
+    Args:
+        start_date (datetime or str): The initial date from which to calculate the next occurrence.
+        frequency_type (str): The frequency type, which can be 'weekly', 'biweekly', 'daily', or 'monthly'.
+        day (str): The target day to calculate the next occurrence. For 'weekly' or 'biweekly', this is a day of the week (e.g., 'monday'). 
+                   For 'monthly', it can be 'first_day' or 'fifteenth_day'.
+    
+    Returns:
+        str: The day of the month for the next occurrence in the format 'dd'.
+        If the calculation fails or the frequency type is invalid, returns an error message.
+    """
+
+    # If start_date is NaT or null, return None to ignore
+    if _is_missing(start_date) or start_date == "NaT":
+        return None  
+
+    # If already a datetime (pd.Timestamp included), do nothing
+    if isinstance(start_date, datetime):
+        pass
+    else:
+        try:
+            # Remove milliseconds if any
+            start_date = start_date.split('.')[0]  
+            # Try to convert to the format with time
+            start_date = datetime.strptime(start_date, "%Y-%m-%d %H:%M:%S")
+        except ValueError:
+            # If it fails, try the format without time
+            start_date = datetime.strptime(start_date, "%d/%m/%Y")
+
+    result_date = None
+
+    # Handle the frequency calculation
+    if frequency_type == "weekly" or frequency_type == "biweekly":
+        weekly_increment = 1 if frequency_type == "weekly" else 2
+        
+        week_days = {
+            "sunday": 6,
+            "monday": 0,
+            "tuesday": 1,
+            "wednesday": 2,
+            "thursday": 3,
+            "friday": 4,
+            "saturday": 5
+        }
+
+        if day not in week_days:
+            return "Invalid day for weekly or biweekly"
+
+        day_of_week = week_days[day]
+
+        # Calculate the next desired day in the week
+        days_until_next = (day_of_week - start_date.weekday()) % 7
+        if days_until_next == 0:
+            days_until_next = 7 * weekly_increment
+        else:
+            days_until_next += 7 * (weekly_increment - 1)
+
+        result_date = start_date + timedelta(days=days_until_next)
+    
+    elif frequency_type == "daily":
+        # For daily, just add one day
+        result_date = start_date + timedelta(days=1)
+
+    elif frequency_type == "monthly":
+        # If the frequency is monthly, adjust based on the day
+        if day == "first_day":
+            # If "first day", go to the first day of the next month
+            if start_date.month == 12:
+                result_date = datetime(start_date.year + 1, 1, 1)
+            else:
+                result_date = datetime(start_date.year, start_date.month + 1, 1)
+        
+        elif day == "fifteenth_day":
+            # If "fifteenth day", check the current date
+            if start_date.day < 15:
+                # If before or on the 15th, go to the 15th of the same month
+                result_date = datetime(start_date.year, start_date.month, 15)
+            else:
+                # If after the 15th, go to the 15th of the next month
+                if start_date.month == 12:
+                    result_date = datetime(start_date.year + 1, 1, 15)
+                else:
+                    result_date = datetime(start_date.year, start_date.month + 1, 15)
+        else:
+            return "Invalid day for monthly"
+
+    else:
+        return "Invalid frequency type"
+
+    # Return the date formatted, if it was correctly calculated
+    if result_date is not None:
+        return result_date.strftime("%d")
+    else:
+        return "Error in date calculation"
@@ -0,0 +1,322 @@
+"""
+Vectorized schedule engine and calendar index of the payment schedules.
+"""
+
+import os #For the cache directory of the calendar index.
+import numpy as np #For vectorized date arithmetic over whole columns.
+import pandas as pd #For converting the input columns and returning nullable columns.
+
+from .schedule import LIMIT_DATE, WEEK_DAYS_MAP
+
+
+def _as_label_array(values):
+    """
+    Converts a column of labels (category, string or object) into a NumPy object array,
+    replacing missing values with an empty string so it can be compared element-wise.
+    """
+    return pd.Series(values, copy=False).astype("string").fillna("").to_numpy(dtype=object)
+
+
+def _schedule_dates(start_dates, frequency_types, target_days, limit_date=None):
+    """
+    Vectorized core of the schedule calculations, using NumPy datetime64[D] arithmetic.
+
+    For every row it computes the first scheduled date after the start date (the same date
+    `calculate_incremented_date` returns). When `limit_date` is given, that date is rolled forward
+    by whole periods until it is later than the limit, in closed form, reproducing the loop
+    in `calculate_next_ocurrence`.
+
+    Args:
+        start_dates (array-like of datetime64): Start date of each row. Missing values (NaT) are ignored.
+        frequency_types (array-like of str): 'weekly', 'biweekly', 'daily' or 'monthly'.
+        target_days (array-like of str): Day of the week, or 'first_day'/'fifteenth_day' for 'monthly'.
+        limit_date (datetime or array-like of datetime, optional): Date the result must be later than,
+                                                                   the same for every row or one per row.
+
+    Returns:
+        tuple: (np.ndarray of datetime64[D] with the calculated dates, NaT when no date could be calculated,
+                np.ndarray of object with the error message of each invalid row, None otherwise)
+    """
+    start = pd.to_datetime(pd.Series(start_dates, copy=False)).to_numpy(dtype="datetime64[ns]")
+    frequency = _as_label_array(frequency_types)
+    day = _as_label_array(target_days)
+
+    start_day = start.astype("datetime64[D]")
+    time_of_day = start - start_day.astype("datetime64[ns]")
+    present = ~np.isnat(start)
+
+    result = np.full(len(start), np.datetime64("NaT"), dtype="datetime64[D]")
+    errors = np.full(len(start), None, dtype=object)
+
+    # Masks for every supported combination of frequency and day
+    is_weekly = (frequency == "weekly") | (frequency == "biweekly")
+    target_weekday = pd.Series(day).map(WEEK_DAYS_MAP).to_numpy()
+    valid_weekday = ~np.isnan(target_weekday)
+    weekly = present & is_weekly & valid_weekday
+    daily = present & (frequency == "daily")
+    first_day = present & (frequency == "monthly") & (day == "first_day")
+    fifteenth_day = present & (frequency == "monthly") & (day == "fifteenth_day")
+
+    errors[present & is_weekly & ~valid_weekday] = "Invalid day for weekly or biweekly"
+    errors[present & (frequency == "monthly") & ~first_day & ~fifteenth_day] = "Invalid day for monthly"
+    errors[present & ~is_weekly & (frequency != "daily") & (frequency != "monthly")] = "Invalid frequency type"
+
+    # Weekly and biweekly: days until the next target weekday (1970-01-01 was a thursday, weekday 3)
+    weekly_increment = np.where(frequency == "biweekly", 2, 1)
+    weekday = (start_day.astype(np.int64) + 3) % 7
+    days_until_next = (np.nan_to_num(target_weekday).astype(np.int64) - weekday) % 7
+    days_until_next = np.where(days_until_next == 0, 7 * weekly_increment, days_until_next + 7 * (weekly_increment - 1))
+    result[weekly] = start_day[weekly] + days_until_next[weekly]
+
+    # Daily: the day after the start date
+    result[daily] = start_day[daily] + 1
+
+    # Monthly: the first day of the next month, or the next fifteenth day
+    start_month = start_day.astype("datetime64[M]")
+    start_day_of_month = (start_day - start_month.astype("datetime64[D]")).astype(np.int64) + 1
+    fifteenth_month = np.where(start_day_of_month < 15, start_month, start_month + 1)
+    result[first_day] = (start_month[first_day] + 1).astype("datetime64[D]")
+    result[fifteenth_day] = fifteenth_month[fifteenth_day].astype("datetime64[D]") + 14
+
+    if limit_date is not None:
+        if np.ndim(limit_date) == 0:
+            limit = np.full(len(start), np.datetime64(pd.Timestamp(limit_date).to_datetime64(), "ns"))
+        else:
+            limit = pd.to_datetime(pd.Series(limit_date, copy=False)).to_numpy(dtype="datetime64[ns]")
+
+        # Weekly and daily dates keep the time of the start date, so the first date later than the
+        # limit is the day after the limit shifted back by that time
+        threshold = (limit - time_of_day).astype("datetime64[D]") + 1
+        step = np.where(daily, 1, 7 * weekly_increment)
+        rolling = weekly | daily
+        gap = (threshold[rolling] - result[rolling]).astype(np.int64)
+        periods = np.where(gap > 0, -(-gap // step[rolling]), 0)
+        result[rolling] = result[rolling] + periods * step[rolling]
+
+        # Monthly dates are at midnight: move to the first matching month after the limit
+        limit_day = limit.astype("datetime64[D]") + 1
+        limit_month = limit_day.astype("datetime64[M]")
+        limit_day_of_month = (limit_day - limit_month.astype("datetime64[D]")).astype(np.int64) + 1
+        first_day_month = limit_month + (limit_day_of_month > 1).astype(np.int64)
+        fifteenth_day_month = limit_month + (limit_day_of_month > 15).astype(np.int64)
+        result[first_day] = np.maximum(result[first_day].astype("datetime64[M]"), first_day_month[first_day]).astype("datetime64[D]")
+        result[fifteenth_day] = np.maximum(result[fifteenth_day].astype("datetime64[M]"), fifteenth_day_month[fifteenth_day]).astype("datetime64[D]") + 14
+
+    return result, errors
+
+
+def _day_of_month(dates):
+    """
+    Returns the day of the month of a datetime64[D] array as integers (meaningless where the date is NaT).
+    """
+    return (dates - dates.astype("datetime64[M]").astype("datetime64[D]")).astype(np.int64) + 1
+
+
+def calculate_next_ocurrence_vectorized(start_dates, frequency_types, target_days, limit_date=LIMIT_DATE, calendar=None):
+    """
+    Vectorized version of `calculate_next_ocurrence` for whole columns.
+    Instead of iterating one period at a time until the limit date, the next occurrence is calculated
+    in closed form: modular weekday arithmetic for 'weekly'/'biweekly' and month arithmetic for 'monthly'.
+
+    Args:
+        start_dates (pd.Series or array-like of datetime64): The initial dates from which calculations will begin.
+        frequency_types (pd.Series or array-like of str): The frequency type of each row.
+        target_days (pd.Series or array-like of str): The target day of each row.
+        limit_date (datetime or array-like of datetime): The date the next occurrence must be later than
+                                                         (default: December 3, 2024), or one per row.
+        calendar (dict, optional): Schedule calendar from `load_schedule_calendar`. When given, the dates are
+                                   looked up in it (and its limit date is used) instead of being calculated.
+
+    Returns:
+        np.ndarray: Same values `calculate_next_ocurrence` returns for each row: the day in the format 'dd',
+        None for missing start dates, or the error message for invalid inputs.
+    """
+    if calendar is not None:
+        dates, errors = _calendar_dates(calendar, start_dates, frequency_types, target_days, after_limit=True)
+    else:
+        dates, errors = _schedule_dates(start_dates, frequency_types, target_days, limit_date)
+
+    calculated = ~np.isnat(dates)
+    next_ocurrence = errors.copy()
+    next_ocurrence[calculated] = np.char.zfill(_day_of_month(dates[calculated]).astype(str), 2).astype(object)
+    return next_ocurrence
+
+
+def calculate_incremented_date_vectorized(start_dates, frequency_types, days, calendar=None):
+    """
+    Vectorized version of `calculate_incremented_date` for whole columns.
+    Calculates the next exact occurrence after each start date, without a limit date.
+
+    Args:
+        start_dates (pd.Series or array-like of datetime64): The initial dates from which to calculate the next occurrence.
+        frequency_types (pd.Series or array-like of str): The frequency type of each row.
+        days (pd.Series or array-like of str): The target day of each row.
+        calendar (dict, optional): Schedule calendar from `load_schedule_calendar` to look the dates up in.
+
+    Returns:
+        pd.arrays.IntegerArray: The day of the month of the next occurrence (nullable 'Int64').
+        Rows with a missing start date or an invalid frequency/day combination are masked (<NA>)
+        instead of holding an error message.
+    """
+    if calendar is not None:
+        dates, _ = _calendar_dates(calendar, start_dates, frequency_types, days, after_limit=False)
+    else:
+        dates, _ = _schedule_dates(start_dates, frequency_types, days)
+    missing = np.isnat(dates)
+    return pd.arrays.IntegerArray(np.where(missing, 0, _day_of_month(dates)), missing)
+
+
+# Schedules of the calendar index, as (frequency, day) pairs ('daily' doesn't depend on the day)
+SCHEDULES = [(frequency, day) for frequency in ("weekly", "biweekly") for day in WEEK_DAYS_MAP] + [
+    ("daily", "daily"),
+    ("monthly", "first_day"),
+    ("monthly", "fifteenth_day")
+]
+SCHEDULE_CODES = {schedule: code for code, schedule in enumerate(SCHEDULES)}
+
+
+def _schedule_codes(frequency, day):
+    """
+    Integer-encodes the (frequency, day) of each row as its position in SCHEDULES (-1 when invalid),
+    along with the error message `calculate_next_ocurrence` returns for the invalid ones.
+    Only the distinct pairs are inspected, so the cost per row is a single gather.
+
+    Args:
+        frequency (np.ndarray): Frequency labels, as returned by `_as_label_array`.
+        day (np.ndarray): Day labels, as returned by `_as_label_array`.
+
+    Returns:
+        tuple: (np.ndarray of int with the schedule codes, np.ndarray of object with the error messages)
+    """
+    pair_codes, pairs = pd.factorize(pd.MultiIndex.from_arrays([frequency, day]))
+    pair_frequency = pairs.get_level_values(0).to_numpy(dtype=object)
+    pair_day = pairs.get_level_values(1).to_numpy(dtype=object)
+
+    schedule_of_pair = np.array([
+        SCHEDULE_CODES.get((f, "daily" if f == "daily" else d), -1) for f, d in zip(pair_frequency, pair_day)
+    ], dtype=np.int64)
+    _, errors_of_pair = _schedule_dates(np.full(len(pairs), np.datetime64("2000-01-01", "ns")), pair_frequency, pair_day)
+    return schedule_of_pair[pair_codes], errors_of_pair[pair_codes]
+
+
+def build_schedule_calendar(first_date, last_date, limit_date=LIMIT_DATE):
+    """
+    Precomputes a dense calendar index of the schedules: for every day between `first_date` and `last_date`
+    and every schedule in SCHEDULES, the next occurrence (as `calculate_incremented_date`) and the
+    occurrence after `limit_date` (as `calculate_next_ocurrence`).
+
+    Weekly and daily occurrences keep the time of the start date, so the occurrence after the limit is
+    stored twice: for start times up to the time of `limit_date` and for later start times.
+
+    Args:
+        first_date (datetime): First day of the calendar.
+        last_date (datetime): Last day of the calendar.
+        limit_date (datetime): The as-of date the occurrences must be later than.
+
+    Returns:
+        dict: 'start' (first day), 'limit_date', 'next' (days x schedules) and 'after_limit'
+              (days x schedules x 2) with datetime64[D] dates.
+    """
+    start = np.datetime64(pd.Timestamp(first_date).to_datetime64(), "D")
+    end = np.datetime64(pd.Timestamp(last_date).to_datetime64(), "D")
+    limit = np.datetime64(pd.Timestamp(limit_date).to_datetime64(), "ns")
+    limit_time = limit - limit.astype("datetime64[D]").astype("datetime64[ns]")
+
+    days = np.arange(start, end + 1, dtype="datetime64[D]")
+    grid_start = np.repeat(days, len(SCHEDULES)).astype("datetime64[ns]")
+    grid_frequency = np.tile(np.array([frequency for frequency, _ in SCHEDULES], dtype=object), len(days))
+    grid_day = np.tile(np.array([day for _, day in SCHEDULES], dtype=object), len(days))
+
+    next_dates, _ = _schedule_dates(grid_start, grid_frequency, grid_day)
+    on_time, _ = _schedule_dates(grid_start, grid_frequency, grid_day, limit)
+    late, _ = _schedule_dates(grid_start + limit_time + np.timedelta64(1, "ns"), grid_frequency, grid_day, limit)
+
+    return {
+        "start": start,
+        "limit_date": limit,
+        "next": next_dates.reshape(len(days), len(SCHEDULES)),
+        "after_limit": np.stack([on_time, late], axis=-1).reshape(len(days), len(SCHEDULES), 2)
+    }
+
+
+def _calendar_dates(calendar, start_dates, frequency_types, target_days, after_limit):
+    """
+    Looks the scheduled dates up in a calendar index, with the same outputs as `_schedule_dates`.
+    Start dates outside of the calendar are calculated directly.
+    """
+    start = pd.to_datetime(pd.Series(start_dates, copy=False)).to_numpy(dtype="datetime64[ns]")
+    frequency = _as_label_array(frequency_types)
+    day = _as_label_array(target_days)
+    schedule, errors = _schedule_codes(frequency, day)
+
+    present = ~np.isnat(start)
+    errors[~present] = None
+
+    start_day = start.astype("datetime64[D]")
+    position = np.where(present, (start_day - calendar["start"]).astype(np.int64), -1)
+    valid = present & (schedule >= 0)
+    indexed = valid & (position >= 0) & (position < len(calendar["next"]))
+
+    result = np.full(len(start), np.datetime64("NaT"), dtype="datetime64[D]")
+    if after_limit:
+        limit = calendar["limit_date"]
+        limit_time = limit - limit.astype("datetime64[D]").astype("datetime64[ns]")
+        late = ((start - start_day.astype("datetime64[ns]")) > limit_time).astype(np.int64)
+        result[indexed] = calendar["after_limit"][position[indexed], schedule[indexed], late[indexed]]
+    else:
+        limit = None
+        result[indexed] = calendar["next"][position[indexed], schedule[indexed]]
+
+    outside = valid & ~indexed
+    if outside.any():
+        result[outside], _ = _schedule_dates(start[outside], frequency[outside], day[outside], limit)
+
+    return result, errors
+
+
+def load_schedule_calendar(cache_dir, first_date, last_date, limit_date=LIMIT_DATE):
+    """
+    Returns a schedule calendar covering [first_date, last_date] for the as-of date `limit_date`.
+    The calendar is stored in `cache_dir`, one file per as-of date, and reused by the next runs while
+    it covers the dates in use; otherwise it is built again over whole years including both ranges.
+
+    Args:
+        cache_dir (str): Directory where the calendars are stored (None builds the calendar without storing it).
+        first_date (datetime): First date in use.
+        last_date (datetime): Last date in use.
+        limit_date (datetime): The as-of date.
+
+    Returns:
+        dict: The schedule calendar (see `build_schedule_calendar`).
+    """
+    first = np.datetime64(pd.Timestamp(first_date).to_datetime64(), "D")
+    last = np.datetime64(pd.Timestamp(last_date).to_datetime64(), "D")
+    if cache_dir is None:
+        return build_schedule_calendar(first, last, limit_date)
+
+    cache_file = os.path.join(cache_dir, f"schedule_calendar_{pd.Timestamp(limit_date):%Y%m%dT%H%M%S}.npz")
+    schedules = np.array([f"{frequency}|{day}" for frequency, day in SCHEDULES])
+
+    if os.path.exists(cache_file):
+        with np.load(cache_file) as stored:
+            calendar = {key: stored[key] for key in ("next", "after_limit")}
+            calendar["start"] = stored["start"][()]
+            calendar["limit_date"] = stored["limit_date"][()]
+            same_schedules = np.array_equal(stored["schedules"], schedules)
+        end = calendar["start"] + len(calendar["next"]) - 1
+        if same_schedules and calendar["start"] <= first and last <= end:
+            return calendar
+        if same_schedules:
+            first, last = min(first, calendar["start"]), max(last, end)
+
+    # Whole years, so that new dates rarely require a new calendar
+    first = first.astype("datetime64[Y]").astype("datetime64[D]")
+    last = (last.astype("datetime64[Y]") + 1).astype("datetime64[D]") - 1
+    calendar = build_schedule_calendar(first, last, limit_date)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    temporary_file = f"{cache_file}.tmp-{os.getpid()}"
+    with open(temporary_file, "wb") as f:
+        np.savez(f, schedules=schedules, **calendar)
+    os.replace(temporary_file, cache_file)
+    return calendar
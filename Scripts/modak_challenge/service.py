@@ -0,0 +1,303 @@
+"""
+Long-running reconciliation service with the per-user state in memory.
+
+The three tables are loaded once and every user with events is reconciled with the stages of the pipeline.
+The result of each user (latest schedule, expected next payment day, backend day, discrepancy category and
+payment_date rows with their status) is kept as a small record ready to be sent, so a query is a dictionary
+lookup. Appended events only reconcile their users again. The service answers over local HTTP:
+
+    GET  /users/<user_id>     the record of a user (404 if the user has no events)
+    POST /users               {"user_ids": [...]}: the records of several users and the ids not found
+    POST /events              an event or a list of events, in the layout of the events file
+    GET  /health              number of users and of events received
+
+Only event appends are tracked: changes of the backend tables need a restart.
+"""
+
+import json #For the requests and responses.
+import threading #For serializing the updates of the state.
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer #For the local HTTP interface.
+from urllib.parse import unquote #For the user ids in the paths.
+
+import numpy as np #For the masks of the updated users.
+import pandas as pd #For data manipulation and analysis.
+
+from .analysis import (
+    DISCREPANCY_RULES,
+    aggregate_payment_schedule,
+    classify_rows,
+    compare_with_backend,
+    expand_payment_summary,
+    latest_events_per_user,
+    remove_disabled_users,
+    summarize_payment_schedule
+)
+from .loading import parse_events
+from .schedule_engine import calculate_next_ocurrence_vectorized
+
+
+# Default address of the service (local connections only)
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+
+
+def json_value(value):
+    """
+    A value of a table as JSON: missing values as None, timestamps as 'YYYY-MM-DD HH:MM:SS[.f]'
+    and NumPy scalars as Python values.
+    """
+    if value is None or value is pd.NaT or (isinstance(value, float) and np.isnan(value)) or value is pd.NA:
+        return None
+    if isinstance(value, pd.Timestamp):
+        return str(value)
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def reconcile_user_records(df_events_latest, df_backend, df_payment, calendar=None, df_payment_aggregate=None):
+    """
+    Reconciles the latest event of each user with the backend tables and builds the record of each user.
+
+    Args:
+        df_events_latest (pd.DataFrame): Latest event per user (see `latest_events_per_user`).
+        df_backend (pd.DataFrame): Typed backend table.
+        df_payment (pd.DataFrame): Typed payment schedule table.
+        calendar (dict, optional): Schedule calendar to look the payment days up in.
+        df_payment_aggregate (pd.DataFrame, optional): `aggregate_payment_schedule` of df_payment, when it is
+                                                       kept between calls (default: aggregated here).
+
+    Returns:
+        dict: Record of each user id: 'latest_event', 'next_expected_payment_date', 'next_payment_day',
+              'next_payment_day_from_updated_at', 'is_next_payment_day_correct', 'match_with_updated_at',
+              'discrepancy', 'reason_of_discrepancy' and 'payments' (payment_date rows with their status).
+    """
+    df_events_latest = df_events_latest.reset_index(drop=True)
+    df_events_latest["next_expected_payment_date"] = calculate_next_ocurrence_vectorized(
+        df_events_latest["event.timestamp"],
+        df_events_latest["allowance.scheduled.frequency"],
+        df_events_latest["allowance.scheduled.day"],
+        calendar=calendar
+    )
+    df_events_merged = compare_with_backend(df_events_latest, df_backend, calendar)
+
+    # Same rules as `flag_discrepancies`, over every row (the rows without a discrepancy get no category)
+    discrepancy = ~(df_events_merged["match_with_updated_at"].to_numpy(dtype=bool)
+                    & df_events_merged["is_next_payment_day_correct"].to_numpy(dtype=bool))
+    reasons = np.asarray(classify_rows(df_events_merged, DISCREPANCY_RULES, default=""), dtype=object)
+
+    # Payment status of the users with payment_date rows, grouped by user in the order of the table
+    payments = {}
+    if df_payment_aggregate is None:
+        df_payment_aggregate = aggregate_payment_schedule(df_payment)
+    df_summary = summarize_payment_schedule(df_events_merged, df_payment_aggregate)
+    df_status = expand_payment_summary(df_summary, df_payment)
+    df_status = df_status[df_status["payment_date"].notna().to_numpy()]
+    for user_id, payment_date, status in zip(df_status["user.id"].astype(str), df_status["payment_date"], df_status["payment_date_status"].astype(str)):
+        payments.setdefault(user_id, []).append({"payment_date": int(payment_date), "payment_date_status": status})
+
+    records = {}
+    columns = {column: df_events_merged[column].to_numpy(dtype=object) for column in (
+        "user.id", "event.timestamp", "event.name", "allowance.scheduled.frequency", "allowance.scheduled.day",
+        "allowance.amount", "next_expected_payment_date", "next_payment_day", "next_payment_day_from_updated_at",
+        "is_next_payment_day_correct", "match_with_updated_at", "updated_at", "status"
+    )}
+    for row in range(len(df_events_merged)):
+        user_id = str(columns["user.id"][row])
+        records[user_id] = {
+            "user_id": user_id,
+            "latest_event": {
+                "timestamp": json_value(columns["event.timestamp"][row]),
+                "name": json_value(columns["event.name"][row]),
+                "frequency": json_value(columns["allowance.scheduled.frequency"][row]),
+                "day": json_value(columns["allowance.scheduled.day"][row]),
+                "amount": json_value(columns["allowance.amount"][row])
+            },
+            "next_expected_payment_date": json_value(columns["next_expected_payment_date"][row]),
+            "next_payment_day": json_value(columns["next_payment_day"][row]),
+            "next_payment_day_from_updated_at": json_value(columns["next_payment_day_from_updated_at"][row]),
+            "backend_updated_at": json_value(columns["updated_at"][row]),
+            "backend_status": json_value(columns["status"][row]),
+            "is_next_payment_day_correct": bool(columns["is_next_payment_day_correct"][row]),
+            "match_with_updated_at": bool(columns["match_with_updated_at"][row]),
+            "discrepancy": bool(discrepancy[row]),
+            "reason_of_discrepancy": reasons[row] if discrepancy[row] else None,
+            "payments": payments.get(user_id, [])
+        }
+    return records
+
+
+class ReconciliationService:
+    """
+    In-memory reconciliation state of every user, updated by event appends.
+
+    Args:
+        df_events (pd.DataFrame): Typed events table.
+        df_backend (pd.DataFrame): Typed backend table.
+        df_payment (pd.DataFrame): Typed payment schedule table.
+        calendar (dict, optional): Schedule calendar to look the payment days up in.
+    """
+
+    def __init__(self, df_events, df_backend, df_payment, calendar=None):
+        self.df_backend = df_backend
+        self.df_payment = df_payment
+        self.df_payment_aggregate = aggregate_payment_schedule(df_payment)
+        self.calendar = calendar
+        self.events_received = 0
+        self._lock = threading.Lock()
+
+        df_events_latest = latest_events_per_user(remove_disabled_users(df_events, df_backend))
+        self.records = reconcile_user_records(df_events_latest, df_backend, df_payment, calendar, self.df_payment_aggregate)
+        # Timestamp of the latest event of each user (missing timestamps are the oldest, as in the pipeline)
+        self._latest = dict(zip(
+            df_events_latest["user.id"].astype(str),
+            df_events_latest["event.timestamp"].fillna(pd.Timestamp.min).to_numpy()
+        ))
+
+    def query(self, user_id):
+        """
+        Record of a user, or None if the user has no events (or is disabled).
+        """
+        return self.records.get(user_id)
+
+    def query_many(self, user_ids):
+        """
+        Records of several users.
+
+        Returns:
+            dict: 'users' (record of each user found) and 'missing' (ids without a record).
+        """
+        users = {}
+        missing = []
+        for user_id in user_ids:
+            record = self.records.get(user_id)
+            if record is None:
+                missing.append(user_id)
+            else:
+                users[user_id] = record
+        return {"users": users, "missing": missing}
+
+    def append_events(self, events):
+        """
+        Adds events (dicts in the layout of the events file) and reconciles again the users whose latest
+        event changed. As in the pipeline, an event only replaces the latest one of its user when it is
+        strictly later, and the events of disabled users are ignored.
+
+        Args:
+            events (list of dict): New events.
+
+        Returns:
+            list of str: Ids of the users reconciled again.
+        """
+        df_events = parse_events(events)
+        with self._lock:
+            self.events_received += len(df_events)
+            df_events = remove_disabled_users(df_events, self.df_backend)
+            if df_events.empty:
+                return []
+
+            df_events_latest = latest_events_per_user(df_events)
+            user_ids = df_events_latest["user.id"].astype(str).to_numpy(dtype=object)
+            timestamps = df_events_latest["event.timestamp"].fillna(pd.Timestamp.min).to_numpy()
+            newer = np.array([
+                user_id not in self._latest or timestamp > self._latest[user_id]
+                for user_id, timestamp in zip(user_ids, timestamps)
+            ], dtype=bool)
+            if not newer.any():
+                return []
+
+            records = reconcile_user_records(
+                df_events_latest[newer], self.df_backend, self.df_payment, self.calendar, self.df_payment_aggregate
+            )
+            self.records.update(records)
+            self._latest.update(zip(user_ids[newer], timestamps[newer]))
+            return list(user_ids[newer])
+
+    def health(self):
+        """
+        Size of the state: number of users with a record and of events received since the start.
+        """
+        return {"users": len(self.records), "events_received": self.events_received}
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    """HTTP interface of a `ReconciliationService` (the server holds the service)."""
+
+    # Persistent connections, so a client doesn't pay a new connection per query, and the small
+    # responses sent at once instead of waiting for the acknowledgment of the headers (Nagle)
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def _send(self, status, body):
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"null")
+
+    def do_GET(self):
+        service = self.server.service
+        if self.path == "/health":
+            self._send(200, service.health())
+        elif self.path.startswith("/users/"):
+            user_id = unquote(self.path[len("/users/"):])
+            record = service.query(user_id)
+            if record is None:
+                self._send(404, {"error": f"No events of user {user_id}"})
+            else:
+                self._send(200, record)
+        else:
+            self._send(404, {"error": f"Unknown path {self.path}"})
+
+    def do_POST(self):
+        service = self.server.service
+        try:
+            body = self._read_json()
+        except ValueError as e:
+            self._send(400, {"error": f"Invalid JSON: {e}"})
+            return
+
+        if self.path == "/users":
+            user_ids = body.get("user_ids") if isinstance(body, dict) else None
+            if not isinstance(user_ids, list):
+                self._send(400, {"error": "Expected {\"user_ids\": [...]}"})
+                return
+            self._send(200, service.query_many([str(user_id) for user_id in user_ids]))
+        elif self.path == "/events":
+            events = body if isinstance(body, list) else [body]
+            if not all(isinstance(event, dict) for event in events):
+                self._send(400, {"error": "Expected an event object or a list of event objects"})
+                return
+            try:
+                updated = service.append_events(events)
+            except (TypeError, ValueError) as e:
+                self._send(400, {"error": f"Invalid events: {e}"})
+                return
+            self._send(200, {"updated_users": updated})
+        else:
+            self._send(404, {"error": f"Unknown path {self.path}"})
+
+    def log_message(self, format, *args):
+        # One line per request would dominate the latency of the queries
+        pass
+
+
+def make_server(service, host=DEFAULT_HOST, port=DEFAULT_PORT):
+    """
+    Creates the HTTP server of a service (port 0 picks a free port, see `server.server_address`).
+
+    Args:
+        service (ReconciliationService): The service answering the requests.
+        host (str): Address to listen on (default: local connections only).
+        port (int): Port to listen on.
+
+    Returns:
+        ThreadingHTTPServer: The server, to be run with `serve_forever()`.
+    """
+    server = ThreadingHTTPServer((host, port), _RequestHandler)
+    server.daemon_threads = True
+    server.service = service
+    return server
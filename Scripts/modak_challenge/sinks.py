@@ -0,0 +1,314 @@
+"""
+Output sinks of the reconciliation: CSV (optionally written in parallel chunks or appended in batches),
+Parquet and Arrow IPC, optionally partitioned by a category column.
+
+The date columns of the CSV outputs have explicit formats (see `csv_columns`), so the text of a row only
+depends on its own values and an output appended in batches is the same file as one written at once.
+
+Partitioned outputs are directories with one file per category in hive layout
+(`<output>/<column>=<value>/part-0.<ext>`), so readers such as pyarrow datasets can load a single category.
+The Parquet and Arrow IPC sinks need pyarrow, which is only imported when they are used; category
+columns are stored dictionary-encoded.
+"""
+
+import os #For the output paths.
+import shutil #For replacing the partitioned output directories.
+from concurrent.futures import ProcessPoolExecutor #For rendering the CSV chunks on several cores.
+from urllib.parse import quote #For the category values in the partition paths.
+
+import pandas as pd #For data manipulation and analysis.
+
+from .keys import USER_KEY_COLUMNS
+
+
+# Extension of each output format
+OUTPUT_FORMATS = {"csv": ".csv", "parquet": ".parquet", "arrow": ".arrow"}
+
+# Extension added to the CSV outputs compressed by pandas
+CSV_COMPRESSION_SUFFIXES = {"gzip": ".gz", "bz2": ".bz2", "xz": ".xz", "zstd": ".zst"}
+
+# Directory name of the partition of missing or empty category values (as written by pyarrow)
+DEFAULT_PARTITION = "__HIVE_DEFAULT_PARTITION__"
+
+# Rows rendered at a time by the chunked CSV writer
+CSV_CHUNK_ROWS = 50_000
+
+# Format of the whole seconds of the datetime columns of the CSV outputs
+CSV_DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def _import_pyarrow():
+    """Imports pyarrow, the optional dependency of the Parquet and Arrow IPC sinks."""
+    try:
+        import pyarrow as pa #For the Parquet and Arrow IPC outputs.
+    except ImportError as error:
+        raise ImportError("The parquet and arrow output formats require pyarrow (pip install pyarrow)") from error
+    return pa
+
+
+def check_output_format(output_format):
+    """
+    Checks that an output format is known and that its sink can be used, before the run starts.
+    """
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Unknown output format '{output_format}' (expected one of {', '.join(OUTPUT_FORMATS)})")
+    if output_format != "csv":
+        _import_pyarrow()
+
+
+def output_path(output_dir, file_name, output_format="csv", compression=None, partitioned=False):
+    """
+    Path of an output in the given format: the file name with the extension of the format,
+    or a directory named after the file for partitioned outputs.
+
+    Args:
+        output_dir (str): Directory of the outputs.
+        file_name (str): Default (CSV) name of the output, e.g. 'discrepancies_in_payment_dates.csv'.
+        output_format (str): One of OUTPUT_FORMATS.
+        compression (str, optional): Compression of the output (adds its suffix to compressed CSV files).
+        partitioned (bool): Whether the output is partitioned.
+
+    Returns:
+        str: The path of the output file or directory.
+    """
+    name = os.path.splitext(file_name)[0]
+    if partitioned:
+        return os.path.join(output_dir, name)
+    return os.path.join(output_dir, name + OUTPUT_FORMATS[output_format] + _compression_suffix(output_format, compression))
+
+
+def _compression_suffix(output_format, compression):
+    """Suffix of the compressed CSV files (the columnar formats compress inside the file)."""
+    if output_format == "csv" and compression is not None:
+        return CSV_COMPRESSION_SUFFIXES.get(compression, "")
+    return ""
+
+
+def _nanosecond_text(values, fraction_only=False):
+    """
+    Text of datetimes with nine fraction digits; with `fraction_only`, whole seconds are written without them.
+    """
+    nanoseconds = (values.dt.microsecond * 1000 + values.dt.nanosecond).astype("Int64")
+    text = values.dt.strftime(CSV_DATE_FORMAT) + "." + nanoseconds.astype(str).str.zfill(9)
+    if fraction_only:
+        text = text.where(nanoseconds.fillna(0).to_numpy() != 0, values.dt.strftime(CSV_DATE_FORMAT))
+    return text
+
+
+def csv_columns(df, nanosecond_columns=()):
+    """
+    Explicit CSV types of the date columns whose text pandas would otherwise choose from all the values of the
+    column (e.g. the fraction digits of the datetimes, or '2 days' in a timedelta column of whole days), so a
+    row has the same text whatever the other rows written with it:
+    - the datetime columns of `nanosecond_columns` become text with nine fraction digits;
+    - the values of the other datetime columns with a fraction of a second become text with nine fraction
+      digits, and their whole seconds are written with CSV_DATE_FORMAT;
+    - the timedelta columns become the text of each value ('-1 days +23:59:59.500000').
+
+    Args:
+        df (pd.DataFrame): Table to write as CSV.
+        nanosecond_columns (iterable of str): Datetime columns always written with their nanoseconds.
+
+    Returns:
+        pd.DataFrame: The table with its date columns as text where needed (missing values stay missing).
+    """
+    columns = {}
+    for column in df.columns:
+        values = df[column]
+        if pd.api.types.is_timedelta64_dtype(values.dtype):
+            columns[column] = values.map(str, na_action="ignore").astype(object)
+        elif pd.api.types.is_datetime64_dtype(values.dtype):
+            if column in nanosecond_columns:
+                columns[column] = _nanosecond_text(values)
+            elif (values.dt.microsecond.fillna(0) + values.dt.nanosecond.fillna(0)).to_numpy().any():
+                columns[column] = _nanosecond_text(values, fraction_only=True)
+    return df.assign(**columns) if columns else df
+
+
+def _render_csv_chunk(chunk, header):
+    """Renders a chunk of rows as CSV text (run in the worker processes)."""
+    return chunk.to_csv(index=False, header=header, date_format=CSV_DATE_FORMAT)
+
+
+def write_csv(df, path, jobs=1, compression=None, chunk_rows=CSV_CHUNK_ROWS, nanosecond_columns=()):
+    """
+    Writes a table as CSV, with the explicit types of its date columns (see `csv_columns`).
+
+    With several jobs the rows are split in chunks that are rendered as text in a process pool and
+    written in order. Compressed files are written by pandas in a single pass.
+
+    Args:
+        df (pd.DataFrame): Table to write.
+        path (str): Path to the CSV file.
+        jobs (int): Number of worker processes rendering the chunks.
+        compression (str, optional): Compression of the file, as in `DataFrame.to_csv`.
+        chunk_rows (int): Number of rows per chunk.
+        nanosecond_columns (iterable of str): Datetime columns always written with their nanoseconds.
+    """
+    df = csv_columns(df, nanosecond_columns)
+    if jobs <= 1 or compression is not None or len(df) <= chunk_rows:
+        df.to_csv(path, index=False, compression=compression, date_format=CSV_DATE_FORMAT)
+        return
+
+    starts = range(0, len(df), chunk_rows)
+    chunks = (df.iloc[start:start + chunk_rows] for start in starts)
+    headers = (start == 0 for start in starts)
+    with ProcessPoolExecutor(max_workers=jobs) as executor, open(path, "w", encoding="utf-8", newline="") as f:
+        for text in executor.map(_render_csv_chunk, chunks, headers):
+            f.write(text)
+
+
+def render_csv(df, header=False, nanosecond_columns=()):
+    """
+    Renders rows as CSV text, with the same text as `write_csv` (see `csv_columns`).
+
+    Args:
+        df (pd.DataFrame): Rows to render.
+        header (bool): Whether to render the header first.
+        nanosecond_columns (iterable of str): Datetime columns always written with their nanoseconds.
+
+    Returns:
+        str: The CSV text, one line per row.
+    """
+    return csv_columns(df, nanosecond_columns).to_csv(index=False, header=header, date_format=CSV_DATE_FORMAT)
+
+
+def append_csv(df, path, header=False, nanosecond_columns=()):
+    """
+    Appends rows to a CSV file, with the same text as `write_csv` (see `csv_columns`).
+
+    Args:
+        df (pd.DataFrame): Rows to append, with the columns of the file.
+        path (str): Path to the CSV file (created if it doesn't exist).
+        header (bool): Whether to write the header first.
+        nanosecond_columns (iterable of str): Datetime columns always written with their nanoseconds.
+    """
+    csv_columns(df, nanosecond_columns).to_csv(path, mode="a", header=header, index=False, date_format=CSV_DATE_FORMAT)
+
+
+class CsvBatchWriter:
+    """
+    CSV output written one batch of rows at a time, e.g. by the out-of-core engines. The batches are appended
+    to a temporary file next to the output (the first one with the header), which replaces the output when the
+    writer is closed, so a failed run leaves no partial output.
+
+    Args:
+        path (str): Path to the CSV output.
+        nanosecond_columns (iterable of str): Datetime columns always written with their nanoseconds.
+    """
+
+    def __init__(self, path, nanosecond_columns=()):
+        self.path = path
+        self.nanosecond_columns = nanosecond_columns
+        self.temporary_path = f"{path}.tmp-{os.getpid()}"
+        self.rows = 0
+        self.batches = 0
+        open(self.temporary_path, "w").close()
+
+    def append(self, df):
+        """Appends a batch of rows."""
+        append_csv(df, self.temporary_path, header=self.batches == 0, nanosecond_columns=self.nanosecond_columns)
+        self.batches += 1
+        self.rows += len(df)
+
+    def close(self):
+        """Replaces the output by the batches written."""
+        os.replace(self.temporary_path, self.path)
+
+    def discard(self):
+        """Removes the batches written, leaving the output untouched."""
+        if os.path.exists(self.temporary_path):
+            os.remove(self.temporary_path)
+
+
+def _arrow_table(df):
+    """
+    Converts a table to Arrow. Category columns become dictionary columns with only the categories in use,
+    and the encoded user ids (unique per row in the outputs) are written as plain strings.
+    """
+    pa = _import_pyarrow()
+
+    columns = {}
+    for column in df.columns:
+        if isinstance(df[column].dtype, pd.CategoricalDtype):
+            if column in USER_KEY_COLUMNS:
+                columns[column] = df[column].astype("string")
+            else:
+                columns[column] = df[column].cat.remove_unused_categories()
+    return pa.Table.from_pandas(df.assign(**columns), preserve_index=False)
+
+
+def write_columnar(df, path, output_format, compression=None):
+    """
+    Writes a table as Parquet or Arrow IPC (feather v2).
+
+    Args:
+        df (pd.DataFrame): Table to write.
+        path (str): Path to the file.
+        output_format (str): 'parquet' or 'arrow'.
+        compression (str, optional): Compression codec (e.g. 'snappy' or 'zstd' for Parquet, 'lz4' or 'zstd'
+                                     for Arrow IPC); default: the pyarrow default of the format.
+    """
+    table = _arrow_table(df)
+    if output_format == "parquet":
+        import pyarrow.parquet as pq #For the Parquet files.
+
+        pq.write_table(table, path, **({} if compression is None else {"compression": compression}))
+    else:
+        import pyarrow.feather as feather #For the Arrow IPC files.
+
+        feather.write_feather(table, path, **({} if compression is None else {"compression": compression}))
+
+
+def _write_file(df, path, output_format, compression, jobs, nanosecond_columns):
+    """Writes one file of an output in its format."""
+    if output_format == "csv":
+        write_csv(df, path, jobs, compression, nanosecond_columns=nanosecond_columns)
+    else:
+        write_columnar(df, path, output_format, compression)
+
+
+def partition_directory(column, value):
+    """
+    Hive-style directory name of the partition of a category value (`column=value`, URI-encoded).
+    """
+    if value is None or value != value or value == "":
+        return f"{column}={DEFAULT_PARTITION}"
+    return f"{column}={quote(str(value), safe='')}"
+
+
+def write_output(df, path, output_format="csv", compression=None, partition_by=None, jobs=1, nanosecond_columns=()):
+    """
+    Writes an output table with the sink of its format, in one file or partitioned by a category column.
+
+    Args:
+        df (pd.DataFrame): Table to write.
+        path (str): Path from `output_path` (a directory when partitioned).
+        output_format (str): One of OUTPUT_FORMATS.
+        compression (str, optional): Compression of the files.
+        partition_by (str, optional): Column whose values split the rows in partitions; the column is
+                                      left out of the files, as its value is in their path.
+        jobs (int): Number of worker processes of the CSV writer.
+        nanosecond_columns (iterable of str): Datetime columns always written with their nanoseconds in CSV.
+
+    Returns:
+        list of str: Paths of the files written.
+    """
+    extension = OUTPUT_FORMATS[output_format] + _compression_suffix(output_format, compression)
+    if partition_by is None:
+        _write_file(df, path, output_format, compression, jobs, nanosecond_columns)
+        return [path]
+
+    # The partitions of a previous run are replaced as a whole
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+
+    written = []
+    values = df[partition_by].astype("string").fillna("")
+    for value, rows in df.groupby(values.to_numpy(dtype=object), sort=True).indices.items():
+        directory = os.path.join(path, partition_directory(partition_by, value))
+        os.makedirs(directory, exist_ok=True)
+        file_path = os.path.join(directory, "part-0" + extension)
+        _write_file(df.iloc[rows].drop(columns=[partition_by]), file_path, output_format, compression, jobs, nanosecond_columns)
+        written.append(file_path)
+    return written
@@ -0,0 +1,284 @@
+"""
+Out-of-core execution of the reconciliation on an embedded SQL engine (sqlite3, from the standard library).
+
+The three input files are streamed in chunks into a database file on disk, so the tables are never held in
+memory as a whole. The engine runs the stages that need whole tables: the anti-join with the disabled users,
+the latest (and three latest) events of each user with window functions, and the joins with the backend
+tables, with its sorts spilling to temporary files beyond the memory limit. The per-user rules (schedules,
+comparisons and categories) run over batches of users with the functions of the in-memory pipeline, so both
+engines give the same outputs. The results of each batch are appended to the CSV outputs (see `CsvBatchWriter`).
+"""
+
+import os #For the work directory and the outputs.
+import sqlite3 #For the embedded SQL engine.
+import tempfile #For the database.
+
+import numpy as np #For the timestamps stored as integers.
+import pandas as pd #For data manipulation and analysis.
+
+from .analysis import (
+    PAYMENT_STATUS_COLUMNS,
+    PAYMENT_SUMMARY_COLUMNS,
+    aggregate_payment_schedule,
+    compare_with_backend,
+    expand_payment_summary,
+    flag_discrepancies,
+    summarize_payment_schedule
+)
+from .duplicates import detect_duplicate_events
+from .loading import BACKEND_NANOSECOND_COLUMNS, convert_backend_types, convert_payment_types, iter_events_chunks
+from .schedule_engine import calculate_next_ocurrence_vectorized, load_schedule_calendar
+from .sinks import CsvBatchWriter
+
+
+# Columns of each table: (column of the typed DataFrame, column of the SQL table)
+EVENT_SQL_COLUMNS = [
+    ("user.id", "user_id"),
+    ("event.timestamp", "ts"),
+    ("event.name", "name"),
+    ("allowance.scheduled.frequency", "frequency"),
+    ("allowance.scheduled.day", "day"),
+    ("allowance.amount", "amount")
+]
+BACKEND_SQL_COLUMNS = [(column, column) for column in
+                       ("uuid", "creation_date", "frequency", "day", "updated_at", "next_payment_day", "status")]
+PAYMENT_SQL_COLUMNS = [("user_id", "user_id"), ("payment_date", "payment_date")]
+
+# Users reconciled per batch, and rows inserted or fetched at a time
+SQL_BATCH_USERS = 50_000
+SQL_CHUNK_ROWS = 100_000
+
+# Timestamps of the latest events: missing ones are the oldest events, as in `latest_events_per_user`
+_LATEST_EVENTS_QUERY = """
+    SELECT {columns} FROM (
+        SELECT e.*, ROW_NUMBER() OVER (
+            PARTITION BY e.user_id ORDER BY COALESCE(e.ts, -9223372036854775808) DESC, e.seq
+        ) AS position
+        FROM events e
+        WHERE e.user_id IS NOT NULL
+          AND NOT EXISTS (SELECT 1 FROM backend b WHERE b.uuid = e.user_id AND b.status = 'disabled')
+    )
+    WHERE position = 1
+    ORDER BY user_id
+"""
+
+# Three latest events of each user in the order of a stable sort by user and timestamp (missing timestamps last)
+_RECENT_EVENTS_QUERY = """
+    SELECT {columns} FROM (
+        SELECT e.*, ROW_NUMBER() OVER (
+            PARTITION BY e.user_id ORDER BY e.ts IS NULL DESC, e.ts DESC, e.seq DESC
+        ) AS position
+        FROM events e
+        WHERE e.user_id IS NOT NULL
+    )
+    WHERE :window IS NULL OR position <= :window
+    ORDER BY user_id, ts IS NULL, ts, seq
+"""
+
+
+def _connect(database_path, memory_limit_mb):
+    """
+    Opens the work database: no journal (it is rebuilt on every run) and a page cache of at most
+    `memory_limit_mb`, beyond which sorts and indexes spill to temporary files.
+    """
+    connection = sqlite3.connect(database_path)
+    connection.execute("PRAGMA journal_mode = OFF")
+    connection.execute("PRAGMA synchronous = OFF")
+    connection.execute("PRAGMA temp_store = FILE")
+    connection.execute(f"PRAGMA cache_size = {-int(memory_limit_mb * 1024)}")
+    return connection
+
+
+def _sql_values(df, columns):
+    """
+    Rows of a typed chunk as tuples of SQL values: datetimes as int64 nanoseconds and missing values as NULL.
+    """
+    values = []
+    for column, _ in columns:
+        series = df[column]
+        missing = series.isna().to_numpy()
+        if pd.api.types.is_datetime64_dtype(series.dtype):
+            data = series.astype("datetime64[ns]").to_numpy().view(np.int64).astype(object)
+        elif pd.api.types.is_float_dtype(series.dtype) or pd.api.types.is_integer_dtype(series.dtype):
+            data = series.to_numpy().astype(object)
+        else:
+            data = series.astype(object).to_numpy(copy=True)
+        data[missing] = None
+        values.append(data)
+    return zip(*values)
+
+
+def _create_table(connection, table, columns, chunks):
+    """
+    Creates a table and inserts the typed chunks, numbering the rows in file order ('seq').
+
+    Returns:
+        dict: dtype of each column of the typed DataFrames (to restore the fetched rows).
+    """
+    sql_columns = [name for _, name in columns]
+    connection.execute(f"CREATE TABLE {table} (seq INTEGER, {', '.join(sql_columns)})")
+    insert = f"INSERT INTO {table} VALUES ({', '.join('?' * (len(columns) + 1))})"
+
+    dtypes = None
+    seq = 0
+    for chunk in chunks:
+        dtypes = dtypes or {column: chunk[column].dtype for column, _ in columns}
+        connection.executemany(insert, ((seq + row, *values) for row, values in enumerate(_sql_values(chunk, columns))))
+        seq += len(chunk)
+    connection.commit()
+    return dtypes or {}
+
+
+def _frame(rows, columns, dtypes):
+    """
+    Builds a typed DataFrame from fetched rows, with the dtypes of the loaded tables.
+    """
+    names = [column for column, _ in columns]
+    values = zip(*rows) if rows else ([] for _ in names)
+
+    frame = {}
+    for column, data in zip(names, values):
+        data = np.array(data, dtype=object)
+        dtype = dtypes.get(column, np.dtype(object))
+        missing = np.equal(data, None)
+        if pd.api.types.is_datetime64_dtype(dtype):
+            # Exact int64 nanoseconds (NaT is the minimum int64)
+            nanoseconds = np.where(missing, np.iinfo(np.int64).min, data).astype(np.int64)
+            frame[column] = pd.Series(nanoseconds.view("datetime64[ns]")).astype(dtype)
+        elif isinstance(dtype, pd.CategoricalDtype):
+            frame[column] = pd.Categorical(np.where(missing, np.nan, data))
+        else:
+            frame[column] = pd.Series(data).astype(dtype)
+    return pd.DataFrame(frame, columns=names)
+
+
+def _iter_user_batches(cursor, user_position, batch_rows):
+    """
+    Fetches the rows of a query sorted by user in batches of about `batch_rows` rows, without splitting
+    the rows of a user between batches. Yields a single empty batch when the query returns nothing.
+    """
+    carry = []
+    yielded = False
+    while True:
+        rows = cursor.fetchmany(batch_rows)
+        if not rows:
+            break
+        rows = carry + rows
+        cut = len(rows)
+        while cut > 0 and rows[cut - 1][user_position] == rows[-1][user_position]:
+            cut -= 1
+        if cut == 0:
+            carry = rows
+            continue
+        yield rows[:cut]
+        yielded = True
+        carry = rows[cut:]
+    if carry or not yielded:
+        yield carry
+
+
+def run_sql_reconciliation(events_path, backend_path, payment_path, outputs, work_dir=None, cache_dir=None,
+                           memory_limit_mb=512, batch_users=SQL_BATCH_USERS, tolerance_seconds=20,
+                           duplicate_lookback=1, log=print):
+    """
+    Runs the full reconciliation out of core and writes the CSV outputs, identical to the ones
+    of the in-memory pipeline.
+
+    Args:
+        events_path (str): Path to the events JSON file.
+        backend_path (str): Path to the allowance backend table.
+        payment_path (str): Path to the payment schedule backend table.
+        outputs (dict): Paths of the 'discrepancies', 'payment_status', 'payment_summary' and 'duplicates' CSV outputs.
+        work_dir (str, optional): Directory of the database (default: the system
+                                  temporary directory). The files are removed at the end of the run.
+        cache_dir (str, optional): Directory of the calendar index; None builds it in memory only.
+        memory_limit_mb (int): Page cache of the SQL engine, beyond which it spills to temporary files.
+        batch_users (int): Number of users reconciled per batch.
+        tolerance_seconds (int): Maximum distance, in seconds, between duplicate events.
+        duplicate_lookback (int, optional): Number of latest events of each user checked for duplicates (None: all).
+        log (callable): Function used to report the progress.
+
+    Returns:
+        dict: Number of rows written to each output.
+    """
+    if work_dir is not None:
+        os.makedirs(work_dir, exist_ok=True)
+
+    with tempfile.TemporaryDirectory(prefix="reconciliation-", dir=work_dir) as run_dir:
+        connection = _connect(os.path.join(run_dir, "reconciliation.sqlite"), memory_limit_mb)
+        writers = {}
+        try:
+            # Streaming loads of the three inputs
+            event_dtypes = _create_table(connection, "events", EVENT_SQL_COLUMNS, iter_events_chunks(events_path, SQL_CHUNK_ROWS))
+            backend_dtypes = _create_table(connection, "backend", BACKEND_SQL_COLUMNS, (
+                convert_backend_types(chunk, verbose=False) for chunk in pd.read_csv(backend_path, chunksize=SQL_CHUNK_ROWS)
+            ))
+            payment_dtypes = _create_table(connection, "payment", PAYMENT_SQL_COLUMNS, (
+                convert_payment_types(chunk) for chunk in pd.read_csv(payment_path, chunksize=SQL_CHUNK_ROWS)
+            ))
+            connection.execute("CREATE INDEX backend_uuid ON backend (uuid, status)")
+            connection.execute("CREATE INDEX payment_user_id ON payment (user_id)")
+            connection.execute("CREATE INDEX events_user_id ON events (user_id)")
+            log("Input tables loaded into the SQL engine")
+
+            # Calendar index over the range of the dates in use
+            first, last = connection.execute(
+                "SELECT MIN(value), MAX(value) FROM ("
+                "SELECT ts AS value FROM events UNION ALL SELECT updated_at FROM backend)"
+            ).fetchone()
+            calendar = None
+            if first is not None:
+                calendar = load_schedule_calendar(cache_dir, pd.Timestamp(first, unit="ns"), pd.Timestamp(last, unit="ns"))
+
+            writers = {name: CsvBatchWriter(outputs[name], BACKEND_NANOSECOND_COLUMNS) for name in ("discrepancies", "payment_status", "payment_summary", "duplicates")}
+            event_columns = ", ".join(name for _, name in EVENT_SQL_COLUMNS)
+
+            # Comparative and payment analyses, one batch of users at a time
+            cursor = connection.execute(_LATEST_EVENTS_QUERY.format(columns=event_columns))
+            for rows in _iter_user_batches(cursor, 0, batch_users):
+                df_events_latest = _frame(rows, EVENT_SQL_COLUMNS, event_dtypes)
+                df_events_latest["next_expected_payment_date"] = calculate_next_ocurrence_vectorized(
+                    df_events_latest["event.timestamp"],
+                    df_events_latest["allowance.scheduled.frequency"],
+                    df_events_latest["allowance.scheduled.day"],
+                    calendar=calendar
+                )
+
+                # Rows of the backend tables of the users of the batch (a range of ids), in table order
+                user_range = (rows[0][0], rows[-1][0]) if rows else ("", "")
+                df_backend = _frame(connection.execute(
+                    f"SELECT {', '.join(name for _, name in BACKEND_SQL_COLUMNS)} FROM backend "
+                    "WHERE uuid BETWEEN ? AND ? ORDER BY seq", user_range
+                ).fetchall(), BACKEND_SQL_COLUMNS, backend_dtypes)
+                df_payment = _frame(connection.execute(
+                    "SELECT user_id, payment_date FROM payment WHERE user_id BETWEEN ? AND ? ORDER BY seq", user_range
+                ).fetchall(), PAYMENT_SQL_COLUMNS, payment_dtypes)
+
+                df_events_merged = compare_with_backend(df_events_latest, df_backend, calendar)
+                writers["discrepancies"].append(flag_discrepancies(df_events_merged))
+                df_payment_summary = summarize_payment_schedule(df_events_merged, aggregate_payment_schedule(df_payment))
+                writers["payment_status"].append(expand_payment_summary(df_payment_summary, df_payment)[PAYMENT_STATUS_COLUMNS])
+                writers["payment_summary"].append(df_payment_summary[PAYMENT_SUMMARY_COLUMNS])
+
+            # Duplicate events over the compared events of each user and the two before each of them
+            window = None if duplicate_lookback is None else duplicate_lookback + 2
+            cursor = connection.execute(_RECENT_EVENTS_QUERY.format(columns=event_columns), {"window": window})
+            for rows in _iter_user_batches(cursor, 0, (window or 3) * batch_users):
+                df_compare = detect_duplicate_events(
+                    _frame(rows, EVENT_SQL_COLUMNS, event_dtypes), tolerance_seconds, lookback=duplicate_lookback, presorted=True
+                )
+                df_duplicates = df_compare[df_compare["timestamp_duplicated"] == True]
+                writers["duplicates"].append(df_duplicates.drop(columns=["allowance.amount"]))
+        except BaseException:
+            for writer in writers.values():
+                writer.discard()
+            raise
+        finally:
+            connection.close()
+
+        counts = {}
+        for name, writer in writers.items():
+            writer.close()
+            counts[name] = writer.rows
+            log(f"{writer.rows} rows saved to {outputs[name]}")
+        return counts
@@ -0,0 +1,438 @@
+"""
+Tail-following streaming reconciliation of an append-only NDJSON events file.
+
+New lines of the events file are read in micro-batches. Each `allowance.created`/`allowance.edited` event
+updates only the state of its user:
+- a ring buffer with the user's three most recent events, used to flag timestamp duplicates with the rule of
+  `check_duplicate` (same frequency and day as the previous event, within the tolerance);
+- for enabled users, the latest event, whose expected next payment date is calculated again and compared with the backend and
+  payment tables (see `reconcile_user_records`).
+
+The records are appended to an NDJSON output as soon as their batch is processed:
+- 'discrepancy' when a user's reconciliation has a mismatch (next payment day or a payment_date status);
+- 'resolved' when a user that had one reconciles cleanly again;
+- 'duplicate' when a user's newest event duplicates the previous one;
+- 'invalid_event' for lines that are not event objects, or events whose fields can't be typed (e.g. a
+  timestamp that isn't one); the other events of their batch are still processed.
+
+Every batch is a micro-commit: the output is flushed to disk, the state of the users with an event in the batch
+is appended to a state log, then a small checkpoint with the file offset, the output size and the size of the
+state log replaces the previous one. A restart replays the state log up to the checkpointed size, resumes from
+the checkpointed offset and truncates the records written after the last commit, so no record is emitted twice.
+The log is rewritten as a snapshot of the whole state once it holds STATE_LOG_COMPACTION entries per user, so a
+commit costs the users of its batch. Memory is bounded by the batch size and a constant state per user.
+"""
+
+import bisect #For the ordered ring buffers of recent events.
+import json #For the event lines and the output records.
+import os #For the offsets, the output and the checkpoint.
+import pickle #For the checkpointed state.
+import time #For polling the events file.
+
+import numpy as np #For the timestamps of the ring buffers.
+import pandas as pd #For data manipulation and analysis.
+
+from .analysis import aggregate_payment_schedule
+from .joins import anti_join, table_key_index
+from .loading import parse_events
+from .service import json_value, reconcile_user_records
+
+
+# Events that change a user's schedule
+STREAM_EVENT_NAMES = ("allowance.created", "allowance.edited")
+
+# Recent events kept per user (the compared event and the two before it, as `detect_duplicate_events`)
+RING_SIZE = 3
+
+# Version of the checkpoint format
+CHECKPOINT_VERSION = 2
+
+# Entries per user in the state log beyond which it is rewritten as a snapshot
+STATE_LOG_COMPACTION = 4
+
+# Errors of typing an event whose fields have the wrong types (see `parse_events`)
+EVENT_TYPE_ERRORS = (ValueError, TypeError, AttributeError)
+
+# Missing timestamps sort after every other one when looking for duplicates (as NaT in a sort)
+_LAST = np.iinfo(np.int64).max
+
+
+def _event_fields(columns, row):
+    """Fields of a typed event kept as the latest event of its user: (timestamp, name, frequency, day, amount)."""
+    return tuple(json_value(columns[column][row]) for column in (
+        "event.timestamp", "event.name", "allowance.scheduled.frequency", "allowance.scheduled.day", "allowance.amount"
+    ))
+
+
+def _fields_event(user_id, fields):
+    """Event object, in the layout of the events file, of the fields kept by `_event_fields`."""
+    timestamp, name, frequency, day, amount = fields
+    return {
+        "user": {"id": user_id},
+        "event": {"timestamp": timestamp, "name": name},
+        "allowance": {"amount": amount, "scheduled": {"frequency": frequency, "day": day}}
+    }
+
+
+def _transition(before, after):
+    """'before → after' text of two labels, with missing labels as 'nan' (as in `detect_duplicate_events`)."""
+    return f"{'nan' if before is None else before} → {'nan' if after is None else after}"
+
+
+class StreamingReconciler:
+    """
+    Per-user streaming state of the reconciliation, with its checkpoint and output records.
+
+    Args:
+        events_path (str): Path to the append-only NDJSON events file (uncompressed).
+        df_backend (pd.DataFrame): Typed backend table.
+        df_payment (pd.DataFrame): Typed payment schedule table.
+        output_path (str): Path to the NDJSON output of the records.
+        checkpoint_path (str): Path to the checkpoint file.
+        calendar (dict, optional): Schedule calendar to look the payment days up in.
+        tolerance_seconds (float): Maximum time between two duplicated events.
+        log (callable): Function receiving the progress messages.
+    """
+
+    def __init__(self, events_path, df_backend, df_payment, output_path, checkpoint_path,
+                 calendar=None, tolerance_seconds=20, log=print):
+        self.events_path = os.path.abspath(events_path)
+        self.df_backend = df_backend
+        self.df_payment = df_payment
+        self.df_payment_aggregate = aggregate_payment_schedule(df_payment)
+        self.output_path = output_path
+        self.checkpoint_path = checkpoint_path
+        self.calendar = calendar
+        self.tolerance_ns = int(tolerance_seconds * 1e9)
+        self.log = log
+        self._backend_index = table_key_index(df_backend, "uuid")
+        self._disabled = (df_backend["status"] == "disabled").to_numpy(dtype=bool)
+
+        self.offset = 0
+        self.output_size = 0
+        # Per user: recent events [(sort key, arrival, timestamp, frequency, day)], oldest first,
+        # the latest event (timestamp, `_event_fields`) and whether a discrepancy is open
+        self.recent = {}
+        self.latest = {}
+        self.flagged = set()
+        self._arrivals = 0
+        # Users whose state changed since the last micro-commit, and the state log they are appended to
+        self._changed_users = set()
+        self._generation = 0
+        self._state_size = 0
+        self._state_entries = 0
+        self._load_checkpoint()
+
+    def _state_path(self, generation):
+        """Path to a generation of the state log (a compaction starts a new one)."""
+        return f"{self.checkpoint_path}.state-{generation}"
+
+    def _user_state(self, user_id):
+        """State of a user as stored in the state log."""
+        return self.recent.get(user_id), self.latest.get(user_id), user_id in self.flagged
+
+    def _restore_user_state(self, user_id, state):
+        """Restores the state of a user read from the state log."""
+        recent, latest, flagged = state
+        for states, value in ((self.recent, recent), (self.latest, latest)):
+            if value is None:
+                states.pop(user_id, None)
+            else:
+                states[user_id] = value
+        if flagged:
+            self.flagged.add(user_id)
+        else:
+            self.flagged.discard(user_id)
+
+    def _load_checkpoint(self):
+        """Restores the state of the last micro-commit, if any."""
+        if not os.path.exists(self.checkpoint_path):
+            return
+        with open(self.checkpoint_path, "rb") as f:
+            checkpoint = pickle.load(f)
+        if checkpoint.get("version") != CHECKPOINT_VERSION:
+            raise ValueError(f"Unsupported checkpoint {self.checkpoint_path}")
+        if checkpoint["events_path"] != self.events_path:
+            raise ValueError(f"The checkpoint {self.checkpoint_path} follows {checkpoint['events_path']}, not {self.events_path}")
+
+        self.offset = checkpoint["offset"]
+        self.output_size = checkpoint["output_size"]
+        self._arrivals = checkpoint["arrivals"]
+        self._generation = checkpoint["generation"]
+        self._state_size = checkpoint["state_size"]
+
+        # Entries appended after the last micro-commit are dropped, as their batch is processed again
+        state_path = self._state_path(self._generation)
+        if self._state_size:
+            os.truncate(state_path, self._state_size)
+            with open(state_path, "rb") as f:
+                while f.tell() < self._state_size:
+                    for user_id, state in pickle.load(f).items():
+                        self._restore_user_state(user_id, state)
+                        self._state_entries += 1
+        self.log(f"Resuming {self.events_path} from offset {self.offset}")
+
+    def _write_state(self):
+        """
+        Appends the state of the users changed since the last micro-commit to the state log, or rewrites the log
+        as a snapshot of every user (in a new generation, so the committed one stays valid until the checkpoint
+        is replaced).
+        """
+        if not self._changed_users:
+            return
+        # Every user with a state has recent events
+        if self._state_entries + len(self._changed_users) > STATE_LOG_COMPACTION * len(self.recent):
+            self._generation += 1
+            user_ids, mode = list(self.recent), "wb"
+            self._state_entries = 0
+        else:
+            user_ids, mode = self._changed_users, "ab"
+
+        with open(self._state_path(self._generation), mode) as f:
+            pickle.dump({user_id: self._user_state(user_id) for user_id in user_ids}, f, protocol=pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+            self._state_size = f.tell()
+        self._state_entries += len(user_ids)
+        self._changed_users = set()
+
+    def _commit(self, output):
+        """
+        Micro-commit: the records and the state of the changed users are made durable, then the checkpoint is
+        replaced atomically (and a compacted generation of the state log replaces the previous one).
+        """
+        output.flush()
+        os.fsync(output.fileno())
+        self.output_size = output.tell()
+        generation = self._generation
+        self._write_state()
+
+        checkpoint = {
+            "version": CHECKPOINT_VERSION,
+            "events_path": self.events_path,
+            "offset": self.offset,
+            "output_size": self.output_size,
+            "arrivals": self._arrivals,
+            "generation": self._generation,
+            "state_size": self._state_size
+        }
+        temporary_path = f"{self.checkpoint_path}.tmp-{os.getpid()}"
+        with open(temporary_path, "wb") as f:
+            pickle.dump(checkpoint, f, protocol=pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary_path, self.checkpoint_path)
+        if self._generation != generation and os.path.exists(self._state_path(generation)):
+            os.remove(self._state_path(generation))
+
+    def _read_lines(self, f, max_events, final):
+        """
+        Reads up to `max_events` non-blank lines from the offset. A last line without its line end is left
+        for the next batch (it is still being written), unless `final`.
+
+        Returns:
+            tuple: (list of lines, list of the offset after each line, new offset)
+        """
+        f.seek(self.offset)
+        lines, ends = [], []
+        offset = self.offset
+        while len(lines) < max_events:
+            line = f.readline()
+            if not line or (not line.endswith(b"\n") and not final):
+                break
+            offset += len(line)
+            if line.strip():
+                lines.append(line)
+                ends.append(offset)
+        return lines, ends, offset
+
+    def _add_recent(self, user_id, timestamp, frequency, day):
+        """
+        Adds an event to the ring buffer of its user, ordered by timestamp and arrival.
+
+        Returns:
+            bool: Whether the event is the newest of the buffer.
+        """
+        key = _LAST if timestamp == np.iinfo(np.int64).min else timestamp
+        recent = self.recent.setdefault(user_id, [])
+        entry = (key, self._arrivals, timestamp, frequency, day)
+        self._arrivals += 1
+        self._changed_users.add(user_id)
+        bisect.insort(recent, entry)
+        if len(recent) > RING_SIZE:
+            del recent[0]
+        return recent[-1] is entry
+
+    def _duplicate_record(self, user_id, offset, name):
+        """Record of the newest event of a user if it duplicates the previous one, else None."""
+        recent = self.recent[user_id]
+        if len(recent) < 2:
+            return None
+        _, _, timestamp, frequency, day = recent[-1]
+        _, _, prev_timestamp, prev_frequency, prev_day = recent[-2]
+        missing = np.iinfo(np.int64).min
+        if (frequency is None or day is None or frequency != prev_frequency or day != prev_day
+                or timestamp == missing or prev_timestamp == missing or abs(timestamp - prev_timestamp) > self.tolerance_ns):
+            return None
+
+        preprev_frequency, preprev_day = (recent[-3][3], recent[-3][4]) if len(recent) > 2 else (None, None)
+        return {
+            "kind": "duplicate",
+            "offset": offset,
+            "user_id": user_id,
+            "timestamp": json_value(pd.Timestamp(timestamp)),
+            "name": name,
+            "frequency": frequency,
+            "day": day,
+            "prev_timestamp": json_value(pd.Timestamp(prev_timestamp)),
+            "frequency_transition": _transition(preprev_frequency, prev_frequency),
+            "day_transition": _transition(preprev_day, prev_day)
+        }
+
+    def _parse_events(self, events, offsets):
+        """
+        Types the events of a batch. When the batch can't be typed, each event is typed on its own, and the
+        events that can't be (e.g. with a timestamp that isn't one) get an 'invalid_event' record.
+
+        Returns:
+            tuple: (typed events or None, offset of the line of each typed event, list of 'invalid_event' records)
+        """
+        try:
+            return parse_events(events), offsets, []
+        except EVENT_TYPE_ERRORS:
+            pass
+
+        frames, parsed_offsets, records = [], [], []
+        for event, offset in zip(events, offsets):
+            try:
+                frames.append(parse_events([event]))
+            except EVENT_TYPE_ERRORS as e:
+                records.append({"kind": "invalid_event", "offset": offset, "error": str(e)})
+                continue
+            parsed_offsets.append(offset)
+        return (pd.concat(frames, ignore_index=True) if frames else None), parsed_offsets, records
+
+    def process_lines(self, lines, ends):
+        """
+        Updates the state with a batch of event lines and returns the records to emit.
+
+        Args:
+            lines (list of bytes): NDJSON lines.
+            ends (list of int): Offset of the end of each line in the events file.
+
+        Returns:
+            list of dict: The records of the batch, in the order of the events.
+        """
+        records = []
+        events, offsets = [], []
+        for line, end in zip(lines, ends):
+            try:
+                event = json.loads(line)
+                if not isinstance(event, dict):
+                    raise ValueError("not an event object")
+            except ValueError as e:
+                records.append({"kind": "invalid_event", "offset": end, "error": str(e)})
+                continue
+            details = event.get("event")
+            if isinstance(details, dict) and details.get("name") in STREAM_EVENT_NAMES:
+                events.append(event)
+                offsets.append(end)
+        if not events:
+            return records
+
+        df_events, offsets, invalid = self._parse_events(events, offsets)
+        records.extend(invalid)
+        if df_events is None:
+            return records
+        # As in the pipeline, the duplicates are flagged over every event and disabled users are not reconciled
+        enabled = anti_join(df_events["user.id"], self._backend_index, rows=self._disabled)
+
+        # Events in file order: ring buffers, duplicates and the latest event of each user
+        changed = {}
+        timestamps = df_events["event.timestamp"].to_numpy(dtype="datetime64[ns]").view(np.int64)
+        columns = {column: df_events[column].to_numpy(dtype=object) for column in (
+            "user.id", "event.timestamp", "event.name", "allowance.scheduled.frequency", "allowance.scheduled.day",
+            "allowance.amount"
+        )}
+        for row, timestamp in enumerate(timestamps):
+            user_id = json_value(columns["user.id"][row])
+            if user_id is None:
+                continue
+            offset = offsets[row]
+            frequency = json_value(columns["allowance.scheduled.frequency"][row])
+            day = json_value(columns["allowance.scheduled.day"][row])
+
+            if self._add_recent(user_id, int(timestamp), frequency, day):
+                duplicate = self._duplicate_record(user_id, offset, json_value(columns["event.name"][row]))
+                if duplicate is not None:
+                    records.append(duplicate)
+
+            # Only a strictly later event replaces the latest one (missing timestamps are the oldest)
+            if enabled[row] and (user_id not in self.latest or timestamp > self.latest[user_id][0]):
+                self.latest[user_id] = (int(timestamp), _event_fields(columns, row))
+                changed[user_id] = offset
+
+        if changed:
+            records.extend(self._reconcile(changed))
+        return records
+
+    def _reconcile(self, changed):
+        """Reconciles the users whose latest event changed, returning their discrepancy or resolved records."""
+        df_events_latest = parse_events([_fields_event(user_id, self.latest[user_id][1]) for user_id in changed])
+        user_records = reconcile_user_records(
+            df_events_latest, self.df_backend, self.df_payment, self.calendar, self.df_payment_aggregate
+        )
+
+        records = []
+        for user_id, offset in sorted(changed.items(), key=lambda item: item[1]):
+            record = user_records[user_id]
+            mismatch = record["discrepancy"] or any(
+                payment["payment_date_status"] != "correct payment date" for payment in record["payments"]
+            )
+            if mismatch:
+                self.flagged.add(user_id)
+                records.append({"kind": "discrepancy", "offset": offset, **record})
+            elif user_id in self.flagged:
+                self.flagged.discard(user_id)
+                records.append({"kind": "resolved", "offset": offset, **record})
+        return records
+
+    def run(self, follow=True, batch_events=1_000, poll_interval=0.5):
+        """
+        Processes the events file from the checkpointed offset, one micro-commit per batch.
+
+        Args:
+            follow (bool): Whether to keep following the file for new lines; False stops at its end.
+            batch_events (int): Maximum number of lines per batch.
+            poll_interval (float): Seconds between two checks for new lines when the file has none.
+
+        Returns:
+            dict: Number of lines and records of each kind processed by this run.
+        """
+        counts = {"lines": 0, "discrepancy": 0, "resolved": 0, "duplicate": 0, "invalid_event": 0}
+
+        # Records written after the last micro-commit are dropped, as their batch is processed again
+        if os.path.exists(self.output_path) and os.path.getsize(self.output_path) > self.output_size:
+            os.truncate(self.output_path, self.output_size)
+
+        with open(self.events_path, "rb") as events, open(self.output_path, "a", encoding="utf-8") as output:
+            while True:
+                if os.fstat(events.fileno()).st_size < self.offset:
+                    raise ValueError(f"{self.events_path} is shorter than the checkpointed offset {self.offset} (truncated or replaced)")
+
+                lines, ends, offset = self._read_lines(events, batch_events, final=not follow)
+                if offset == self.offset:
+                    if not follow:
+                        return counts
+                    time.sleep(poll_interval)
+                    continue
+
+                records = self.process_lines(lines, ends)
+                for record in records:
+                    output.write(json.dumps(record) + "\n")
+                    counts[record["kind"]] += 1
+                counts["lines"] += len(lines)
+                self.offset = offset
+                self._commit(output)
+                if records:
+                    self.log(f"Offset {offset}: {len(lines)} lines, {len(records)} records")
@@ -0,0 +1,241 @@
+"""
+Seeded generator of synthetic input files with the shape of the sample data, at any size.
+
+The distributions follow the sample files: most users only create their allowance, the others edit it
+a few times (often seconds apart, which produces duplicate events), about a quarter of the users are
+disabled, 'updated_at' mixes ISO-8601 strings and Unix timestamps, and a few users have duplicated or
+missing rows in the payment schedule table.
+"""
+
+import os #For the output paths.
+import uuid #For the user ids.
+import numpy as np #For drawing the synthetic data.
+import pandas as pd #For formatting and writing the tables.
+
+from .pipeline import BACKEND_FILE, EVENTS_FILE, EVENTS_NDJSON_FILE, PAYMENT_SCHEDULE_FILE
+from .schedule_engine import calculate_incremented_date_vectorized
+
+
+# Users in the sample files (size tier 1 of the benchmarks)
+SAMPLE_USERS = 2882
+
+# Period covered by the events of the sample
+FIRST_EVENT = np.datetime64("2024-07-25T00:00:00")
+LAST_EVENT = np.datetime64("2024-12-03T05:00:00")
+
+# Schedules of the events and their frequencies in the sample
+FREQUENCIES = ["weekly", "biweekly", "monthly", "daily"]
+FREQUENCY_WEIGHTS = [0.41, 0.36, 0.19, 0.04]
+WEEK_DAYS = ["friday", "monday", "thursday", "sunday", "saturday", "wednesday", "tuesday"]
+WEEK_DAY_WEIGHTS = [0.40, 0.19, 0.10, 0.10, 0.09, 0.08, 0.04]
+MONTHLY_DAYS = ["first_day", "fifteenth_day"]
+MONTHLY_DAY_WEIGHTS = [0.63, 0.37]
+AMOUNTS = [5, 10, 15, 20, 25, 50]
+
+# Shares of users and rows with each trait
+DISABLED_SHARE = 0.26
+EDITED_SHARE = 0.34
+REPEATED_EDIT_SHARE = 0.6
+NEVER_UPDATED_SHARE = 0.22
+STALE_BACKEND_SHARE = 0.15
+WRONG_NEXT_DAY_SHARE = 0.05
+DISABLED_PAYMENT_SHARE = 0.01
+WRONG_PAYMENT_DATE_SHARE = 0.10
+DUPLICATED_PAYMENT_SHARE = 0.005
+
+
+def _draw_schedules(rng, size):
+    """
+    Draws `size` (frequency, day) schedules with the frequencies of the sample.
+    """
+    frequency = rng.choice(FREQUENCIES, size=size, p=FREQUENCY_WEIGHTS).astype(object)
+    day = rng.choice(WEEK_DAYS, size=size, p=WEEK_DAY_WEIGHTS).astype(object)
+    monthly = frequency == "monthly"
+    day[monthly] = rng.choice(MONTHLY_DAYS, size=monthly.sum(), p=MONTHLY_DAY_WEIGHTS)
+    day[frequency == "daily"] = "daily"
+    return frequency, day
+
+
+def _format_event_timestamps(timestamps):
+    """
+    Formats timestamps as in the events file: 'YYYY-MM-DD H:MM:SS', without a leading zero in the hour.
+    """
+    text = pd.Series(np.datetime_as_string(timestamps, unit="s"))
+    return text.str.replace("T0", " ", regex=False).str.replace("T", " ", regex=False)
+
+
+def generate_events(rng, user_ids):
+    """
+    Draws the event history of each user: one 'allowance.created' event followed, for some users, by
+    'allowance.edited' events. Edits are often seconds apart and repeat the previous schedule
+    (duplicate events), otherwise they are days apart and change it.
+
+    Args:
+        rng (np.random.Generator): Random generator.
+        user_ids (np.ndarray): Ids of the users.
+
+    Returns:
+        pd.DataFrame: The events, sorted by user and timestamp, with the columns of the typed events table.
+    """
+    n_users = len(user_ids)
+    edits = np.where(rng.random(n_users) < EDITED_SHARE, 2 * rng.geometric(0.55, n_users) - (rng.random(n_users) < 0.1), 0)
+    events_per_user = 1 + edits
+    user = np.repeat(np.arange(n_users), events_per_user)
+    first_of_user = np.repeat(np.cumsum(events_per_user) - events_per_user, events_per_user)
+    is_created = np.arange(len(user)) == first_of_user
+
+    # Creation time of each user, then gaps of a few seconds (repeated edits) or of hours to weeks
+    span = int((LAST_EVENT - FIRST_EVENT) / np.timedelta64(1, "s"))
+    created = FIRST_EVENT + rng.integers(0, span, n_users).astype("timedelta64[s]")
+    repeated = ~is_created & (rng.random(len(user)) < REPEATED_EDIT_SHARE)
+    gap = np.where(repeated, rng.integers(1, 25, len(user)), rng.exponential(4 * 86400, len(user)).astype(np.int64))
+    gap[is_created] = 0
+    elapsed = np.cumsum(gap)
+    offset = elapsed - elapsed[first_of_user]
+    timestamps = np.minimum(created[user] + offset.astype("timedelta64[s]"), LAST_EVENT)
+
+    # Schedules: repeated edits keep the schedule of the last event that wasn't repeated
+    source = np.maximum.accumulate(np.where(repeated, 0, np.arange(len(user))))
+    frequency, day = _draw_schedules(rng, len(user))
+    amount = rng.choice(AMOUNTS, len(user))
+    frequency, day, amount = frequency[source], day[source], amount[source]
+
+    return pd.DataFrame({
+        "user.id": user_ids[user],
+        "event.timestamp": timestamps,
+        "event.name": np.where(is_created, "allowance.created", "allowance.edited"),
+        "allowance.scheduled.frequency": frequency,
+        "allowance.scheduled.day": day,
+        "allowance.amount": amount
+    })
+
+
+def generate_backend_tables(rng, events):
+    """
+    Draws the allowance backend and payment schedule tables of the users of `events`.
+
+    The backend keeps the schedule of the latest event of each user (or, for some users, of a previous event),
+    'updated_at' is a Unix timestamp equal to 'creation_date' for users never updated and an ISO-8601 string
+    otherwise, and 'next_payment_day' is the next day of the schedule after 'updated_at' (with some errors).
+    The payment schedule table has a row for every enabled user (and a few disabled ones), some with wrong
+    or duplicated payment dates.
+
+    Args:
+        rng (np.random.Generator): Random generator.
+        events (pd.DataFrame): Output of `generate_events`.
+
+    Returns:
+        tuple: (allowance backend table, payment schedule table) as written to the CSV files.
+    """
+    first = events.drop_duplicates("user.id", keep="first").reset_index(drop=True)
+    last = events.drop_duplicates("user.id", keep="last").reset_index(drop=True)
+    n_users = len(first)
+
+    # Schedule of the backend: the latest one, or a stale one for some users
+    stale = rng.random(n_users) < STALE_BACKEND_SHARE
+    frequency = np.where(stale, first["allowance.scheduled.frequency"], last["allowance.scheduled.frequency"])
+    day = np.where(stale, first["allowance.scheduled.day"], last["allowance.scheduled.day"])
+
+    # updated_at: the time of the latest event plus a processing delay (seconds, sometimes days)
+    delay = np.where(rng.random(n_users) < 0.8, rng.integers(0, 60, n_users), rng.integers(86400, 5 * 86400, n_users))
+    nanoseconds = rng.integers(0, 10 ** 9, n_users)
+    created_at = first["event.timestamp"].to_numpy().astype("datetime64[ns]")
+    updated_at = last["event.timestamp"].to_numpy().astype("datetime64[ns]") + (delay * 10 ** 9 + nanoseconds).astype("timedelta64[ns]")
+    # Users never updated only have their creation event (NEVER_UPDATED_SHARE of all users)
+    single_event = last["event.timestamp"].to_numpy() == first["event.timestamp"].to_numpy()
+    never_updated = single_event & (rng.random(n_users) < NEVER_UPDATED_SHARE / (1 - EDITED_SHARE))
+    updated_at[never_updated] = created_at[never_updated]
+
+    next_payment_day = np.asarray(calculate_incremented_date_vectorized(updated_at, frequency, day).fillna(1), dtype=np.int64)
+    creation_date = created_at.astype("datetime64[s]").astype(np.int64)
+    updated_at = np.where(
+        never_updated,
+        creation_date.astype(str),
+        np.char.add(np.datetime_as_string(updated_at, unit="ns"), "Z")
+    )
+    wrong_day = rng.random(n_users) < WRONG_NEXT_DAY_SHARE
+    next_payment_day[wrong_day] = rng.integers(1, 29, wrong_day.sum())
+
+    status = np.where(rng.random(n_users) < DISABLED_SHARE, "disabled", "enabled")
+    backend = pd.DataFrame({
+        "uuid": first["user.id"],
+        "creation_date": creation_date,
+        "frequency": frequency,
+        "day": day,
+        "updated_at": updated_at,
+        "next_payment_day": next_payment_day,
+        "status": status
+    })
+
+    # Payment schedule: enabled users and a few disabled ones, some wrong dates, a few duplicated users with another date
+    scheduled = np.flatnonzero((status == "enabled") | (rng.random(n_users) < DISABLED_PAYMENT_SHARE))
+    payment_date = next_payment_day[scheduled].copy()
+    wrong_date = rng.random(len(scheduled)) < WRONG_PAYMENT_DATE_SHARE
+    payment_date[wrong_date] = rng.integers(1, 29, wrong_date.sum())
+    duplicated = scheduled[rng.random(len(scheduled)) < DUPLICATED_PAYMENT_SHARE]
+    payment = pd.DataFrame({
+        "user_id": np.concatenate([first["user.id"].to_numpy()[scheduled], first["user.id"].to_numpy()[duplicated]]),
+        "payment_date": np.concatenate([payment_date, rng.integers(1, 29, len(duplicated))])
+    })
+
+    return backend, payment.iloc[rng.permutation(len(payment))].reset_index(drop=True)
+
+
+def write_events_file(events, path, events_format="json"):
+    """
+    Writes the events as a JSON array (or NDJSON) with the nested layout of the events file.
+    The objects are formatted column by column, as the file can hold millions of events.
+
+    Args:
+        events (pd.DataFrame): Output of `generate_events`.
+        path (str): Path to the events file.
+        events_format (str): 'json' for a JSON array, 'ndjson' for one object per line.
+    """
+    objects = (
+        '{"user": {"id": "' + events["user.id"].astype(str)
+        + '"}, "event": {"timestamp": "' + _format_event_timestamps(events["event.timestamp"].to_numpy())
+        + '", "name": "' + events["event.name"].astype(str)
+        + '"}, "allowance": {"scheduled": {"frequency": "' + events["allowance.scheduled.frequency"].astype(str)
+        + '", "day": "' + events["allowance.scheduled.day"].astype(str)
+        + '"}, "amount": ' + events["allowance.amount"].astype(str) + '}}'
+    )
+    with open(path, "w", encoding="utf-8") as f:
+        if events_format == "ndjson":
+            f.writelines(objects + "\n")
+            return
+        f.write("[\n")
+        f.write(",\n".join(objects))
+        f.write("\n]\n")
+
+
+def generate_dataset(output_dir, n_users=SAMPLE_USERS, seed=0, events_format="json"):
+    """
+    Writes a synthetic set of the three input files, with their default names, to `output_dir`.
+    The same seed and number of users always produce the same files.
+
+    Args:
+        output_dir (str): Directory of the files.
+        n_users (int): Number of users.
+        seed (int): Seed of the random generator.
+        events_format (str): Format of the events file: 'json' (EVENTS_FILE) or 'ndjson' (EVENTS_NDJSON_FILE).
+
+    Returns:
+        dict: Paths of the files written ('events', 'backend' and 'payment'), 'n_users' and 'n_events'.
+    """
+    rng = np.random.default_rng(seed)
+    user_ids = np.array([str(uuid.UUID(bytes=rng.bytes(16), version=4)) for _ in range(n_users)], dtype=object)
+
+    events = generate_events(rng, user_ids)
+    backend, payment = generate_backend_tables(rng, events)
+
+    os.makedirs(output_dir, exist_ok=True)
+    paths = {
+        "events": os.path.join(output_dir, EVENTS_NDJSON_FILE if events_format == "ndjson" else EVENTS_FILE),
+        "backend": os.path.join(output_dir, BACKEND_FILE),
+        "payment": os.path.join(output_dir, PAYMENT_SCHEDULE_FILE)
+    }
+    write_events_file(events, paths["events"], events_format)
+    backend.to_csv(paths["backend"], index=False)
+    payment.to_csv(paths["payment"], index=False)
+
+    return {**paths, "n_users": n_users, "n_events": len(events)}